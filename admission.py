@@ -0,0 +1,277 @@
+"""
+Admission control for the LLM pipeline.
+
+Each worker process admits at most ADMISSION_MAX_IN_FLIGHT pipeline requests
+at a time. Their estimated token cost together may not exceed
+ADMISSION_MAX_TOKENS_IN_FLIGHT. A request's cost is its prompt budget plus
+its answer's max_tokens: PROMPT_INPUT_BUDGET for a search and
+ADMISSION_CONVERSATION_PROMPT_TOKENS for a conversation, once per query of a
+batch.
+
+Requests that do not fit wait in a priority queue. They are ordered by their
+API key's tier (ADMISSION_TIER_PRIORITY) and then by arrival. A request is
+refused at once, with a 503 and a Retry-After header, in two cases: the
+queue already holds ADMISSION_QUEUE_SIZE requests, or its estimated wait is
+longer than ADMISSION_MAX_WAIT seconds. The wait is estimated from the
+recent service time. A request that has waited ADMISSION_MAX_WAIT seconds
+without being admitted is refused the same way. Overload therefore turns
+into fast refusals, while the admitted requests keep the upstreams busy at
+capacity.
+
+A waiting request holds a server thread. GUNICORN_THREADS should therefore
+cover ADMISSION_MAX_IN_FLIGHT plus ADMISSION_QUEUE_SIZE, with a few threads
+left for probes (see gunicorn.conf.py). The stage pool in stage_runner.py is
+sized from ADMISSION_MAX_IN_FLIGHT in the same way, so admitted requests never
+wait for a stage thread.
+"""
+import os
+import json
+import math
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+from metrics import record_stage, ADMISSION_IN_FLIGHT, ADMISSION_QUEUED, ADMISSION_REJECTIONS
+from prompt_builder import PROMPT_INPUT_BUDGET
+
+# Admission control configuration
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "true").lower() in ("1", "true", "yes")
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", "8"))
+ADMISSION_MAX_TOKENS_IN_FLIGHT = int(os.environ.get("ADMISSION_MAX_TOKENS_IN_FLIGHT", "80000"))
+ADMISSION_QUEUE_SIZE = int(os.environ.get("ADMISSION_QUEUE_SIZE", "16"))
+ADMISSION_MAX_WAIT = float(os.environ.get("ADMISSION_MAX_WAIT", "10"))
+# The service time assumed before any request has finished
+ADMISSION_INITIAL_SERVICE_SECONDS = float(os.environ.get("ADMISSION_INITIAL_SERVICE_SECONDS", "5"))
+ADMISSION_ANSWER_MAX_TOKENS = int(os.environ.get("ADMISSION_ANSWER_MAX_TOKENS", "3000"))
+ADMISSION_CONVERSATION_PROMPT_TOKENS = int(os.environ.get("ADMISSION_CONVERSATION_PROMPT_TOKENS", "2500"))
+
+# Lower is admitted first, e.g. ADMISSION_TIER_PRIORITY='{"partner": 0, "default": 1}'
+ADMISSION_TIER_PRIORITY = {"default": 1}
+ADMISSION_TIER_PRIORITY.update(json.loads(os.environ.get("ADMISSION_TIER_PRIORITY", "{}")))
+
+# Weight of the latest request in the service time average
+_SERVICE_TIME_SMOOTHING = 0.2
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is refused; retry_after is the suggested wait in whole seconds."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"Request not admitted ({reason}); retry after {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def estimate_cost(query_types: list) -> int:
+    """
+    Parameters:
+    query_types (list): "search", "conversation" or None (not known yet) for each query of the request.
+
+    Returns:
+    int: The tokens the request is expected to use; unknown queries are costed as searches.
+    """
+    prompt_tokens = sum(ADMISSION_CONVERSATION_PROMPT_TOKENS if query_type == "conversation" else PROMPT_INPUT_BUDGET
+                        for query_type in query_types)
+    return prompt_tokens + ADMISSION_ANSWER_MAX_TOKENS * len(query_types)
+
+
+class Ticket:
+    """An admitted request's share of the capacity, returned with AdmissionController.release."""
+
+    __slots__ = ("tier", "cost", "admitted_at")
+
+    def __init__(self, tier: str, cost: int):
+        self.tier = tier
+        self.cost = cost
+        self.admitted_at = time.monotonic()
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "ticket", "granted", "cancelled", "event", "future", "loop")
+
+    def __init__(self, priority: int, seq: int, ticket: Ticket):
+        self.priority = priority
+        self.seq = seq
+        self.ticket = ticket
+        self.granted = False
+        self.cancelled = False
+        self.event = None
+        self.future = None
+        self.loop = None
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    def wake(self):
+        if self.event is not None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(True)
+
+
+class AdmissionController:
+    """
+    Admit requests within this process's in-flight and token limits, queueing the rest by tier.
+
+    Parameters:
+    max_in_flight (int): Requests admitted at once.
+    max_tokens_in_flight (int): Estimated tokens of the admitted requests together.
+    queue_size (int): Requests that may wait for admission.
+    max_wait (float): Seconds a request may wait.
+    """
+
+    def __init__(self, max_in_flight: int = ADMISSION_MAX_IN_FLIGHT,
+                 max_tokens_in_flight: int = ADMISSION_MAX_TOKENS_IN_FLIGHT,
+                 queue_size: int = ADMISSION_QUEUE_SIZE, max_wait: float = ADMISSION_MAX_WAIT):
+        self.max_in_flight = max_in_flight
+        self.max_tokens_in_flight = max_tokens_in_flight
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.tokens_in_flight = 0
+        self.service_seconds = ADMISSION_INITIAL_SERVICE_SECONDS
+        self._queue = []
+        self._waiting = 0
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def _fits(self, cost: int) -> bool:
+        if self.in_flight >= self.max_in_flight:
+            return False
+        # A request costing more than the token limit still runs, alone
+        return self.in_flight == 0 or self.tokens_in_flight + cost <= self.max_tokens_in_flight
+
+    def _admit(self, ticket: Ticket):
+        self.in_flight += 1
+        self.tokens_in_flight += ticket.cost
+        ticket.admitted_at = time.monotonic()
+        ADMISSION_IN_FLIGHT.inc()
+
+    def _estimated_wait(self, ahead: int) -> float:
+        # The requests ahead finish at about max_in_flight per service time
+        return (ahead + 1) * self.service_seconds / self.max_in_flight
+
+    def _enter(self, tier: str, cost: int):
+        """Admit at once, or queue a waiter; called with the lock held."""
+        ticket = Ticket(tier, cost)
+        priority = ADMISSION_TIER_PRIORITY.get(tier, ADMISSION_TIER_PRIORITY["default"])
+        if self._waiting == 0 and self._fits(cost):
+            self._admit(ticket)
+            return ticket, None
+        if self._waiting >= self.queue_size:
+            self._reject(tier, "queue_full", self._estimated_wait(self._waiting))
+        ahead = sum(1 for waiter in self._queue if not waiter.cancelled and waiter.priority <= priority)
+        wait = self._estimated_wait(ahead)
+        if wait > self.max_wait:
+            self._reject(tier, "wait", wait)
+        waiter = _Waiter(priority, next(self._seq), ticket)
+        heapq.heappush(self._queue, waiter)
+        self._waiting += 1
+        ADMISSION_QUEUED.inc()
+        return ticket, waiter
+
+    def _reject(self, tier: str, reason: str, wait: float):
+        ADMISSION_REJECTIONS.labels(tier, reason).inc()
+        raise AdmissionRejected(reason, max(1, math.ceil(wait)))
+
+    def _leave_queue(self, waiter: _Waiter):
+        # Called with the lock held; the waiter stays in the heap and is skipped when it reaches the head
+        waiter.cancelled = True
+        self._waiting -= 1
+        ADMISSION_QUEUED.dec()
+        # It may have been the head that kept smaller requests behind it waiting
+        self._grant()
+
+    def _grant(self):
+        # Admit waiters in order while the one at the head fits; called with the lock held
+        while self._queue:
+            head = self._queue[0]
+            if head.cancelled:
+                heapq.heappop(self._queue)
+                continue
+            if not self._fits(head.ticket.cost):
+                return
+            heapq.heappop(self._queue)
+            self._waiting -= 1
+            ADMISSION_QUEUED.dec()
+            self._admit(head.ticket)
+            head.granted = True
+            head.wake()
+
+    def _timed_out(self, waiter: _Waiter):
+        with self._lock:
+            if waiter.granted:
+                return
+            self._leave_queue(waiter)
+        self._reject(waiter.ticket.tier, "timeout", self.service_seconds)
+
+    def acquire(self, tier: str, cost: int) -> Ticket:
+        """
+        Admit a request, waiting up to max_wait seconds for capacity.
+
+        Raises:
+        AdmissionRejected: If the queue is full, the wait would be too long, or it was.
+        """
+        start = time.monotonic()
+        with self._lock:
+            ticket, waiter = self._enter(tier, cost)
+            if waiter is not None:
+                waiter.event = threading.Event()
+        if waiter is not None:
+            if not waiter.event.wait(self.max_wait):
+                self._timed_out(waiter)
+            record_stage("admission_wait", time.monotonic() - start)
+        return ticket
+
+    async def acquire_async(self, tier: str, cost: int) -> Ticket:
+        """acquire for asyncio handlers."""
+        start = time.monotonic()
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            ticket, waiter = self._enter(tier, cost)
+            if waiter is not None:
+                waiter.loop = loop
+                waiter.future = loop.create_future()
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), self.max_wait)
+            except asyncio.TimeoutError:
+                self._timed_out(waiter)
+            except asyncio.CancelledError:
+                # The client went away while waiting; give back the slot if it was granted meanwhile
+                with self._lock:
+                    if not waiter.granted:
+                        self._leave_queue(waiter)
+                        raise
+                self.release(ticket)
+                raise
+            record_stage("admission_wait", time.monotonic() - start)
+        return ticket
+
+    def release(self, ticket: Ticket):
+        """Return an admitted request's capacity and admit whoever is next."""
+        seconds = time.monotonic() - ticket.admitted_at
+        with self._lock:
+            self.in_flight -= 1
+            self.tokens_in_flight -= ticket.cost
+            self.service_seconds += _SERVICE_TIME_SMOOTHING * (seconds - self.service_seconds)
+            ADMISSION_IN_FLIGHT.dec()
+            self._grant()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "tokens_in_flight": self.tokens_in_flight,
+                "waiting": self._waiting,
+                "service_seconds": round(self.service_seconds, 3),
+            }
+
+
+admission = AdmissionController()
@@ -0,0 +1,222 @@
+import os
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+from local_classifier import normalize_query, vectorize
+
+logger = logging.getLogger(__name__)
+
+# Answer cache configuration
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", "1024"))
+ANSWER_CACHE_TTL = int(os.environ.get("ANSWER_CACHE_TTL", "3600"))
+# Near-duplicate lookups are off by default; only identical normalized queries share an answer
+ANSWER_CACHE_SEMANTIC = os.environ.get("ANSWER_CACHE_SEMANTIC", "false").lower() in ("1", "true", "yes")
+# Cosine similarity of hashed n-gram vectors above which two queries count as the same question
+ANSWER_CACHE_SIMILARITY = float(os.environ.get("ANSWER_CACHE_SIMILARITY", "0.85"))
+# Each cached answer keeps a vector of this many float32 values
+ANSWER_CACHE_DIMENSIONS = int(os.environ.get("ANSWER_CACHE_DIMENSIONS", "2048"))
+
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9+']+")
+
+# Words that can differ between two phrasings of the same question
+_FILLER_WORDS = frozenset("""
+a an the of in on at to for from by with about and or is are was were be been do does did
+what which tell me can could would you please give explain describe some any there i my
+""".split())
+
+
+def key_terms(normalized: str) -> frozenset:
+    """
+    Returns:
+    frozenset: The query's content words and numbers, singular; near-duplicate
+    queries must have the same ones.
+    """
+    terms = set()
+    for token in _TOKEN_PATTERN.findall(normalized):
+        if token in _FILLER_WORDS:
+            continue
+        # Numbers, including decades like "1970s", must match exactly
+        if not any(char.isdigit() for char in token) and len(token) > 3 and token.endswith("s"):
+            token = token[:-1]
+        terms.add(token)
+    return frozenset(terms)
+
+
+class AnswerIndex:
+    """
+    A bounded LRU map from normalized queries to answers, with a fixed-size
+    vector matrix for near-duplicate lookups.
+
+    A near duplicate must be similar enough and have the same key_terms, so
+    queries that differ only in a name, a number or a year never share an
+    answer, however similar their character n-grams are.
+
+    Memory is bounded by size * dimensions float32 values plus the answers
+    themselves. Expired entries are never returned and their slots are
+    reused first.
+    """
+
+    def __init__(self, size=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL, dimensions=ANSWER_CACHE_DIMENSIONS):
+        self.size = size
+        self.ttl = ttl
+        self.dimensions = dimensions
+        self.vectors = np.zeros((size, dimensions), dtype=np.float32)
+        self.expires = np.zeros(size, dtype=np.float64)
+        self.answers = [None] * size
+        self.queries = [None] * size
+        self.terms = [None] * size
+        # Normalized query to slot, least recently used first
+        self.slots = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, query: str, threshold: float):
+        """
+        Parameters:
+        query (str): The user's query.
+        threshold (float): Cosine similarity a near duplicate needs; None, or above 1, for exact matches only.
+
+        Returns:
+        tuple: The cached answer and "exact" or "semantic", or (None, None) on a miss.
+        """
+        normalized = normalize_query(query)
+        now = time.monotonic()
+        with self.lock:
+            slot = self.slots.get(normalized)
+            if slot is not None:
+                if self.expires[slot] > now:
+                    self.slots.move_to_end(normalized)
+                    return self.answers[slot], "exact"
+                self._evict(slot)
+
+        if threshold is None or threshold > 1:
+            return None, None
+        vector = vectorize(normalized, self.dimensions)
+        terms = key_terms(normalized)
+        with self.lock:
+            if not self.slots:
+                return None, None
+            similarities = self.vectors @ vector
+            similarities[self.expires <= now] = -1.0
+            for slot in self.slots.values():
+                if self.terms[slot] != terms:
+                    similarities[slot] = -1.0
+            slot = int(np.argmax(similarities))
+            if similarities[slot] < threshold:
+                return None, None
+            self.slots.move_to_end(self.queries[slot])
+            return self.answers[slot], "semantic"
+
+    def put(self, query: str, answer):
+        normalized = normalize_query(query)
+        vector = vectorize(normalized, self.dimensions)
+        now = time.monotonic()
+        with self.lock:
+            slot = self.slots.get(normalized)
+            if slot is None:
+                slot = self._free_slot(now)
+            self.slots[normalized] = slot
+            self.slots.move_to_end(normalized)
+            self.queries[slot] = normalized
+            self.terms[slot] = key_terms(normalized)
+            self.answers[slot] = answer
+            self.vectors[slot] = vector
+            self.expires[slot] = now + self.ttl
+
+    def clear(self):
+        with self.lock:
+            for slot in list(self.slots.values()):
+                self._evict(slot)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def _free_slot(self, now):
+        if len(self.slots) < self.size:
+            used = set(self.slots.values())
+            return next(slot for slot in range(self.size) if slot not in used)
+        expired = np.flatnonzero(self.expires <= now)
+        slot = int(expired[0]) if len(expired) else next(iter(self.slots.values()))
+        self._evict(slot)
+        return slot
+
+    def _evict(self, slot):
+        self.slots.pop(self.queries[slot], None)
+        self.queries[slot] = None
+        self.terms[slot] = None
+        self.answers[slot] = None
+        self.vectors[slot] = 0.0
+        self.expires[slot] = 0.0
+
+
+# One index per kind of answer ("search" responses and "conversation" replies)
+_indexes = {}
+_indexes_lock = threading.Lock()
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _get_index(kind: str) -> AnswerIndex:
+    with _indexes_lock:
+        index = _indexes.get(kind)
+        if index is None:
+            index = _indexes[kind] = AnswerIndex()
+        return index
+
+
+def _count(route: str, stat: str):
+    with _stats_lock:
+        stats = _stats.setdefault(route, {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "stores": 0})
+        stats[stat] += 1
+
+
+def get_answer(kind: str, query: str, route: str):
+    """
+    Look up a cached answer for a query, by exact normalized text and, with
+    ANSWER_CACHE_SEMANTIC, then by similarity.
+
+    Parameters:
+    kind (str): The query type the answer was generated for.
+    query (str): The user's query.
+    route (str): The endpoint asking, used for the hit rate statistics.
+
+    Returns:
+    The cached answer, or None on a miss.
+    """
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    answer, match = _get_index(kind).get(query, ANSWER_CACHE_SIMILARITY if ANSWER_CACHE_SEMANTIC else None)
+    _count(route, f"{match}_hits" if match else "misses")
+    if match == "semantic":
+        logger.info("Answer cache semantic hit for %s query", kind)
+    return answer
+
+
+def put_answer(kind: str, query: str, answer, route: str):
+    if not ANSWER_CACHE_ENABLED or not answer:
+        return
+    _get_index(kind).put(query, answer)
+    _count(route, "stores")
+
+
+def clear_answer_cache():
+    with _indexes_lock:
+        indexes = list(_indexes.values())
+    for index in indexes:
+        index.clear()
+
+
+def get_cache_stats() -> dict:
+    with _stats_lock:
+        stats = {route: dict(route_stats) for route, route_stats in _stats.items()}
+    for route_stats in stats.values():
+        hits = route_stats["exact_hits"] + route_stats["semantic_hits"]
+        lookups = hits + route_stats["misses"]
+        route_stats["hit_rate"] = round(hits / lookups, 4) if lookups else None
+    with _indexes_lock:
+        entries = {kind: len(index) for kind, index in _indexes.items()}
+    return {"routes": stats, "entries": entries}
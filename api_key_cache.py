@@ -0,0 +1,223 @@
+import os
+import asyncio
+import hashlib
+import logging
+import threading
+from cachetools import TTLCache
+from redis_utils import redis_client
+from db import get_cursor
+from metrics import timed, upstream_call
+from rate_limiter import DEFAULT_TIER
+
+logger = logging.getLogger(__name__)
+
+# API key cache configuration
+API_KEY_CACHE_SIZE = int(os.environ.get("API_KEY_CACHE_SIZE", "10000"))
+API_KEY_CACHE_TTL = int(os.environ.get("API_KEY_CACHE_TTL", "60"))
+# Also bounds how long a revoked key stays usable if Redis could not be told about the revocation
+API_KEY_REDIS_TTL = int(os.environ.get("API_KEY_REDIS_TTL", "120"))
+API_KEY_NEGATIVE_TTL = int(os.environ.get("API_KEY_NEGATIVE_TTL", "30"))
+
+INVALID_MARKER = "0"
+
+# In-process caches of key digest to tier; invalid keys expire sooner than valid ones
+_valid_keys = TTLCache(maxsize=API_KEY_CACHE_SIZE, ttl=API_KEY_CACHE_TTL)
+_invalid_keys = TTLCache(maxsize=API_KEY_CACHE_SIZE, ttl=API_KEY_NEGATIVE_TTL)
+_lock = threading.Lock()
+
+_stats = {
+    "local_hits": 0,
+    "redis_hits": 0,
+    "negative_hits": 0,
+    "misses": 0,
+    "invalidations": 0,
+}
+
+
+def _digest(api_key: str) -> str:
+    # Keys are only ever cached by digest so they never sit in Redis in plain text
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+def _redis_key(digest: str) -> str:
+    return f"api_key_valid:{digest}"
+
+
+def _count(stat: str):
+    with _lock:
+        _stats[stat] += 1
+
+
+def lookup_api_key_in_database(api_key: str):
+    """
+    Look up an API key's tier in the keys table.
+
+    Keys tables without a tier column put every key in the default tier.
+
+    Returns:
+    str: The key's tier, or None if the key does not exist.
+    """
+    with timed("api_key_lookup"), upstream_call("postgres", "keys", "api_key_lookup"), get_cursor() as cur:
+        cur.execute("SELECT * FROM keys WHERE api_key = %s", (api_key,))
+        row = cur.fetchone()
+        columns = [column[0] for column in cur.description] if cur.description else []
+    if row is None:
+        return None
+    return dict(zip(columns, row)).get("tier") or DEFAULT_TIER
+
+
+def _remember(digest: str, tier):
+    with _lock:
+        if tier is not None:
+            _valid_keys[digest] = tier
+            _invalid_keys.pop(digest, None)
+        else:
+            _invalid_keys[digest] = True
+            _valid_keys.pop(digest, None)
+
+
+def _lookup_local(digest: str):
+    """
+    Returns:
+    tuple: Whether the key was found locally, and its tier (None for an invalid key).
+    """
+    with _lock:
+        tier = _valid_keys.get(digest)
+        if tier is not None:
+            _stats["local_hits"] += 1
+            return True, tier
+        if digest in _invalid_keys:
+            _stats["negative_hits"] += 1
+            return True, None
+    return False, None
+
+
+def _from_redis(digest: str, cached: bytes):
+    # "0" marks an invalid key; entries written before tiers existed hold "1"
+    tier = cached.decode("utf-8")
+    if tier == INVALID_MARKER:
+        tier = None
+    elif tier == "1":
+        tier = DEFAULT_TIER
+    _count("redis_hits" if tier is not None else "negative_hits")
+    _remember(digest, tier)
+    return tier
+
+
+def _redis_ttl(tier) -> int:
+    return API_KEY_REDIS_TTL if tier is not None else API_KEY_NEGATIVE_TTL
+
+
+def get_api_key_tier(api_key: str):
+    """
+    Check an API key against the in-process cache, then Redis, then Postgres.
+
+    Both valid and invalid results are cached; invalid ones for a shorter time
+    so a newly generated key becomes usable quickly.
+
+    Parameters:
+    api_key (str): The API key presented by the client.
+
+    Returns:
+    str: The key's tier, or None if the key does not exist.
+    """
+    digest = _digest(api_key)
+    found, tier = _lookup_local(digest)
+    if found:
+        return tier
+
+    try:
+        cached = redis_client.get(_redis_key(digest))
+    except Exception as e:
+        logger.warning(f"Failed to read API key cache from Redis: {str(e)}")
+        cached = None
+    if cached is not None:
+        return _from_redis(digest, cached)
+
+    _count("misses")
+    tier = lookup_api_key_in_database(api_key)
+    _remember(digest, tier)
+    try:
+        redis_client.set(_redis_key(digest), tier or INVALID_MARKER, ex=_redis_ttl(tier))
+    except Exception as e:
+        logger.warning(f"Failed to write API key cache to Redis: {str(e)}")
+    return tier
+
+
+async def get_api_key_tier_async(redis, api_key: str):
+    """
+    get_api_key_tier on an asyncio Redis client. The rare database lookup
+    runs on the default executor.
+    """
+    digest = _digest(api_key)
+    found, tier = _lookup_local(digest)
+    if found:
+        return tier
+
+    try:
+        cached = await redis.get(_redis_key(digest))
+    except Exception as e:
+        logger.warning(f"Failed to read API key cache from Redis: {str(e)}")
+        cached = None
+    if cached is not None:
+        return _from_redis(digest, cached)
+
+    _count("misses")
+    tier = await asyncio.to_thread(lookup_api_key_in_database, api_key)
+    _remember(digest, tier)
+    try:
+        await redis.set(_redis_key(digest), tier or INVALID_MARKER, ex=_redis_ttl(tier))
+    except Exception as e:
+        logger.warning(f"Failed to write API key cache to Redis: {str(e)}")
+    return tier
+
+
+def is_valid_api_key(api_key: str) -> bool:
+    return get_api_key_tier(api_key) is not None
+
+
+def invalidate_api_key(api_key: str):
+    """
+    Drop an API key from both cache levels.
+
+    Other processes keep their in-process entry for at most API_KEY_CACHE_TTL
+    seconds; the shared Redis entry is replaced with a negative one so they
+    do not repopulate from it. If Redis cannot be written the failure is
+    logged, and its positive entry expires within API_KEY_REDIS_TTL seconds.
+    """
+    digest = _digest(api_key)
+    with _lock:
+        _valid_keys.pop(digest, None)
+        _invalid_keys.pop(digest, None)
+        _stats["invalidations"] += 1
+    try:
+        redis_client.set(_redis_key(digest), INVALID_MARKER, ex=API_KEY_NEGATIVE_TTL)
+    except Exception as e:
+        logger.error(f"Failed to invalidate API key in Redis, other processes may accept it "
+                     f"for up to {API_KEY_REDIS_TTL}s: {str(e)}")
+
+
+def revoke_api_key(api_key: str) -> bool:
+    """
+    Delete an API key from the keys table and invalidate its cache entries.
+
+    Once the delete has committed the key counts as revoked, even if the
+    cache could not be invalidated.
+
+    Returns:
+    bool: True if the key existed.
+    """
+    with get_cursor() as cur:
+        cur.execute("DELETE FROM keys WHERE api_key = %s", (api_key,))
+        deleted = cur.rowcount > 0
+    invalidate_api_key(api_key)
+    return deleted
+
+
+def get_cache_stats() -> dict:
+    with _lock:
+        stats = dict(_stats)
+        stats["local_entries"] = len(_valid_keys) + len(_invalid_keys)
+    lookups = stats["local_hits"] + stats["redis_hits"] + stats["negative_hits"] + stats["misses"]
+    stats["hit_rate"] = round(1 - stats["misses"] / lookups, 4) if lookups else None
+    return stats
@@ -4,40 +4,53 @@ from flask_caching import Cache
 import datetime
 import uuid
 import time
-from flask import Flask, request, jsonify, make_response
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Flask, Response, g, request, jsonify, make_response, stream_with_context
 from flask_cors import CORS
 from google.oauth2 import service_account
-from elasticsearch_utils import search_elasticsearch
-import psycopg2
+from retrievers import retriever
 import json
 import secrets
-from supabase import create_client, Client
-from query_classifier import classify_query
-from openai_utils import initialize_openai, generate_model_output, generate_search_quality_reflection, generate_conversation_response
+from query_classifier import classify_query, classify_queries, guess_query_types
+from openai_utils import initialize_openai, generate_model_output, generate_conversation_response, generate_model_output_stream, generate_conversation_response_stream
 import weave
-from conversation_logger import log_conversation
-from response_quality_evaluator import evaluate_response_quality
-import redis
-
-redis_url = os.environ.get("REDIS_URL")
-redis_client = redis.from_url(redis_url)
+from stage_runner import Stage, StageReport, run_stages, submit_stage
+from supabase_utils import supabase
+from task_queue import enqueue
+from tasks import persist_search_run_inline
+from db import get_cursor, get_pool_stats
+from api_key_cache import get_api_key_tier, revoke_api_key, get_cache_stats
+from conversation_memory import record_turn, get_conversation_memory, has_memory
+from rate_limiter import check_rate_limit, rate_limit_headers, max_cost, DEFAULT_TIER
+from search_quality import assess_search_quality
+from answer_cache import get_answer, put_answer, get_cache_stats as get_answer_cache_stats
+from pipeline import (SEARCH_QUALITY_TIMEOUT, GENERATION_TIMEOUT, BACKGROUND_TASKS_ENABLED, BATCH_MAX_QUERIES,
+                      BATCH_CONCURRENCY, NO_SEARCH_QUALITY, build_search_response, search_answer,
+                      cached_search_response, parse_batch_queries, sse_event, format_documents, new_run,
+                      with_degraded)
+from token_usage import start_usage_collection, usage_totals, log_usage
+from readiness import check_readiness
+from admission import ADMISSION_ENABLED, AdmissionRejected, admission, estimate_cost
+from logging_setup import configure_logging
+from deadline import DEADLINE_HEADER, start_deadline, budget_timeout, degraded, answer_degraded
+from metrics import (METRICS_PATH, start_request_timing, server_timing_header, observe_request,
+                     render_metrics)
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+configure_logging()
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
-
-CORS(app, resources={r"/api/*": {"origins": "*", "allow_headers": ["Content-Type", "Authorization"]}})
+WEAVE_PROJECT = os.environ.get("WEAVE_PROJECT", "bayard-one")
+WEAVE_ENABLED = os.environ.get("WEAVE_ENABLED", "true").lower() in ("1", "true", "yes")
 
-# Supabase PostgreSQL database connection
-SUPABASE_URL = os.environ.get("SUPABASE_URL")
-SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
+# Routes that never need tracing, authentication or any upstream client
+PROBE_PATHS = ("/health-check", "/ready", METRICS_PATH)
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise ValueError("SUPABASE_URL and SUPABASE_KEY environment variables are not set")
+app = Flask(__name__)
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+CORS(app, resources={r"/api/*": {"origins": "*", "allow_headers": ["Content-Type", "Authorization", DEADLINE_HEADER]}})
 
 def create_table_if_not_exists():
     runs_table = """
@@ -74,16 +87,40 @@ def create_table_if_not_exists():
 
 @app.after_request
 def add_headers(response):
-    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
+    response.headers['Access-Control-Allow-Headers'] = f'Content-Type, Authorization, {DEADLINE_HEADER}'
     response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS'
+    if degraded():
+        # Streamed responses only report what was shed before the stream started
+        response.headers["X-Degraded"] = ",".join(degraded())
+    if g.get("rate_limit") is not None:
+        response.headers.extend(rate_limit_headers(g.rate_limit))
+    if g.get("answer_cache") is not None:
+        response.headers["X-Answer-Cache"] = g.answer_cache
+    if g.get("request_start") is not None:
+        # Streamed responses only report the stages that ran before the stream started
+        elapsed = time.perf_counter() - g.request_start
+        response.headers["Server-Timing"] = server_timing_header(elapsed)
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        observe_request(route, request.method, response.status_code, elapsed)
     return response
 
 initialize_openai()
 
 @app.route("/health-check", methods=["GET"])
 def health_check():
+    # Liveness only; see /ready for the dependencies
     return "OK", 200
 
+@app.route("/ready", methods=["GET"])
+def ready():
+    checks = check_readiness()
+    return jsonify({"ready": all(checks.values()), "checks": checks}), 200 if all(checks.values()) else 503
+
+@app.route(METRICS_PATH, methods=["GET"])
+def metrics():
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
 @app.route("/api/bayard", methods=["OPTIONS"])
 def handle_preflight_request():
     response = make_response()
@@ -98,18 +135,13 @@ def generate_api_key():
         # Generate a new API key
         new_api_key = secrets.token_urlsafe(32)
         
-        # Connect to the PostgreSQL database
-        conn = psycopg2.connect(os.environ.get("DATABASE_URL"))
-        cur = conn.cursor()
-
         # Store the new API key in the database
-        cur.execute("INSERT INTO keys (api_key) VALUES (%s)", (new_api_key,))
-        conn.commit()
+        with get_cursor() as cur:
+            cur.execute("INSERT INTO keys (api_key) VALUES (%s)", (new_api_key,))
+            inserted = cur.rowcount > 0
 
         # Check if the insertion was successful
-        if cur.rowcount > 0:
-            cur.close()
-            conn.close()
+        if inserted:
             return jsonify({"api_key": new_api_key}), 200
         else:
             raise Exception("Failed to store API key in the database")
@@ -117,6 +149,31 @@ def generate_api_key():
         logging.error(f"Failed to generate API key: {str(e)}")
         return jsonify({"error": "Failed to generate API key"}), 500
 
+@app.route("/api/revoke-key", methods=["POST"])
+def revoke_key():
+    # Revoke the API key the request was authenticated with, but only one the caller sent
+    if g.api_key_source == "environment":
+        return jsonify({"error": "The server's configured API key cannot be revoked"}), 403
+    try:
+        if not revoke_api_key(g.api_key):
+            return jsonify({"error": "API key not found"}), 404
+        return jsonify({"revoked": True}), 200
+    except Exception as e:
+        logging.error(f"Failed to revoke API key: {str(e)}")
+        return jsonify({"error": "Failed to revoke API key"}), 500
+
+@app.route("/api/key-cache-stats", methods=["GET"])
+def key_cache_stats():
+    return jsonify(get_cache_stats()), 200
+
+@app.route("/api/db-pool-stats", methods=["GET"])
+def db_pool_stats():
+    return jsonify(get_pool_stats()), 200
+
+@app.route("/api/answer-cache-stats", methods=["GET"])
+def answer_cache_stats():
+    return jsonify(get_answer_cache_stats()), 200
+
 @app.route("/api/bayard", methods=["POST"])
 @weave.op(
     input_type=weave.types.TypedDict({
@@ -130,6 +187,7 @@ def generate_api_key():
         'search_quality_score': weave.types.Number(),
         'documents': weave.types.List(weave.types.Dict()),
         'model_output': weave.types.String(),
+        'degraded': weave.types.List(weave.types.String()),
     })
 )
 def bayard_api():
@@ -139,173 +197,429 @@ def bayard_api():
 
     user_id = request.json.get("user_id")  # Assuming user_id is provided in the request
 
-    # Retrieve conversation history from Redis
-    conversation_history = get_conversation_history_from_cache(user_id)
+    stage_report = StageReport()
 
-    query_type = classify_query(input_text)
+    # Retrieve conversation memory from Redis while the query is classified
+    stage_results = run_stages([
+        Stage("conversation_memory", get_conversation_memory, user_id, required=True),
+        Stage("classify_query", classify_query, input_text, required=True),
+    ], stage_report)
+    conversation_memory = stage_results["conversation_memory"]
+    query_type = stage_results["classify_query"]
+    cached_answer = lookup_answer(query_type, input_text, conversation_memory)
 
     if query_type == "search":
-        search_results = search_elasticsearch(input_text)
-        run_id = str(uuid.uuid4())
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if cached_answer is not None:
+            response_data = cached_search_response(input_text, cached_answer)
+            record_turn(user_id, input_text, response_data["model_output"])
+            return stage_timed_response(jsonify(with_degraded(response_data)), stage_report)
+
+        search_results = retriever.search(input_text)
+        response_data, search_quality = answer_search_query(input_text, search_results, conversation_memory, stage_report)
+
+        logger.info("Answered search query run_id=%s with %d documents and %d output chars",
+                    response_data["run_id"], len(response_data["documents"]), len(response_data["model_output"]),
+                    extra={"payload": response_data})
+
+        persist_search_run(response_data["run_id"], response_data["timestamp"], user_id, input_text, search_quality,
+                           response_data["model_output"], stage_report)
+        remember_answer(query_type, input_text, conversation_memory, search_answer(response_data), request.path)
+
+        return stage_timed_response(jsonify(with_degraded(response_data)), stage_report)
+    else:
+        # Handle conversation without searching
+        if cached_answer is not None:
+            conversation_response = cached_answer
+        else:
+            conversation_response = generate_conversation_response(input_text, conversation_memory)
+            remember_answer(query_type, input_text, conversation_memory, conversation_response, request.path)
+        # Update conversation memory in Redis
+        record_turn(user_id, input_text, conversation_response)
+
+        return stage_timed_response(jsonify(with_degraded({"model_output": conversation_response})), stage_report)
 
-        # Generate search quality reflection and score
-        search_quality = generate_search_quality_reflection(search_results, input_text)
+def answer_search_query(input_text: str, search_results: list, conversation_memory: dict, stage_report: StageReport):
+    """
+    Generate the search quality reflection and the model output side by side.
 
-        # Generate the model output
-        model_output = generate_model_output(input_text, search_results, conversation_history)        
+    Returns:
+    tuple: The response data and the search quality fields.
+    """
+    stage_results = run_stages([
+        Stage("search_quality_reflection", assess_search_quality, search_results, input_text,
+              timeout=budget_timeout(SEARCH_QUALITY_TIMEOUT), default=NO_SEARCH_QUALITY),
+        Stage("generate_model_output", generate_model_output, input_text, search_results, conversation_memory,
+              timeout=GENERATION_TIMEOUT, required=True),
+    ], stage_report)
+    search_quality = stage_results["search_quality_reflection"]
+    response_data = build_search_response(input_text, search_results, search_quality, stage_results["generate_model_output"])
+    return response_data, search_quality
+
+def lookup_answer(query_type: str, input_text: str, conversation_memory: dict):
+    # Answers that build on earlier turns are neither served from nor added to the answer cache
+    if has_memory(conversation_memory):
+        return None
+    answer = get_answer(query_type, input_text, request.path)
+    g.answer_cache = "hit" if answer is not None else "miss"
+    return answer
+
+def remember_answer(query_type: str, input_text: str, conversation_memory: dict, answer, route: str):
+    # Nor are answers shortened to meet a deadline
+    if not has_memory(conversation_memory) and not answer_degraded():
+        put_answer(query_type, input_text, answer, route)
+
+@app.route("/api/bayard/batch", methods=["POST"])
+def bayard_batch_api():
+    """
+    Answer several independent queries in one request.
+
+    Expects {"queries": [...], "stream": false}. All queries are classified
+    together, search queries are retrieved with a single msearch, and answers
+    are generated BATCH_CONCURRENCY at a time. Batch queries carry no
+    conversation history. Each query gets its own latency budget, from the
+    X-Request-Timeout header or REQUEST_BUDGET, starting when its answer
+    does, and lists what it shed under its own "degraded". Results are
+    returned in query order under "results", or with "stream": true written
+    as NDJSON lines tagged with their "index" as each one completes.
+    """
+    queries = get_batch_queries()
+    if queries is None:
+        return jsonify({"error": "queries must be a non-empty list of strings"}), 400
+    if len(queries) > BATCH_MAX_QUERIES:
+        return jsonify({"error": f"A batch can contain at most {BATCH_MAX_QUERIES} queries"}), 400
+
+    query_types = classify_queries(queries)
+    cached_answers = [get_answer(query_type, query, request.path) for query, query_type in zip(queries, query_types)]
+    search_indexes = [i for i, query_type in enumerate(query_types)
+                      if query_type == "search" and cached_answers[i] is None]
+    search_results = dict(zip(search_indexes, retriever.search_batch([queries[i] for i in search_indexes])))
+    route = request.path
+    budget_header = request.headers.get(DEADLINE_HEADER)
+
+    def answer(index):
+        input_text = queries[index]
+        cached_answer = cached_answers[index]
+        # The request's deadline covers classification and retrieval; queries waiting for
+        # a thread must not find it already spent
+        start_deadline(budget_header)
         try:
-            response_quality_scores = evaluate_response_quality(input_text, model_output)
+            if query_types[index] == "search" and cached_answer is not None:
+                response_data = cached_search_response(input_text, cached_answer)
+            elif query_types[index] == "search":
+                stage_report = StageReport()
+                response_data, search_quality = answer_search_query(input_text, search_results[index], [], stage_report)
+                store_search_run(response_data["run_id"], response_data["timestamp"], input_text, search_quality,
+                                 response_data["model_output"], stage_report)
+                if not answer_degraded():
+                    put_answer("search", input_text, search_answer(response_data), route)
+            elif cached_answer is not None:
+                response_data = {"model_output": cached_answer}
+            else:
+                response_data = {"model_output": generate_conversation_response(input_text, [])}
+                if not answer_degraded():
+                    put_answer(query_types[index], input_text, response_data["model_output"], route)
         except Exception as e:
-            logging.error(f"Failed to evaluate response quality: {str(e)}")
-            response_quality_scores = None  # Default or fallback value if score evaluation fails
-        log_conversation(input_text, model_output, response_quality_scores)
-
-        response_data = {
-            "run_id": run_id,
-            "timestamp": timestamp,
-            "input_text": input_text,
-            "search_quality_reflection": search_quality["search_quality_reflection"],
-            "search_quality_score": search_quality["search_quality_score"],
-            "documents": [{
-                "abstract": doc.get("abstract", "No abstract provided"),
-                "authors": [author.strip("{'name': '").strip("'}") for author in doc.get("authors", [])],
-                "categories": doc.get("categories", ["No categories provided"]),
-                "classification": doc.get("classification", "No classification provided"),
-                "concepts": doc.get("concepts", ["No concepts provided"]),
-                "downloadUrl": doc.get("downloadUrl", "No download URL provided"),
-                "emotion": doc.get("emotion", "No emotion provided"),
-                "id": doc.get("_id", "No ID provided"),
-                "sentiment": doc.get("sentiment", "No sentiment provided"),
-                "title": doc.get("title", "No title provided"),
-                "yearPublished": doc.get("yearPublished", "No year published provided")
-            } for doc in (search_results or [])],
-            "model_output": model_output
-        }
-
-        logging.info(f"Response Data: {response_data}")
-
-        # Store the run in the database
-        try:
-            supabase.table("runs").insert({
+            logging.error(f"Failed to answer batch query {index}: {str(e)}")
+            response_data = {"error": "Failed to generate model output"}
+        return dict(with_degraded(response_data), index=index, query_type=query_types[index])
+
+    # One executor per batch so a large batch cannot starve the stage pool
+    executor = ThreadPoolExecutor(max_workers=max(1, min(BATCH_CONCURRENCY, len(queries))),
+                                  thread_name_prefix="bayard-batch")
+    # A copied context per query keeps token usage reporting to this request
+    futures = [executor.submit(contextvars.copy_context().run, answer, index) for index in range(len(queries))]
+
+    if request.json.get("stream"):
+        def generate():
+            try:
+                for future in as_completed(futures):
+                    yield json.dumps(future.result()) + "\n"
+            finally:
+                executor.shutdown(wait=False, cancel_futures=True)
+                log_usage()
+
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+    try:
+        results = [future.result() for future in futures]
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    log_usage()
+    return jsonify(with_degraded({"results": results}))
+
+def get_batch_queries():
+    return parse_batch_queries(request.get_json(silent=True))
+
+@app.route("/api/bayard/stream", methods=["POST"])
+def bayard_stream_api():
+    """
+    Streaming variant of /api/bayard using Server-Sent Events.
+
+    Search queries emit a "metadata" event with the run id and documents, a
+    "token" event per generated chunk, and a final "done" event carrying the
+    search quality fields and the "degraded" list. Conversation queries emit
+    "metadata", "token" and "done" events with the model output only. The run and conversation are
+    persisted once the stream has completed.
+    """
+    input_text = request.json.get("input_text")
+    if not input_text:
+        return jsonify({"error": "Input text is required"}), 400
+
+    user_id = request.json.get("user_id")
+
+    stage_report = StageReport()
+    stage_results = run_stages([
+        Stage("conversation_memory", get_conversation_memory, user_id, required=True),
+        Stage("classify_query", classify_query, input_text, required=True),
+    ], stage_report)
+    conversation_memory = stage_results["conversation_memory"]
+    query_type = stage_results["classify_query"]
+    cached_answer = lookup_answer(query_type, input_text, conversation_memory)
+    route = request.path
+
+    if cached_answer is not None:
+        def generate():
+            # Replay the cached answer as a single token event
+            if query_type == "search":
+                response_data = cached_search_response(input_text, cached_answer)
+                yield sse_event("metadata", {
+                    "query_type": query_type,
+                    "run_id": response_data["run_id"],
+                    "timestamp": response_data["timestamp"],
+                    "input_text": input_text,
+                    "documents": response_data["documents"],
+                    "cached": True,
+                })
+                yield sse_event("token", {"content": response_data["model_output"]})
+                yield sse_event("done", {
+                    "search_quality_reflection": response_data["search_quality_reflection"],
+                    "search_quality_score": response_data["search_quality_score"],
+                })
+                model_output = response_data["model_output"]
+            else:
+                yield sse_event("metadata", {"query_type": query_type})
+                yield sse_event("token", {"content": cached_answer})
+                yield sse_event("done", {})
+                model_output = cached_answer
+            record_turn(user_id, input_text, model_output)
+    elif query_type == "search":
+        search_results = retriever.search(input_text)
+        run_id, timestamp = new_run()
+
+        # The reflection runs on the stage pool while the answer streams
+        pending_search_quality = submit_stage(
+            Stage("search_quality_reflection", assess_search_quality, search_results, input_text,
+                  timeout=budget_timeout(SEARCH_QUALITY_TIMEOUT), default=NO_SEARCH_QUALITY)
+        )
+
+        def generate():
+            yield sse_event("metadata", {
+                "query_type": query_type,
                 "run_id": run_id,
                 "timestamp": timestamp,
                 "input_text": input_text,
-                "search_quality_reflection": search_quality,
-                "model_output": model_output,
-                "response_quality_scores": json.dumps(response_quality_scores)
-            }).execute()
-        except Exception as e:
-            logging.error(f"Failed to store run in the database: {str(e)}")
+                "documents": format_documents(search_results),
+            })
+            chunks = []
+            completed = False
+            try:
+                for chunk in generate_model_output_stream(input_text, search_results, conversation_memory):
+                    chunks.append(chunk)
+                    yield sse_event("token", {"content": chunk})
+                # Joined once; the stage is recorded once and a timeout is not waited out twice
+                search_quality = pending_search_quality.result(stage_report)
+                completed = True
+                yield sse_event("done", with_degraded({
+                    "search_quality_reflection": search_quality["search_quality_reflection"],
+                    "search_quality_score": search_quality["search_quality_score"],
+                }))
+            except Exception as e:
+                logging.error(f"Failed to stream model output: {str(e)}")
+                yield sse_event("error", {"error": "Failed to generate model output"})
+            finally:
+                if completed:
+                    persist_search_run(run_id, timestamp, user_id, input_text,
+                                       search_quality, "".join(chunks), stage_report)
+                    remember_answer(query_type, input_text, conversation_memory, {
+                        "run_id": run_id,
+                        "timestamp": timestamp,
+                        "search_quality_reflection": search_quality["search_quality_reflection"],
+                        "search_quality_score": search_quality["search_quality_score"],
+                        "documents": format_documents(search_results),
+                        "model_output": "".join(chunks),
+                    }, route)
+                log_usage()
+    else:
+        def generate():
+            yield sse_event("metadata", {"query_type": query_type})
+            chunks = []
+            completed = False
+            try:
+                for chunk in generate_conversation_response_stream(input_text, conversation_memory):
+                    chunks.append(chunk)
+                    yield sse_event("token", {"content": chunk})
+                completed = True
+                yield sse_event("done", with_degraded({}))
+            except Exception as e:
+                logging.error(f"Failed to stream conversation response: {str(e)}")
+                yield sse_event("error", {"error": "Failed to generate model output"})
+            finally:
+                if completed:
+                    record_turn(user_id, input_text, "".join(chunks))
+                    remember_answer(query_type, input_text, conversation_memory, "".join(chunks), route)
+                log_usage()
+
+    response = Response(stream_with_context(generate()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+def persist_search_run(run_id: str, timestamp: str, user_id: str, input_text: str, search_quality: dict, model_output: str, stage_report: StageReport):
+    store_search_run(run_id, timestamp, input_text, search_quality, model_output, stage_report)
 
-        # Update conversation history in Redis
-        log_conversation_in_cache(user_id, input_text, model_output)
+    # Update conversation memory in Redis
+    record_turn(user_id, input_text, model_output)
 
-        return jsonify(response_data)
+def store_search_run(run_id: str, timestamp: str, input_text: str, search_quality: dict, model_output: str, stage_report: StageReport):
+    if BACKGROUND_TASKS_ENABLED:
+        try:
+            enqueue("evaluate_search_run", run_id=run_id, timestamp=timestamp, input_text=input_text,
+                    search_quality=search_quality, model_output=model_output)
+        except Exception as e:
+            logging.error(f"Failed to enqueue run evaluation, running it inline: {str(e)}")
+            persist_search_run_inline(run_id, timestamp, input_text, search_quality, model_output, stage_report)
     else:
-        # Handle conversation without searching
-        conversation_response = generate_conversation_response(input_text, conversation_history)        
-        # Update conversation history in Redis
-        log_conversation_in_cache(user_id, input_text, conversation_response)
+        persist_search_run_inline(run_id, timestamp, input_text, search_quality, model_output, stage_report)
+
+def stage_timed_response(response, stage_report: StageReport):
+    # Report how much wall-clock time running the stages concurrently saved
+    logger.info("Stage timings: %s", stage_report.as_dict())
+    response.headers["X-Stage-Time-Saved"] = f"{stage_report.time_saved:.3f}"
+    response.headers["X-Stage-Durations"] = ",".join(
+        f"{name}={duration:.4f}" for name, duration in stage_report.durations.items())
+    log_usage()
+    totals = usage_totals()
+    response.headers["X-Prompt-Tokens"] = str(totals["prompt_tokens"])
+    response.headers["X-Completion-Tokens"] = str(totals["completion_tokens"])
+    return response
 
-        return jsonify({"model_output": conversation_response})
+_weave_lock = threading.Lock()
+_weave_pid = None
+
+def init_weave():
+    """
+    Initialise weave tracing once per process.
+
+    weave.init logs in to W&B over the network, so it runs on the first
+    request instead of at import. Until then, and if it fails, weave ops run
+    untraced.
+    """
+    global _weave_pid
+    if not WEAVE_ENABLED or _weave_pid == os.getpid():
+        return
+    with _weave_lock:
+        if _weave_pid == os.getpid():
+            return
+        _weave_pid = os.getpid()
+        try:
+            weave.init(WEAVE_PROJECT)
+        except Exception as e:
+            logging.error(f"Failed to initialise weave, requests will not be traced: {str(e)}")
+
+@app.before_request
+def init_tracing():
+    if request.path not in PROBE_PATHS:
+        init_weave()
+
+@app.before_request
+def start_request_usage():
+    g.request_start = time.perf_counter()
+    start_request_timing()
+    start_deadline(request.headers.get(DEADLINE_HEADER))
+    start_usage_collection()
 
 @app.before_request
 def authenticate_request():
-    # Check if the request is for the health check or API key generation endpoint
-    if request.path == '/health-check' or request.path == '/api/generate-key':
+    # Check if the request is for a probe or the API key generation endpoint
+    if request.path in PROBE_PATHS or request.path == '/api/generate-key':
+        return
+
+    # CORS preflight requests never carry credentials
+    if request.method == 'OPTIONS':
         return
 
     # Try to get the API key from the environment variable
     bayard_api_key = os.environ.get('BAYARD_API_KEY')
-    logging.info(f"Retrieved API key from environment variable: {bayard_api_key}")
+    key_source = "environment"
 
     # If the environment variable is not set, try to get the API key from the X-API-Key header
     if not bayard_api_key:
         bayard_api_key = request.headers.get('X-API-Key')
-        logging.info(f"Retrieved API key from X-API-Key header: {bayard_api_key}")
+        key_source = "X-API-Key header"
 
     # If neither the environment variable nor the X-API-Key header is present, try to get the API key from the Authorization header
     if not bayard_api_key:
         auth_header = request.headers.get('Authorization')
         if auth_header and auth_header.startswith('Bearer'):
             bayard_api_key = auth_header.split(' ')[1]
-            logging.info(f"Retrieved API key from Authorization header: {bayard_api_key}")
+            key_source = "Authorization header"
 
     if not bayard_api_key:
-        logging.error("API key not found in request headers or environment variable")
+        logger.error("API key not found in request headers or environment variable")
         return jsonify({'error': 'API key not configured'}), 500
 
-    # Check if the API key exists in the database
-    
-    # Connect to the PostgreSQL database
-    conn = psycopg2.connect(os.environ.get("DATABASE_URL"))
-    cur = conn.cursor()
-    cur.execute("SELECT api_key FROM keys WHERE api_key = %s", (bayard_api_key,))
-    api_key_exists = cur.fetchone()
-    cur.close()
-    conn.close()
-
-    logging.info(f"API key exists in database: {api_key_exists}")
+    # Check if the API key exists, going to the database only on a cache miss
+    api_key_tier = get_api_key_tier(bayard_api_key)
+    api_key_exists = api_key_tier is not None
+
+    logger.debug("API key from %s exists: %s", key_source, api_key_exists)
     if not api_key_exists:
         return jsonify({'error': 'Invalid API key'}), 401
 
-    # Check if the rate limit has been exceeded
-    if not rate_limit(bayard_api_key):
+    g.api_key = bayard_api_key
+    g.api_key_source = key_source
+    g.api_key_tier = api_key_tier
+
+    # Check if the rate limit has been exceeded; a batch counts once per query
+    cost = 1
+    if request.path == '/api/bayard/batch':
+        cost = len(get_batch_queries() or []) or 1
+    if cost > max_cost(api_key_tier):
+        # Waiting would not help, so it is refused as a bad request rather than a 429
+        return jsonify({'error': f"A batch can contain at most {max_cost(api_key_tier)} queries for this API key"}), 400
+    if not rate_limit(bayard_api_key, cost):
         return jsonify({'error': 'Rate limit exceeded'}), 429
 
-# Dictionary to store API key usage
-api_key_usage = {}
-
-conversation_history_cache = {}
-
-def log_conversation_in_cache(user_id: str, input_text: str, model_output: str):
-    # Retrieve the user's conversation history from Redis
-    conversation_history = redis_client.lrange(f"conversation_history:{user_id}", 0, -1)
-    conversation_history = [json.loads(entry) for entry in conversation_history]
-
-    # Append the new conversation to the user's history
-    conversation_history.append({
-        "input_text": input_text,
-        "model_output": model_output
-    })
-
-    # Limit the conversation history to the last 3 entries
-    conversation_history = conversation_history[-3:]
-
-    # Store the updated conversation history in Redis
-    redis_client.delete(f"conversation_history:{user_id}")
-    for entry in conversation_history:
-        redis_client.rpush(f"conversation_history:{user_id}", json.dumps(entry))
-
-def get_conversation_history_from_cache(user_id: str):
-    conversation_history = redis_client.lrange(f"conversation_history:{user_id}", 0, -1)
-    conversation_history = [json.loads(entry) for entry in conversation_history]
-    return conversation_history
-
-# Rate limiting configuration
-RATE_LIMIT_QUERIES = 500
-RATE_LIMIT_PERIOD = 3600
+# Routes that run the LLM pipeline and so go through admission control
+ADMITTED_PATHS = ("/api/bayard", "/api/bayard/stream", "/api/bayard/batch")
 
-def rate_limit(api_key):
-    current_time = datetime.datetime.now()
-    usage_history = api_key_usage.get(api_key, [])
-
-    # Remove expired entries from the usage history
-    usage_history = [entry for entry in usage_history if (current_time - entry).total_seconds() < RATE_LIMIT_PERIOD]
-    api_key_usage[api_key] = usage_history
-
-    # Check if the rate limit has been exceeded
-    if len(usage_history) >= RATE_LIMIT_QUERIES:
-        return False
-
-    # Add the current request to the usage history
-    usage_history.append(current_time)
-    api_key_usage[api_key] = usage_history
-
-    return True
-
-weave.init('bayard-one')
+@app.before_request
+def admit_request():
+    if not ADMISSION_ENABLED or request.method != 'POST' or request.path not in ADMITTED_PATHS:
+        return
+    if request.path == '/api/bayard/batch':
+        queries = get_batch_queries() or []
+    else:
+        queries = [(request.get_json(silent=True) or {}).get("input_text") or ""]
+    try:
+        g.admission = admission.acquire(g.get("api_key_tier", DEFAULT_TIER), estimate_cost(guess_query_types(queries)))
+    except AdmissionRejected as e:
+        logger.warning("Refused %s: %s", request.path, e)
+        response = jsonify({'error': 'Server is at capacity, please retry later'})
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response, 503
+
+@app.teardown_request
+def release_admission(exc):
+    # Streamed responses keep their slot until the stream is closed
+    ticket = g.pop("admission", None)
+    if ticket is not None:
+        admission.release(ticket)
+
+def rate_limit(api_key, cost=1):
+    # Keep the result so the rate limit headers can be added to the response
+    g.rate_limit = check_rate_limit(api_key, g.get("api_key_tier", DEFAULT_TIER), cost)
+    return g.rate_limit.allowed
 
 if __name__ == "__main__":
     create_table_if_not_exists()
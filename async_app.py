@@ -0,0 +1,560 @@
+"""
+Asyncio serving mode for the Bayard API.
+
+Serves the same routes and authentication as app.py on aiohttp, with the
+async OpenAI, Cohere, Elasticsearch and Redis clients, so a single worker
+process keeps many upstream calls in flight instead of one per request.
+Run it with:
+
+    gunicorn -c gunicorn.conf.py --worker-class aiohttp.GunicornWebWorker async_app:app
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+import secrets
+from aiohttp import web
+from async_clients import get_async_redis, get_async_openai, get_async_cohere, close_async_clients
+from retrievers import retriever
+from query_classifier import classify_query_async, classify_queries_async, guess_query_types
+from openai_utils import (generate_model_output_async, generate_model_output_stream_async,
+                          generate_conversation_response_async, generate_conversation_response_stream_async)
+from search_quality import assess_search_quality_async
+from stage_runner import Stage, StageReport, run_stages_async
+from task_queue import enqueue_async
+from tasks import persist_search_run_inline
+from db import get_cursor, get_pool_stats
+from api_key_cache import get_api_key_tier_async, revoke_api_key, get_cache_stats
+from conversation_memory import record_turn_async, get_conversation_memory_async, has_memory
+from rate_limiter import check_rate_limit_async, rate_limit_headers, max_cost
+from answer_cache import get_answer, put_answer, get_cache_stats as get_answer_cache_stats
+from pipeline import (SEARCH_QUALITY_TIMEOUT, GENERATION_TIMEOUT, BACKGROUND_TASKS_ENABLED, BATCH_MAX_QUERIES,
+                      BATCH_CONCURRENCY, NO_SEARCH_QUALITY, build_search_response, search_answer,
+                      cached_search_response, parse_batch_queries, sse_event, new_run, with_degraded)
+from token_usage import start_usage_collection, usage_totals, log_usage
+from readiness import check_readiness
+from admission import ADMISSION_ENABLED, AdmissionRejected, admission, estimate_cost
+from logging_setup import configure_logging
+from deadline import DEADLINE_HEADER, start_deadline, budget_timeout, degraded, answer_degraded
+from metrics import (METRICS_PATH, start_request_timing, server_timing_header, observe_request,
+                     render_metrics)
+
+# Configure logging
+configure_logging()
+logger = logging.getLogger(__name__)
+
+UNAUTHENTICATED_PATHS = ("/health-check", "/ready", METRICS_PATH, "/api/generate-key")
+# Routes that run the LLM pipeline and so go through admission control
+ADMITTED_PATHS = ("/api/bayard", "/api/bayard/stream", "/api/bayard/batch")
+
+routes = web.RouteTableDef()
+
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+@routes.get("/health-check")
+async def health_check(request):
+    # Liveness only; see /ready for the dependencies
+    return web.Response(text="OK")
+
+
+@routes.get("/ready")
+async def ready(request):
+    checks = await asyncio.to_thread(check_readiness)
+    return web.json_response({"ready": all(checks.values()), "checks": checks}, status=200 if all(checks.values()) else 503)
+
+
+@routes.get(METRICS_PATH)
+async def metrics(request):
+    body, content_type = render_metrics()
+    return web.Response(body=body, headers={"Content-Type": content_type})
+
+
+def store_api_key(api_key: str) -> bool:
+    with get_cursor() as cur:
+        cur.execute("INSERT INTO keys (api_key) VALUES (%s)", (api_key,))
+        return cur.rowcount > 0
+
+
+@routes.get("/api/generate-key")
+async def generate_api_key(request):
+    try:
+        new_api_key = secrets.token_urlsafe(32)
+        if not await asyncio.to_thread(store_api_key, new_api_key):
+            raise Exception("Failed to store API key in the database")
+        return web.json_response({"api_key": new_api_key})
+    except Exception as e:
+        logger.error(f"Failed to generate API key: {str(e)}")
+        return web.json_response({"error": "Failed to generate API key"}, status=500)
+
+
+@routes.post("/api/revoke-key")
+async def revoke_key(request):
+    # Revoke the API key the request was authenticated with, but only one the caller sent
+    if request["api_key_source"] == "environment":
+        return web.json_response({"error": "The server's configured API key cannot be revoked"}, status=403)
+    try:
+        if not await asyncio.to_thread(revoke_api_key, request["api_key"]):
+            return web.json_response({"error": "API key not found"}, status=404)
+        return web.json_response({"revoked": True})
+    except Exception as e:
+        logger.error(f"Failed to revoke API key: {str(e)}")
+        return web.json_response({"error": "Failed to revoke API key"}, status=500)
+
+
+@routes.get("/api/key-cache-stats")
+async def key_cache_stats(request):
+    return web.json_response(get_cache_stats())
+
+
+@routes.get("/api/db-pool-stats")
+async def db_pool_stats(request):
+    return web.json_response(get_pool_stats())
+
+
+@routes.get("/api/answer-cache-stats")
+async def answer_cache_stats(request):
+    return web.json_response(get_answer_cache_stats())
+
+
+@routes.post("/api/bayard")
+async def bayard_api(request):
+    body = await read_json(request) or {}
+    input_text = body.get("input_text")
+    if not input_text:
+        return web.json_response({"error": "Input text is required"}, status=400)
+
+    user_id = body.get("user_id")
+    redis = get_async_redis()
+    stage_report = StageReport()
+
+    # Retrieve conversation memory from Redis while the query is classified
+    stage_results = await run_stages_async([
+        Stage("conversation_memory", get_conversation_memory_async, redis, user_id, required=True),
+        Stage("classify_query", classify_query_async, get_async_cohere(), input_text, required=True),
+    ], stage_report)
+    conversation_memory = stage_results["conversation_memory"]
+    query_type = stage_results["classify_query"]
+    cached_answer = lookup_answer(request, query_type, input_text, conversation_memory)
+
+    if query_type == "search":
+        if cached_answer is not None:
+            response_data = cached_search_response(input_text, cached_answer)
+            await record_turn_async(redis, user_id, input_text, response_data["model_output"])
+            return stage_timed_response(web.json_response(with_degraded(response_data)), stage_report)
+
+        search_results = await retriever.search_async(input_text)
+        response_data, search_quality = await answer_search_query(input_text, search_results, conversation_memory, stage_report)
+
+        logger.info("Answered search query run_id=%s with %d documents and %d output chars",
+                    response_data["run_id"], len(response_data["documents"]), len(response_data["model_output"]),
+                    extra={"payload": response_data})
+
+        await persist_search_run(response_data["run_id"], response_data["timestamp"], user_id, input_text,
+                                 search_quality, response_data["model_output"], stage_report)
+        remember_answer(query_type, input_text, conversation_memory, search_answer(response_data), request.path)
+
+        return stage_timed_response(web.json_response(with_degraded(response_data)), stage_report)
+    else:
+        # Handle conversation without searching
+        if cached_answer is not None:
+            conversation_response = cached_answer
+        else:
+            conversation_response = await generate_conversation_response_async(get_async_openai(), input_text, conversation_memory)
+            remember_answer(query_type, input_text, conversation_memory, conversation_response, request.path)
+        await record_turn_async(redis, user_id, input_text, conversation_response)
+
+        return stage_timed_response(web.json_response(with_degraded({"model_output": conversation_response})), stage_report)
+
+
+async def answer_search_query(input_text: str, search_results: list, conversation_memory: dict, stage_report: StageReport):
+    """
+    Generate the search quality reflection and the model output side by side.
+
+    Returns:
+    tuple: The response data and the search quality fields.
+    """
+    openai_client = get_async_openai()
+    stage_results = await run_stages_async([
+        Stage("search_quality_reflection", assess_search_quality_async, openai_client, search_results, input_text,
+              timeout=budget_timeout(SEARCH_QUALITY_TIMEOUT), default=NO_SEARCH_QUALITY),
+        Stage("generate_model_output", generate_model_output_async, openai_client, input_text, search_results,
+              conversation_memory, timeout=GENERATION_TIMEOUT, required=True),
+    ], stage_report)
+    search_quality = stage_results["search_quality_reflection"]
+    response_data = build_search_response(input_text, search_results, search_quality, stage_results["generate_model_output"])
+    return response_data, search_quality
+
+
+def lookup_answer(request, query_type: str, input_text: str, conversation_memory: dict):
+    # Answers that build on earlier turns are neither served from nor added to the answer cache
+    if has_memory(conversation_memory):
+        return None
+    answer = get_answer(query_type, input_text, request.path)
+    request["answer_cache"] = "hit" if answer is not None else "miss"
+    return answer
+
+
+def remember_answer(query_type: str, input_text: str, conversation_memory: dict, answer, route: str):
+    # Nor are answers shortened to meet a deadline
+    if not has_memory(conversation_memory) and not answer_degraded():
+        put_answer(query_type, input_text, answer, route)
+
+
+@routes.post("/api/bayard/batch")
+async def bayard_batch_api(request):
+    """
+    Answer several independent queries in one request; see app.bayard_batch_api.
+    """
+    body = await read_json(request) or {}
+    queries = parse_batch_queries(body)
+    if queries is None:
+        return web.json_response({"error": "queries must be a non-empty list of strings"}, status=400)
+    if len(queries) > BATCH_MAX_QUERIES:
+        return web.json_response({"error": f"A batch can contain at most {BATCH_MAX_QUERIES} queries"}, status=400)
+
+    redis = get_async_redis()
+    openai_client = get_async_openai()
+    route = request.path
+    query_types = await classify_queries_async(get_async_cohere(), queries)
+    cached_answers = [get_answer(query_type, query, route) for query, query_type in zip(queries, query_types)]
+    search_indexes = [i for i, query_type in enumerate(query_types)
+                      if query_type == "search" and cached_answers[i] is None]
+    search_results = dict(zip(search_indexes, await retriever.search_batch_async([queries[i] for i in search_indexes])))
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    budget_header = request.headers.get(DEADLINE_HEADER)
+
+    async def answer(index):
+        input_text = queries[index]
+        cached_answer = cached_answers[index]
+        try:
+            if query_types[index] == "search" and cached_answer is not None:
+                response_data = cached_search_response(input_text, cached_answer)
+            elif query_types[index] == "search":
+                async with semaphore:
+                    # Each task has its own context, so this deadline is the query's alone
+                    start_deadline(budget_header)
+                    stage_report = StageReport()
+                    response_data, search_quality = await answer_search_query(input_text, search_results[index], [], stage_report)
+                await store_search_run(response_data["run_id"], response_data["timestamp"], input_text, search_quality,
+                                       response_data["model_output"], stage_report)
+                if not answer_degraded():
+                    put_answer("search", input_text, search_answer(response_data), route)
+            elif cached_answer is not None:
+                response_data = {"model_output": cached_answer}
+            else:
+                async with semaphore:
+                    start_deadline(budget_header)
+                    response_data = {"model_output": await generate_conversation_response_async(openai_client, input_text, [])}
+                if not answer_degraded():
+                    put_answer(query_types[index], input_text, response_data["model_output"], route)
+        except Exception as e:
+            logger.error(f"Failed to answer batch query {index}: {str(e)}")
+            response_data = {"error": "Failed to generate model output"}
+        return dict(with_degraded(response_data), index=index, query_type=query_types[index])
+
+    tasks = [asyncio.ensure_future(answer(index)) for index in range(len(queries))]
+
+    if body.get("stream"):
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                await response.write((json.dumps(await next_result) + "\n").encode("utf-8"))
+        finally:
+            for pending in tasks:
+                pending.cancel()
+            log_usage()
+        await response.write_eof()
+        return response
+
+    try:
+        results = await asyncio.gather(*tasks)
+    finally:
+        for pending in tasks:
+            pending.cancel()
+    log_usage()
+    return web.json_response(with_degraded({"results": results}))
+
+
+@routes.post("/api/bayard/stream")
+async def bayard_stream_api(request):
+    """
+    Streaming variant of /api/bayard using Server-Sent Events; see app.bayard_stream_api.
+    """
+    body = await read_json(request) or {}
+    input_text = body.get("input_text")
+    if not input_text:
+        return web.json_response({"error": "Input text is required"}, status=400)
+
+    user_id = body.get("user_id")
+    redis = get_async_redis()
+    openai_client = get_async_openai()
+    stage_report = StageReport()
+    stage_results = await run_stages_async([
+        Stage("conversation_memory", get_conversation_memory_async, redis, user_id, required=True),
+        Stage("classify_query", classify_query_async, get_async_cohere(), input_text, required=True),
+    ], stage_report)
+    conversation_memory = stage_results["conversation_memory"]
+    query_type = stage_results["classify_query"]
+    cached_answer = lookup_answer(request, query_type, input_text, conversation_memory)
+
+    response = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+    async def send(event, data):
+        await response.write(sse_event(event, data).encode("utf-8"))
+
+    if cached_answer is not None:
+        await response.prepare(request)
+        # Replay the cached answer as a single token event
+        if query_type == "search":
+            response_data = cached_search_response(input_text, cached_answer)
+            await send("metadata", {
+                "query_type": query_type,
+                "run_id": response_data["run_id"],
+                "timestamp": response_data["timestamp"],
+                "input_text": input_text,
+                "documents": response_data["documents"],
+                "cached": True,
+            })
+            await send("token", {"content": response_data["model_output"]})
+            await send("done", {
+                "search_quality_reflection": response_data["search_quality_reflection"],
+                "search_quality_score": response_data["search_quality_score"],
+            })
+            model_output = response_data["model_output"]
+        else:
+            await send("metadata", {"query_type": query_type})
+            await send("token", {"content": cached_answer})
+            await send("done", {})
+            model_output = cached_answer
+        await record_turn_async(redis, user_id, input_text, model_output)
+    elif query_type == "search":
+        search_results = await retriever.search_async(input_text)
+        run_id, timestamp = new_run()
+
+        # The reflection runs alongside the streamed answer
+        pending_search_quality = asyncio.ensure_future(run_stages_async([
+            Stage("search_quality_reflection", assess_search_quality_async, openai_client, search_results, input_text,
+                  timeout=budget_timeout(SEARCH_QUALITY_TIMEOUT), default=NO_SEARCH_QUALITY),
+        ], stage_report))
+
+        await response.prepare(request)
+        chunks = []
+        completed = False
+        try:
+            await send("metadata", {
+                "query_type": query_type,
+                "run_id": run_id,
+                "timestamp": timestamp,
+                "input_text": input_text,
+                "documents": build_search_response(input_text, search_results, NO_SEARCH_QUALITY, "")["documents"],
+            })
+            async for chunk in generate_model_output_stream_async(openai_client, input_text, search_results, conversation_memory):
+                chunks.append(chunk)
+                await send("token", {"content": chunk})
+            search_quality = (await pending_search_quality)["search_quality_reflection"]
+            completed = True
+            await send("done", with_degraded({
+                "search_quality_reflection": search_quality["search_quality_reflection"],
+                "search_quality_score": search_quality["search_quality_score"],
+            }))
+        except ConnectionResetError:
+            logger.info("Client disconnected during stream")
+        except Exception as e:
+            logger.error(f"Failed to stream model output: {str(e)}")
+            await send("error", {"error": "Failed to generate model output"})
+        finally:
+            if completed:
+                await persist_search_run(run_id, timestamp, user_id, input_text, search_quality, "".join(chunks), stage_report)
+                remember_answer(query_type, input_text, conversation_memory, {
+                    "run_id": run_id,
+                    "timestamp": timestamp,
+                    "search_quality_reflection": search_quality["search_quality_reflection"],
+                    "search_quality_score": search_quality["search_quality_score"],
+                    "documents": build_search_response(input_text, search_results, NO_SEARCH_QUALITY, "")["documents"],
+                    "model_output": "".join(chunks),
+                }, request.path)
+            else:
+                pending_search_quality.cancel()
+            log_usage()
+    else:
+        await response.prepare(request)
+        chunks = []
+        completed = False
+        try:
+            await send("metadata", {"query_type": query_type})
+            async for chunk in generate_conversation_response_stream_async(openai_client, input_text, conversation_memory):
+                chunks.append(chunk)
+                await send("token", {"content": chunk})
+            completed = True
+            await send("done", with_degraded({}))
+        except ConnectionResetError:
+            logger.info("Client disconnected during stream")
+        except Exception as e:
+            logger.error(f"Failed to stream conversation response: {str(e)}")
+            await send("error", {"error": "Failed to generate model output"})
+        finally:
+            if completed:
+                await record_turn_async(redis, user_id, input_text, "".join(chunks))
+                remember_answer(query_type, input_text, conversation_memory, "".join(chunks), request.path)
+            log_usage()
+
+    await response.write_eof()
+    return response
+
+
+async def persist_search_run(run_id: str, timestamp: str, user_id: str, input_text: str, search_quality: dict, model_output: str, stage_report: StageReport):
+    await store_search_run(run_id, timestamp, input_text, search_quality, model_output, stage_report)
+
+    # Update conversation memory in Redis
+    await record_turn_async(get_async_redis(), user_id, input_text, model_output)
+
+
+async def store_search_run(run_id: str, timestamp: str, input_text: str, search_quality: dict, model_output: str, stage_report: StageReport):
+    if BACKGROUND_TASKS_ENABLED:
+        try:
+            await enqueue_async(get_async_redis(), "evaluate_search_run", run_id=run_id, timestamp=timestamp,
+                                input_text=input_text, search_quality=search_quality, model_output=model_output)
+            return
+        except Exception as e:
+            logger.error(f"Failed to enqueue run evaluation, running it inline: {str(e)}")
+    # The evaluation and database writes are blocking; keep them off the event loop
+    await asyncio.to_thread(persist_search_run_inline, run_id, timestamp, input_text, search_quality, model_output, stage_report)
+
+
+def stage_timed_response(response, stage_report: StageReport):
+    # Report how much wall-clock time running the stages concurrently saved
+    logger.info("Stage timings: %s", stage_report.as_dict())
+    response.headers["X-Stage-Time-Saved"] = f"{stage_report.time_saved:.3f}"
+    response.headers["X-Stage-Durations"] = ",".join(
+        f"{name}={duration:.4f}" for name, duration in stage_report.durations.items())
+    log_usage()
+    totals = usage_totals()
+    response.headers["X-Prompt-Tokens"] = str(totals["prompt_tokens"])
+    response.headers["X-Completion-Tokens"] = str(totals["completion_tokens"])
+    return response
+
+
+def get_request_api_key(request):
+    # Same order as app.authenticate_request: environment, X-API-Key header, then bearer token
+    api_key = os.environ.get('BAYARD_API_KEY')
+    if api_key:
+        return api_key, "environment"
+    api_key = request.headers.get('X-API-Key')
+    if api_key:
+        return api_key, "X-API-Key header"
+    auth_header = request.headers.get('Authorization')
+    if auth_header and auth_header.startswith('Bearer'):
+        return auth_header.split(' ')[1], "Authorization header"
+    return None, None
+
+
+@web.middleware
+async def authenticate_request(request, handler):
+    request["start"] = time.perf_counter()
+    start_request_timing()
+    start_deadline(request.headers.get(DEADLINE_HEADER))
+    start_usage_collection()
+
+    # CORS preflight requests never carry credentials
+    if request.method == 'OPTIONS':
+        return web.Response()
+    if request.path in UNAUTHENTICATED_PATHS:
+        return await handler(request)
+
+    api_key, key_source = get_request_api_key(request)
+    if not api_key:
+        logger.error("API key not found in request headers or environment variable")
+        return web.json_response({'error': 'API key not configured'}, status=500)
+
+    redis = get_async_redis()
+    api_key_tier = await get_api_key_tier_async(redis, api_key)
+    if api_key_tier is None:
+        return web.json_response({'error': 'Invalid API key'}, status=401)
+    request["api_key"] = api_key
+    request["api_key_source"] = key_source
+    request["api_key_tier"] = api_key_tier
+
+    # A batch counts once per query
+    cost = 1
+    if request.path == '/api/bayard/batch':
+        cost = len(parse_batch_queries(await read_json(request)) or []) or 1
+    if cost > max_cost(api_key_tier):
+        # Waiting would not help, so it is refused as a bad request rather than a 429
+        return web.json_response({'error': f"A batch can contain at most {max_cost(api_key_tier)} queries for this API key"},
+                                 status=400)
+    request["rate_limit"] = await check_rate_limit_async(redis, api_key, api_key_tier, cost)
+    if not request["rate_limit"].allowed:
+        return web.json_response({'error': 'Rate limit exceeded'}, status=429)
+
+    if not ADMISSION_ENABLED or request.method != 'POST' or request.path not in ADMITTED_PATHS:
+        return await handler(request)
+    return await admit_request(request, handler, api_key_tier)
+
+
+async def admit_request(request, handler, api_key_tier):
+    body = await read_json(request)
+    if request.path == '/api/bayard/batch':
+        queries = parse_batch_queries(body) or []
+    else:
+        queries = [(body if isinstance(body, dict) else {}).get("input_text") or ""]
+    try:
+        ticket = await admission.acquire_async(api_key_tier, estimate_cost(guess_query_types(queries)))
+    except AdmissionRejected as e:
+        logger.warning("Refused %s: %s", request.path, e)
+        return web.json_response({'error': 'Server is at capacity, please retry later'}, status=503,
+                                 headers={"Retry-After": str(e.retry_after)})
+    try:
+        # Streamed responses keep their slot until the stream is written
+        return await handler(request)
+    finally:
+        admission.release(ticket)
+
+
+async def add_headers(request, response):
+    # Runs before the headers are sent, so it covers streamed responses too
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Allow-Headers'] = f'Content-Type, Authorization, {DEADLINE_HEADER}'
+    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS'
+    if degraded():
+        response.headers["X-Degraded"] = ",".join(degraded())
+    if request.get("rate_limit") is not None:
+        response.headers.extend(rate_limit_headers(request["rate_limit"]))
+    if request.get("answer_cache") is not None:
+        response.headers["X-Answer-Cache"] = request["answer_cache"]
+    if request.get("start") is not None:
+        # Streamed responses only report the stages that ran before the stream started
+        elapsed = time.perf_counter() - request["start"]
+        response.headers["Server-Timing"] = server_timing_header(elapsed)
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource is not None else "unmatched"
+        observe_request(route, request.method, response.status, elapsed)
+
+
+async def close_clients(app):
+    await close_async_clients()
+
+
+def create_app():
+    app = web.Application(middlewares=[authenticate_request])
+    app.add_routes(routes)
+    app.on_response_prepare.append(add_headers)
+    app.on_cleanup.append(close_clients)
+    return app
+
+
+app = create_app()
+
+if __name__ == "__main__":
+    web.run_app(app, host="0.0.0.0", port=5550)
@@ -0,0 +1,65 @@
+import os
+import httpx
+import cohere
+import openai
+import redis.asyncio as aioredis
+from elasticsearch import AsyncElasticsearch
+from resilience import ES_TIMEOUT, OPENAI_TIMEOUT, COHERE_TIMEOUT
+
+# Connections each client may hold open to its upstream; the library defaults
+# (10 for Elasticsearch, 100 for Cohere) would cap the requests in flight
+ASYNC_MAX_CONNECTIONS = int(os.environ.get("ASYNC_MAX_CONNECTIONS", "512"))
+
+# Async counterparts of the module-level clients, for async_app. They are
+# created on first use so they bind to the event loop of the worker process.
+_clients = {}
+
+
+def get_async_redis():
+    client = _clients.get("redis")
+    if client is None:
+        client = _clients["redis"] = aioredis.from_url(os.environ.get("REDIS_URL"))
+    return client
+
+
+def get_async_elasticsearch():
+    client = _clients.get("elasticsearch")
+    if client is None:
+        client = _clients["elasticsearch"] = AsyncElasticsearch(
+            os.environ.get("ES_URL"), api_key=os.environ.get("ES_API_KEY"),
+            connections_per_node=ASYNC_MAX_CONNECTIONS, request_timeout=ES_TIMEOUT, max_retries=0,
+        )
+    return client
+
+
+def get_async_openai():
+    client = _clients.get("openai")
+    if client is None:
+        client = _clients["openai"] = openai.AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"),
+                                                         timeout=OPENAI_TIMEOUT, max_retries=0)
+    return client
+
+
+def get_async_cohere():
+    client = _clients.get("cohere")
+    if client is None:
+        _clients["cohere_http"] = httpx.AsyncClient(
+            timeout=None, limits=httpx.Limits(max_connections=ASYNC_MAX_CONNECTIONS)
+        )
+        client = _clients["cohere"] = cohere.AsyncClient(api_key=os.getenv('COHERE_API_KEY'), timeout=COHERE_TIMEOUT,
+                                                         httpx_client=_clients["cohere_http"])
+    return client
+
+
+async def close_async_clients():
+    """Close every async client opened by this process."""
+    clients = dict(_clients)
+    _clients.clear()
+    if "redis" in clients:
+        await clients["redis"].aclose()
+    if "elasticsearch" in clients:
+        await clients["elasticsearch"].close()
+    if "openai" in clients:
+        await clients["openai"].close()
+    if "cohere_http" in clients:
+        await clients["cohere_http"].aclose()
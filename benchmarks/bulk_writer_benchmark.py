@@ -0,0 +1,115 @@
+"""
+Compare per-row inserts with the bulk writer for the conversations and runs tables.
+
+Each request thread stores a conversation row and a run row. "per_row" writes
+each with its own statement on the request thread, as conversation_logger and
+store_run did before bulk_writer.py. "bulk" hands both to BulkWriters. The
+table is simulated with a fixed cost per statement (--statement-latency, the
+round trip and commit) plus a cost per row (--row-latency), and at most
+--connections statements run at once, like the database pool.
+
+The report gives the time each request spent storing its rows, the rows
+written per second, and the statements issued.
+
+Usage:
+    python -m benchmarks.bulk_writer_benchmark
+    python -m benchmarks.bulk_writer_benchmark --requests 5000 --threads 32 --statement-latency 0.01 --output bulk.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.harness import latency_summary
+
+
+class SimulatedTable:
+    """A table whose writes sleep as long as a real statement would take."""
+
+    def __init__(self, statement_latency, row_latency, connections):
+        self.statement_latency = statement_latency
+        self.row_latency = row_latency
+        self.connections = threading.BoundedSemaphore(connections)
+        self.statements = 0
+        self.rows = 0
+        self.lock = threading.Lock()
+
+    def write_rows(self, rows):
+        with self.connections:
+            time.sleep(self.statement_latency + self.row_latency * len(rows))
+        with self.lock:
+            self.statements += 1
+            self.rows += len(rows)
+
+
+def run(mode, args):
+    from bulk_writer import BulkWriter, _writers
+    conversations = SimulatedTable(args.statement_latency, args.row_latency, args.connections)
+    runs = SimulatedTable(args.statement_latency, args.row_latency, args.connections)
+    writers = []
+    if mode == "bulk":
+        writers = [BulkWriter("benchmark_conversations", conversations.write_rows, batch_size=args.batch_size),
+                   BulkWriter("benchmark_runs", runs.write_rows, batch_size=args.batch_size)]
+
+    def request(number):
+        conversation = [f"query {number}", "answer", None, None, None, None, None]
+        run_record = {"run_id": str(number), "model_output": "answer"}
+        start = time.perf_counter()
+        if writers:
+            writers[0].add(conversation)
+            writers[1].add(run_record)
+        else:
+            conversations.write_rows([conversation])
+            runs.write_rows([run_record])
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        latencies = list(executor.map(request, range(args.requests)))
+    for writer in writers:
+        writer.close()
+        _writers.remove(writer)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "request_store": latency_summary(latencies),
+        "rows_per_second": round((conversations.rows + runs.rows) / elapsed, 1),
+        "statements": conversations.statements + runs.statements,
+        "seconds": round(elapsed, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=16, help="Concurrent requests.")
+    parser.add_argument("--connections", type=int, default=10, help="Statements that may run at once.")
+    parser.add_argument("--statement-latency", type=float, default=0.005, help="Seconds per statement.")
+    parser.add_argument("--row-latency", type=float, default=0.0001, help="Seconds per row written.")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    args = parser.parse_args()
+
+    # Rows are only spilled if the simulated table fails, which it does not
+    os.environ.setdefault("REDIS_URL", "redis://localhost:6379/0")
+
+    report = {
+        "requests": args.requests,
+        "threads": args.threads,
+        "statement_latency_ms": args.statement_latency * 1000,
+        "per_row": run("per_row", args),
+        "bulk": run("bulk", args),
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
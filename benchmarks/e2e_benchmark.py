@@ -0,0 +1,242 @@
+"""
+End-to-end benchmark of /api/bayard against local stand-ins for every upstream.
+
+The app runs under gunicorn with OpenAI, Cohere, Supabase and Elasticsearch
+served from localhost (see fake_upstreams.py and fake_elasticsearch.py) and
+Redis from fakeredis. Search and conversation queries are sent at a fixed
+concurrency and the report gives p50/p95/p99 latency and requests/s per
+path, plus the per-stage times the app reports in Server-Timing.
+
+Latencies accept a fixed number of seconds or a distribution such as
+"lognormal:0.8,0.4" (median, sigma), "uniform:0.2,1.0" or "normal:0.5,0.1".
+Pass --database-url to evaluate and store runs inline against a local
+Postgres; otherwise they are queued on Redis.
+
+Usage:
+    python -m benchmarks.e2e_benchmark --output baseline.json
+    python -m benchmarks.e2e_benchmark --fixture hits.json --openai-latency lognormal:1.2,0.5 --output after.json
+    python -m benchmarks.e2e_benchmark --compare baseline.json --output after.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import subprocess
+from collections import defaultdict
+import aiohttp
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.fake_elasticsearch import synthetic_corpus, load_fixture
+from benchmarks.fake_upstreams import latency_distribution, make_answer
+from benchmarks.harness import (API_KEY, SEARCH_QUERIES, CONVERSATION_QUERIES, Upstreams, start_app,
+                                prepare_database, latency_summary)
+
+# Metrics compared by --compare; latencies regress upwards, throughput downwards
+LATENCY_METRICS = ("p50_ms", "p95_ms", "p99_ms")
+
+
+def parse_server_timing(header):
+    """
+    Returns:
+    dict: Stage name to seconds, from a header such as "classify_query;dur=12.3, total;dur=812.0".
+    """
+    durations = {}
+    for item in (header or "").split(","):
+        name, *params = item.strip().split(";")
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "dur" and value and name != "total":
+                durations[name] = float(value) / 1000
+    return durations
+
+
+async def drive(url, concurrency, total, conversation_ratio, timeout, seed):
+    """
+    Send total requests to /api/bayard from concurrency clients.
+
+    Returns:
+    dict: Per path, the latencies and errors, and the stage durations reported by the app.
+    """
+    rng = random.Random(seed)
+    plan = [("conversation", rng.choice(CONVERSATION_QUERIES)) if rng.random() < conversation_ratio
+            else ("search", rng.choice(SEARCH_QUERIES)) for _ in range(total)]
+    pending = iter(enumerate(plan))
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    stages = defaultdict(list)
+    headers = {"X-API-Key": API_KEY}
+
+    async def client(session):
+        for i, (path, query) in pending:
+            # A fresh user each time, so conversation history stays empty and requests stay comparable
+            body = {"input_text": query, "user_id": f"bench-{seed}-{i}"}
+            start = time.perf_counter()
+            try:
+                async with session.post(f"{url}/api/bayard", json=body, headers=headers) as response:
+                    await response.read()
+                    ok = response.status == 200
+                    durations = parse_server_timing(response.headers.get("Server-Timing"))
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                ok = False
+            if not ok:
+                errors[path] += 1
+                continue
+            latencies[path].append(time.perf_counter() - start)
+            for name, duration in durations.items():
+                stages[name].append(duration)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return {"latencies": latencies, "errors": errors, "stages": stages, "elapsed": elapsed}
+
+
+def build_report(run, args):
+    paths = {}
+    for path in ("search", "conversation"):
+        latencies = run["latencies"].get(path, [])
+        paths[path] = {"requests": len(latencies), "errors": run["errors"].get(path, 0),
+                       "rps": round(len(latencies) / run["elapsed"], 2), **latency_summary(latencies)}
+    everything = [latency for latencies in run["latencies"].values() for latency in latencies]
+    overall = {"requests": len(everything), "errors": sum(run["errors"].values()),
+               "rps": round(len(everything) / run["elapsed"], 2), **latency_summary(everything)}
+    stages = {name: {"count": len(durations), **latency_summary(durations)}
+              for name, durations in sorted(run["stages"].items())}
+    return {
+        "config": {
+            "mode": args.mode,
+            "workers": args.workers,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "conversation_ratio": args.conversation_ratio,
+            "openai_latency": args.openai_latency,
+            "cohere_latency": args.cohere_latency,
+            "es_latency": args.es_latency,
+            "answer_words": args.answer_words,
+            "corpus": args.fixture or "synthetic",
+            "inline_persistence": bool(args.database_url),
+        },
+        "environment": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count(),
+                        "commit": git_commit()},
+        "overall": overall,
+        "paths": paths,
+        "stages": stages,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__)).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(report, baseline, threshold):
+    """
+    Print the change of each metric against a baseline report.
+
+    Returns:
+    list: Descriptions of the metrics that regressed by more than threshold.
+    """
+    for key, value in report["config"].items():
+        if baseline.get("config", {}).get(key) != value:
+            print(f"  note: {key} differs ({baseline.get('config', {}).get(key)!r} -> {value!r})")
+    regressions = []
+    for section in ["overall"] + [f"paths.{path}" for path in report["paths"]]:
+        current = report["overall"] if section == "overall" else report["paths"][section.split(".")[1]]
+        previous = baseline["overall"] if section == "overall" else baseline.get("paths", {}).get(section.split(".")[1], {})
+        for metric in LATENCY_METRICS + ("rps",):
+            before, after = previous.get(metric), current.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            worse = change > threshold if metric in LATENCY_METRICS else change < -threshold
+            print(f"  {section:<18} {metric:<7} {before:>10} -> {after:>10} ({change:+.1%}){'  REGRESSION' if worse else ''}")
+            if worse:
+                regressions.append(f"{section} {metric} {change:+.1%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("sync", "async"), default="sync", help="Serve app.py or async_app.py.")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers.")
+    parser.add_argument("--concurrency", type=int, default=16, help="Clients sending requests at once.")
+    parser.add_argument("--requests", type=int, default=400, help="Requests to measure.")
+    parser.add_argument("--warmup", type=int, default=20, help="Requests sent first and not measured.")
+    parser.add_argument("--conversation-ratio", type=float, default=0.2, help="Share of conversation queries.")
+    parser.add_argument("--openai-latency", default="lognormal:0.8,0.3")
+    parser.add_argument("--cohere-latency", default="lognormal:0.15,0.3")
+    parser.add_argument("--es-latency", default="lognormal:0.05,0.3")
+    parser.add_argument("--supabase-latency", default="0.02")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Seconds between streamed OpenAI tokens.")
+    parser.add_argument("--answer-words", type=int, default=120, help="Length of every OpenAI answer.")
+    parser.add_argument("--fixture", help="Recorded bayardcorpus hits (es_query_benchmark --record).")
+    parser.add_argument("--database-url", help="Local Postgres for inline run persistence.")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--output", help="Write the report as JSON to this file.")
+    parser.add_argument("--compare", help="Baseline report to compare against.")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change counted as a regression.")
+    parser.add_argument("--app-log", default=os.devnull, help="File for the app's own log output.")
+    args = parser.parse_args()
+
+    docs = load_fixture(args.fixture) if args.fixture else synthetic_corpus()
+    upstreams = Upstreams(
+        docs,
+        openai_latency=latency_distribution(args.openai_latency, args.seed),
+        cohere_latency=latency_distribution(args.cohere_latency, args.seed + 1),
+        es_latency=latency_distribution(args.es_latency, args.seed + 2),
+        supabase_latency=latency_distribution(args.supabase_latency, args.seed + 3),
+        answer=make_answer(args.answer_words),
+        token_delay=args.token_delay,
+    ).start()
+    if args.database_url:
+        prepare_database(args.database_url)
+
+    log = open(args.app_log, "a")
+    try:
+        process, url = start_app(args.mode, args.workers, upstreams.env(args.database_url), log)
+        try:
+            if args.warmup:
+                asyncio.run(drive(url, args.concurrency, args.warmup, args.conversation_ratio, args.timeout, args.seed - 1))
+            run = asyncio.run(drive(url, args.concurrency, args.requests, args.conversation_ratio, args.timeout, args.seed))
+        finally:
+            process.terminate()
+            process.wait()
+        upstream_requests = upstreams.requests()
+    finally:
+        upstreams.stop()
+        log.close()
+
+    report = build_report(run, args)
+    report["upstream_requests"] = upstream_requests
+    print(json.dumps(report, indent=2))
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"\nCompared with {args.compare}:")
+        regressions = compare(report, baseline, args.threshold)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if regressions:
+        print(f"\n{len(regressions)} metric(s) regressed by more than {args.threshold:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Compare response size and latency of the original Elasticsearch query with the lean one.
+
+The original query fetches the full _source of 10 hits and drops duplicate
+titles in Python; the lean query requests only the response fields and
+collapses titles on the server.
+
+Usage:
+    python -m benchmarks.es_query_benchmark                      # local stand-in, synthetic corpus
+    python -m benchmarks.es_query_benchmark --fixture hits.json   # local stand-in, recorded hits
+    python -m benchmarks.es_query_benchmark --es-url URL --es-api-key KEY [--record hits.json]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import requests
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.fake_elasticsearch import FakeElasticsearch, synthetic_corpus, load_fixture
+
+QUERIES = [
+    "history of the Stonewall riots",
+    "what is gender identity",
+    "transgender experiences in the workplace",
+    "LGBTQ youth mental health",
+    "same-sex marriage legislation",
+    "queer representation in media",
+    "intersectionality of race and sexuality",
+    "pride month origins",
+]
+
+INDEX = "bayardcorpus"
+ELSER_MODEL = ".elser_model_2_linux-x86_64"
+
+
+def legacy_body(query, size=10):
+    # The query as originally sent by search_elasticsearch
+    return {
+        "query": {"text_expansion": {"content_embedding": {"model_id": ELSER_MODEL, "model_text": query}}},
+        "size": size,
+    }
+
+
+def lean_body(query, size=10, collapse_field="title.keyword"):
+    from elasticsearch_utils import build_search_body
+    return build_search_body(query, size, collapse_field)
+
+
+def unique_titles(hits):
+    return len({hit["_source"].get("title") for hit in hits})
+
+
+def run_variant(session, url, headers, body_for, repeat, params=None):
+    sizes, latencies, unique = [], [], []
+    for _ in range(repeat):
+        for query in QUERIES:
+            start = time.perf_counter()
+            response = session.post(f"{url}/{INDEX}/_search", json=body_for(query), headers=headers, params=params)
+            response.raise_for_status()
+            payload = response.json()
+            latencies.append((time.perf_counter() - start) * 1000)
+            sizes.append(len(response.content))
+            unique.append(unique_titles(payload["hits"]["hits"]))
+    latencies.sort()
+    return {
+        "mean_response_bytes": round(statistics.mean(sizes)),
+        "p50_ms": round(latencies[len(latencies) // 2], 3),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 3),
+        "mean_unique_documents": round(statistics.mean(unique), 2),
+    }
+
+
+def record(session, url, headers, path):
+    # Save full hits so later runs can replay them through the stand-in
+    docs = {}
+    for query in QUERIES:
+        response = session.post(f"{url}/{INDEX}/_search", json=legacy_body(query, 50), headers=headers)
+        response.raise_for_status()
+        for hit in response.json()["hits"]["hits"]:
+            docs[hit["_id"]] = {"_id": hit["_id"], **hit["_source"]}
+    with open(path, "w") as f:
+        json.dump(list(docs.values()), f)
+    print(f"Recorded {len(docs)} documents to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--es-url", help="Benchmark a real cluster instead of the local stand-in.")
+    parser.add_argument("--es-api-key", default=os.environ.get("ES_API_KEY"))
+    parser.add_argument("--fixture", help="Recorded documents for the local stand-in.")
+    parser.add_argument("--record", help="Record hits from --es-url to this file and exit.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Base latency added by the stand-in.")
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    args = parser.parse_args()
+
+    session = requests.Session()
+    headers = {"Authorization": f"ApiKey {args.es_api_key}"} if args.es_url and args.es_api_key else {}
+
+    fake = None
+    if args.es_url:
+        url = args.es_url.rstrip("/")
+        if args.record:
+            record(session, url, headers, args.record)
+            return
+    else:
+        docs = load_fixture(args.fixture) if args.fixture else synthetic_corpus()
+        fake = FakeElasticsearch(docs, latency=lambda: args.latency_ms / 1000).start()
+        url = fake.url
+
+    try:
+        results = {
+            "target": "elasticsearch" if args.es_url else ("fixture" if args.fixture else "synthetic"),
+            "queries": len(QUERIES) * args.repeat,
+            "legacy": run_variant(session, url, headers, legacy_body, args.repeat),
+            "lean": run_variant(session, url, headers, lean_body, args.repeat, params={"request_cache": "true"}),
+        }
+    finally:
+        if fake is not None:
+            fake.stop()
+
+    results["bytes_reduction"] = round(1 - results["lean"]["mean_response_bytes"] / results["legacy"]["mean_response_bytes"], 4)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
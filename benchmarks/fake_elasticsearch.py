@@ -0,0 +1,196 @@
+"""
+A local stand-in for the parts of the Elasticsearch HTTP API the app uses.
+
+It serves _search and _msearch against an in-memory list of documents, honouring size,
+_source includes and collapse, and ranks documents by term overlap with the
+ELSER model_text. Documents are either recorded bayardcorpus hits or a
+deterministic synthetic corpus shaped like them.
+"""
+import json
+import time
+import random
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = (
+    "queer history stonewall riots transgender rights identity pride activism community "
+    "health education policy law marriage equality youth media representation culture "
+    "gender sexuality discrimination movement literature research survey experiences "
+    "workplace family religion politics archive oral memory visibility intersectionality"
+).split()
+
+
+class LocalServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Load tests open hundreds of connections at once; the default backlog of 5 drops them
+    request_queue_size = 1024
+
+
+def synthetic_corpus(num_docs=500, duplicate_ratio=0.3, embedding_tokens=150, seed=7, abstract_words=(120, 260)):
+    """
+    Build documents with the fields of bayardcorpus, including an ELSER
+    content_embedding token-weight map, with some titles repeated.
+    """
+    rng = random.Random(seed)
+    docs = []
+    for i in range(num_docs):
+        if docs and rng.random() < duplicate_ratio:
+            title = rng.choice(docs)["title"]
+        else:
+            title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 10))).title()
+        docs.append({
+            "_id": f"doc-{i}",
+            "title": title,
+            "abstract": " ".join(rng.choice(WORDS) for _ in range(rng.randint(*abstract_words))),
+            "authors": [f"{{'name': 'Author {rng.randint(1, 999)}'}}" for _ in range(rng.randint(1, 4))],
+            "classification": rng.choice(["History", "Health", "Law", "Culture", "Education"]),
+            "concepts": rng.sample(WORDS, 5),
+            "yearPublished": rng.randint(1970, 2024),
+            "downloadUrl": f"https://core.ac.uk/download/{rng.randint(10 ** 6, 10 ** 8)}.pdf",
+            "emotion": rng.choice(["joy", "sadness", "anger", "neutral"]),
+            "sentiment": rng.choice(["positive", "negative", "neutral"]),
+            "categories": rng.sample(["history", "health", "law", "culture", "education", "media"], 2),
+            "content_embedding": {
+                f"{rng.choice(WORDS)}{n}": round(rng.uniform(0.01, 3.0), 4) for n in range(embedding_tokens)
+            },
+        })
+    return docs
+
+
+def load_fixture(path):
+    """Load documents recorded with es_query_benchmark --record."""
+    with open(path) as f:
+        return json.load(f)
+
+
+def _source_field(doc, field):
+    # Keyword sub-fields such as title.keyword collapse on the parent field's value
+    return doc.get(field[:-len(".keyword")] if field.endswith(".keyword") else field)
+
+
+def prepare(docs):
+    """Pre-tokenize documents for run_search."""
+    prepared = []
+    for doc in docs:
+        words = f"{doc.get('title', '')} {doc.get('abstract', '')}".lower().split()
+        prepared.append((Counter(words), 1 + len(words) ** 0.5, doc))
+    return prepared
+
+
+def run_search(prepared, body):
+    """Evaluate a search body against prepared documents and build an Elasticsearch response."""
+    expansion = body.get("query", {}).get("text_expansion", {})
+    model_text = next(iter(expansion.values()), {}).get("model_text", "") if expansion else ""
+    terms = set(model_text.lower().split())
+
+    scored = [(sum(counts[term] for term in terms) / norm, doc) for counts, norm, doc in prepared]
+    scored.sort(key=lambda item: (-item[0], item[1]["_id"]))
+
+    collapse_field = body.get("collapse", {}).get("field")
+    includes = body.get("_source", {}).get("includes") if isinstance(body.get("_source"), dict) else None
+    size = body.get("size", 10)
+
+    hits = []
+    seen = set()
+    for score, doc in scored:
+        if collapse_field:
+            value = _source_field(doc, collapse_field)
+            if value in seen:
+                continue
+            seen.add(value)
+        source = {key: value for key, value in doc.items() if key != "_id"}
+        if includes is not None:
+            source = {key: value for key, value in source.items() if key in includes}
+        hits.append({"_index": "bayardcorpus", "_id": doc["_id"], "_score": round(score + 1.0, 6), "_source": source})
+        if len(hits) >= size:
+            break
+
+    return {
+        "took": 1,
+        "timed_out": False,
+        "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+        "hits": {
+            "total": {"value": len(prepared), "relation": "eq"},
+            "max_score": hits[0]["_score"] if hits else None,
+            "hits": hits,
+        },
+    }
+
+
+class FakeElasticsearch:
+    """
+    Serve _search and _msearch on localhost in a background thread.
+
+    Parameters:
+    docs (list): Documents to search.
+    latency (callable): Returns the seconds to sleep before answering each request.
+    """
+
+    def __init__(self, docs, latency=None, host="127.0.0.1", port=0):
+        self.docs = prepare(docs)
+        self.latency = latency or (lambda: 0.0)
+        self.requests = 0
+        handler = self._handler_class()
+        self.server = LocalServer((host, port), handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, payload):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                # The Python client refuses to talk to servers without this header
+                self.send_header("X-Elastic-Product", "Elasticsearch")
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._send_json(200, {"version": {"number": "8.13.0"}, "tagline": "You Know, for Search"})
+
+            def do_HEAD(self):
+                self.send_response(200)
+                self.send_header("X-Elastic-Product", "Elasticsearch")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                raw = self.rfile.read(length) if length else b"{}"
+                fake.requests += 1
+                time.sleep(fake.latency())
+                path = self.path.split("?")[0]
+                if path.endswith("/_msearch"):
+                    # NDJSON body of alternating header and search body lines
+                    lines = [json.loads(line) for line in raw.splitlines() if line.strip()]
+                    responses = [dict(run_search(fake.docs, body), status=200) for body in lines[1::2]]
+                    self._send_json(200, {"took": 1, "responses": responses})
+                elif path.endswith("/_search"):
+                    self._send_json(200, run_search(fake.docs, json.loads(raw or b"{}")))
+                else:
+                    self._send_json(404, {"error": f"unsupported path {path}"})
+
+        return Handler
@@ -0,0 +1,234 @@
+"""
+Local stand-ins for the OpenAI, Cohere and Supabase HTTP APIs the app uses.
+
+FakeOpenAI serves chat completions (plain and streamed) and legacy
+completions; FakeCohere serves classify and chat; FakeSupabase accepts
+PostgREST inserts. Each answers after a configurable latency so load tests
+can model slow upstream calls without a network. Point the clients at them
+with OPENAI_BASE_URL, CO_API_URL and SUPABASE_URL.
+"""
+import re
+import json
+import time
+import uuid
+import random
+import threading
+from http.server import BaseHTTPRequestHandler
+from benchmarks.fake_elasticsearch import LocalServer
+
+ANSWER = (
+    "The Stonewall riots began on June 28, 1969, when patrons of the Stonewall Inn in New York "
+    "resisted a police raid. The uprising is widely seen as a turning point for LGBTQ activism."
+)
+# Conversation-style queries are recognised by these words, everything else is a search
+CONVERSATION_WORDS = {"hello", "hi", "hey", "thanks", "thank", "bye"}
+EVALUATION = "Relevance: 4\nCoherence: 4\nInformativeness: 4\nEngagement: 3\nOverall Score: 4"
+
+
+def latency_distribution(spec, seed=None):
+    """
+    Build a latency function from a spec string, in seconds.
+
+    "0.5" is a fixed latency; "uniform:LOW,HIGH", "normal:MEAN,SD" and
+    "lognormal:MEDIAN,SIGMA" sample from the named distribution, never below zero.
+
+    Returns:
+    callable: Returns the next latency.
+    """
+    rng = random.Random(seed)
+    kind, _, params = str(spec).partition(":")
+    if not params:
+        value = float(kind)
+        return lambda: value
+    a, b = (float(value) for value in params.split(","))
+    if kind == "uniform":
+        return lambda: rng.uniform(a, b)
+    if kind == "normal":
+        return lambda: max(rng.gauss(a, b), 0.0)
+    if kind == "lognormal":
+        return lambda: a * rng.lognormvariate(0.0, b)
+    raise ValueError(f"Unknown latency distribution {spec!r}")
+
+
+def make_answer(words):
+    """An answer of roughly the given number of words, built from ANSWER."""
+    base = ANSWER.split(" ")
+    return " ".join(base[i % len(base)] for i in range(words))
+
+
+class FakeUpstream:
+    """
+    Base class serving JSON POST endpoints on localhost in a background thread.
+
+    Parameters:
+    latency (callable): Returns the seconds to wait before answering each request.
+    """
+
+    def __init__(self, latency=None, host="127.0.0.1", port=0):
+        self.latency = latency or (lambda: 0.0)
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.server = LocalServer((host, port), self._handler_class())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, path, body, handler):
+        raise NotImplementedError
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def send_json(self, status, payload):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def send_events(self, events, delay=0.0):
+                # Server-sent events with a chunked body, as the OpenAI API streams them
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for event in events:
+                    data = f"data: {event}\n\n".encode("utf-8")
+                    self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                    self.wfile.flush()
+                    if delay:
+                        time.sleep(delay)
+                self.wfile.write(b"0\r\n\r\n")
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                raw = self.rfile.read(length) if length else b"{}"
+                with fake._lock:
+                    fake.requests += 1
+                    latency = fake.latency()
+                time.sleep(latency)
+                fake.handle(self.path.split("?")[0], json.loads(raw or b"{}"), self)
+
+        return Handler
+
+
+def _usage(prompt_tokens, completion_tokens):
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+
+class FakeOpenAI(FakeUpstream):
+    """
+    Serve /v1/chat/completions and /v1/completions.
+
+    Parameters:
+    latency (callable): Seconds before the response (or the first streamed token).
+    answer (str): The text every completion returns.
+    token_delay (float): Seconds between streamed tokens.
+    """
+
+    def __init__(self, latency=None, answer=ANSWER, token_delay=0.0, **kwargs):
+        super().__init__(latency, **kwargs)
+        self.answer = answer
+        self.token_delay = token_delay
+
+    def handle(self, path, body, handler):
+        prompt_tokens = len(json.dumps(body.get("messages") or body.get("prompt") or "")) // 4
+        completion_tokens = len(self.answer) // 4
+        created = int(time.time())
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        model = body.get("model") or "gpt-3.5-turbo"
+
+        if path.endswith("/chat/completions") and body.get("stream"):
+            words = self.answer.split(" ")
+            chunks = [word if i == 0 else f" {word}" for i, word in enumerate(words)]
+            events = [json.dumps({
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {"role": "assistant", "content": chunk}, "finish_reason": None}],
+            }) for chunk in chunks]
+            events.append(json.dumps({
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            }))
+            events.append("[DONE]")
+            handler.send_events(events, self.token_delay)
+        elif path.endswith("/chat/completions"):
+            handler.send_json(200, {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": self.answer}, "finish_reason": "stop"}],
+                "usage": _usage(prompt_tokens, completion_tokens),
+            })
+        elif path.endswith("/completions"):
+            # The search quality reflection prompt asks for a score out of 5
+            handler.send_json(200, {
+                "id": completion_id, "object": "text_completion", "created": created, "model": model,
+                "choices": [{"index": 0, "text": "Score: 4. The documents are relevant to the query.",
+                             "logprobs": None, "finish_reason": "stop"}],
+                "usage": _usage(prompt_tokens, 12),
+            })
+        else:
+            handler.send_json(404, {"error": {"message": f"unsupported path {path}"}})
+
+
+class FakeCohere(FakeUpstream):
+    """
+    Serve /v1/classify, labelling greetings as conversation and everything else
+    as search, and /v1/chat, answering with a response quality evaluation.
+    """
+
+    def handle(self, path, body, handler):
+        if path.endswith("/chat"):
+            handler.send_json(200, {
+                "response_id": str(uuid.uuid4()), "generation_id": str(uuid.uuid4()), "text": EVALUATION,
+                "finish_reason": "COMPLETE", "chat_history": [],
+                "meta": {"billed_units": {"input_tokens": len(json.dumps(body)) // 4, "output_tokens": 24}},
+            })
+            return
+        if not path.endswith("/classify"):
+            handler.send_json(404, {"message": f"unsupported path {path}"})
+            return
+        classifications = []
+        for query in body.get("inputs", []):
+            label = "Conversation" if CONVERSATION_WORDS & set(re.findall(r"[a-z]+", query.lower())) else "Search"
+            other = "Search" if label == "Conversation" else "Conversation"
+            classifications.append({
+                "id": str(uuid.uuid4()),
+                "input": query,
+                "prediction": label,
+                "predictions": [label],
+                "confidence": 0.9,
+                "confidences": [0.9],
+                "labels": {label: {"confidence": 0.9}, other: {"confidence": 0.1}},
+                "classification_type": "single-label",
+            })
+        handler.send_json(200, {"id": str(uuid.uuid4()), "classifications": classifications,
+                                "meta": {"api_version": {"version": "1"}}})
+
+
+class FakeSupabase(FakeUpstream):
+    """Accept PostgREST inserts under /rest/v1/ and echo the inserted rows."""
+
+    def handle(self, path, body, handler):
+        if not path.startswith("/rest/v1/"):
+            handler.send_json(404, {"message": f"unsupported path {path}"})
+            return
+        handler.send_json(201, body if isinstance(body, list) else [body])
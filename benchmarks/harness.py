@@ -0,0 +1,200 @@
+"""
+Shared set-up for the end-to-end benchmarks: local stand-ins for every
+upstream, and the app itself running under gunicorn against them.
+
+Redis is a fakeredis TCP server. Postgres is only needed when runs are
+persisted inline; by default they go to the Redis task queue, which nothing
+consumes during a benchmark.
+"""
+import os
+import sys
+import time
+import socket
+import hashlib
+import threading
+import subprocess
+import urllib.request
+import redis
+import fakeredis
+import numpy as np
+
+from benchmarks.fake_elasticsearch import FakeElasticsearch
+from benchmarks.fake_upstreams import FakeOpenAI, FakeCohere, FakeSupabase, ANSWER
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+API_KEY = "load-test-key"
+SEARCH_QUERIES = [
+    "history of the Stonewall riots",
+    "what is gender identity",
+    "transgender experiences in the workplace",
+    "LGBTQ youth mental health",
+    "same-sex marriage legislation",
+    "queer representation in media",
+    "intersectionality of race and sexuality",
+    "pride month origins",
+]
+CONVERSATION_QUERIES = [
+    "hello, how are you today?",
+    "hi there",
+    "thanks for the help",
+    "hey, what can you do?",
+]
+APPS = {
+    "sync": ["app:app"],
+    "async": ["--worker-class", "aiohttp.GunicornWebWorker", "async_app:app"],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_redis(api_key=API_KEY):
+    server = fakeredis.TcpFakeServer(("127.0.0.1", free_port()), server_type="redis")
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    url = f"redis://{host}:{port}/0"
+    client = redis.from_url(url)
+    # Seed the API key cache so requests authenticate without the keys table
+    client.set(f"api_key_valid:{hashlib.sha256(api_key.encode('utf-8')).hexdigest()}", "default")
+    # fakeredis' TCP server drops the connection when a script is loaded after a
+    # NOSCRIPT reply, so load the rate limiter script up front
+    from rate_limiter import _GCRA_LUA
+    client.script_load(_GCRA_LUA)
+    return server, url
+
+
+def prepare_database(database_url, api_key=API_KEY):
+    """Create the tables the inline persistence path writes to and register the benchmark key."""
+    import psycopg2
+    with psycopg2.connect(database_url) as conn, conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS keys (
+                api_key VARCHAR(255) PRIMARY KEY,
+                tier VARCHAR(32) NOT NULL DEFAULT 'default'
+            );
+            CREATE TABLE IF NOT EXISTS conversations (
+                input_text TEXT,
+                model_output TEXT,
+                relevance_score INTEGER,
+                coherence_score INTEGER,
+                informativeness_score INTEGER,
+                engagement_score INTEGER,
+                overall_score INTEGER
+            );
+        """)
+        cur.execute("INSERT INTO keys (api_key) VALUES (%s) ON CONFLICT DO NOTHING", (api_key,))
+
+
+class Upstreams:
+    """
+    Start every stand-in the app talks to.
+
+    Parameters:
+    docs (list): Documents for the Elasticsearch stand-in.
+    openai_latency, cohere_latency, es_latency, supabase_latency (callable):
+    Latency functions, see fake_upstreams.latency_distribution.
+    answer (str): Text of every OpenAI completion.
+    token_delay (float): Seconds between streamed OpenAI tokens.
+    """
+
+    def __init__(self, docs, openai_latency=None, cohere_latency=None, es_latency=None, supabase_latency=None,
+                 answer=ANSWER, token_delay=0.0):
+        self.es = FakeElasticsearch(docs, latency=es_latency)
+        self.openai = FakeOpenAI(latency=openai_latency, answer=answer, token_delay=token_delay)
+        self.cohere = FakeCohere(latency=cohere_latency)
+        self.supabase = FakeSupabase(latency=supabase_latency)
+        self.redis_server = None
+        self.redis_url = None
+
+    def start(self):
+        for fake in (self.es, self.openai, self.cohere, self.supabase):
+            fake.start()
+        self.redis_server, self.redis_url = start_redis()
+        return self
+
+    def stop(self):
+        for fake in (self.es, self.openai, self.cohere, self.supabase):
+            fake.stop()
+        self.redis_server.shutdown()
+
+    def requests(self):
+        return {"elasticsearch": self.es.requests, "openai": self.openai.requests,
+                "cohere": self.cohere.requests, "supabase": self.supabase.requests}
+
+    def env(self, database_url=None, **overrides):
+        """
+        Environment for the app. Without a database_url runs are queued on
+        Redis instead of being evaluated and stored inline.
+        """
+        env = dict(os.environ)
+        env.update({
+            "ES_URL": self.es.url,
+            "ES_API_KEY": "load-test",
+            "REDIS_URL": self.redis_url,
+            "OPENAI_BASE_URL": f"{self.openai.url}/v1",
+            "OPENAI_API_KEY": "load-test",
+            "OPENAI_MODEL_ID": "gpt-3.5-turbo",
+            "CO_API_URL": f"{self.cohere.url}/v1",
+            "COHERE_API_KEY": "load-test",
+            "SUPABASE_URL": self.supabase.url,
+            "SUPABASE_KEY": "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.load-test",
+            "BAYARD_BACKGROUND_TASKS": "false" if database_url else "true",
+            # Every request should reach the upstreams
+            "ANSWER_CACHE_ENABLED": "false",
+            "RATE_LIMIT_QUERIES": str(10 ** 9),
+            "WEAVE_ENABLED": "false",
+            "PYTHONPATH": ROOT,
+        })
+        if database_url:
+            env["DATABASE_URL"] = database_url
+        env.update(overrides)
+        return env
+
+
+def start_app(mode, workers, env, log=subprocess.DEVNULL):
+    """
+    Run the sync (Flask) or async (aiohttp) app under gunicorn and wait for its health check.
+
+    Returns:
+    tuple: The gunicorn process and the app's base URL.
+    """
+    port = free_port()
+    command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}",
+               "--workers", str(workers), "--log-level", "warning"] + APPS[mode]
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{mode} app exited with code {process.returncode}")
+        try:
+            with urllib.request.urlopen(f"{url}/health-check", timeout=1):
+                return process, url
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"{mode} app did not start")
+
+
+def latency_summary(latencies):
+    """
+    Parameters:
+    latencies (list): Latencies in seconds.
+
+    Returns:
+    dict: Mean and p50/p95/p99 in milliseconds.
+    """
+    if not latencies:
+        return {"mean_ms": None, "p50_ms": None, "p95_ms": None, "p99_ms": None}
+    values = np.array(latencies) * 1000
+    return {
+        "mean_ms": round(float(values.mean()), 1),
+        "p50_ms": round(float(np.percentile(values, 50)), 1),
+        "p95_ms": round(float(np.percentile(values, 95)), 1),
+        "p99_ms": round(float(np.percentile(values, 99)), 1),
+    }
@@ -0,0 +1,114 @@
+"""
+Compare tail latency of the Flask app (sync gunicorn workers) with the asyncio app as concurrency grows.
+
+Both apps run under gunicorn against local stand-ins for Elasticsearch,
+OpenAI, Cohere and Redis, with a fixed LLM latency, so the numbers show how
+many slow upstream calls each serving mode keeps in flight. Runs are
+evaluated on the Redis task queue (nothing consumes it here), so Postgres is
+not needed.
+
+Usage:
+    python -m benchmarks.load_test                                  # both modes, default sweep
+    python -m benchmarks.load_test --modes async --concurrency 16,64,256 --llm-latency 1.0
+    python -m benchmarks.load_test --output load.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import aiohttp
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.fake_elasticsearch import synthetic_corpus
+from benchmarks.fake_upstreams import latency_distribution
+from benchmarks.harness import API_KEY, SEARCH_QUERIES, Upstreams, start_app
+
+
+async def run_level(url, concurrency, total, timeout):
+    """Send total requests to /api/bayard from concurrency clients and collect latencies."""
+    latencies, errors = [], 0
+    counter = iter(range(total))
+    headers = {"X-API-Key": API_KEY}
+
+    async def client(session):
+        nonlocal errors
+        for i in counter:
+            body = {"input_text": SEARCH_QUERIES[i % len(SEARCH_QUERIES)], "user_id": f"load-{i % concurrency}"}
+            start = time.perf_counter()
+            try:
+                async with session.post(f"{url}/api/bayard", json=body, headers=headers) as response:
+                    await response.read()
+                    ok = response.status == 200
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    result = {"concurrency": concurrency, "requests": total, "errors": errors,
+              "rps": round(len(latencies) / elapsed, 1)}
+    if latencies:
+        result.update({
+            "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 1),
+            "p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 1),
+        })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default="sync,async", help="Comma separated: sync, async.")
+    parser.add_argument("--concurrency", default="1,8,32,128", help="Comma separated concurrency levels.")
+    parser.add_argument("--requests-per-client", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers per app.")
+    parser.add_argument("--llm-latency", default="0.5", help="Seconds per OpenAI and Cohere call, or a distribution (see fake_upstreams).")
+    parser.add_argument("--es-latency", default="0.02", help="Seconds per Elasticsearch call, or a distribution.")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    parser.add_argument("--app-log", default=os.devnull, help="File for the apps' own log output.")
+    args = parser.parse_args()
+
+    upstreams = Upstreams(synthetic_corpus(), openai_latency=latency_distribution(args.llm_latency),
+                          cohere_latency=latency_distribution(args.llm_latency),
+                          es_latency=latency_distribution(args.es_latency)).start()
+    env = upstreams.env()
+
+    levels = [int(level) for level in args.concurrency.split(",")]
+    results = {}
+    log = open(args.app_log, "a")
+    try:
+        for mode in args.modes.split(","):
+            process, url = start_app(mode, args.workers, env, log)
+            try:
+                results[mode] = []
+                for concurrency in levels:
+                    result = asyncio.run(run_level(url, concurrency, concurrency * args.requests_per_client, args.timeout))
+                    results[mode].append(result)
+                    print(f"{mode:>5} c={concurrency:<4} p50={result.get('p50_ms')}ms p99={result.get('p99_ms')}ms "
+                          f"rps={result['rps']} errors={result['errors']}")
+            finally:
+                process.terminate()
+                process.wait()
+    finally:
+        upstreams.stop()
+        log.close()
+
+    report = {"workers": args.workers, "llm_latency": args.llm_latency, "es_latency": args.es_latency, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Measure the time the request path spends logging, before and after logging_setup.
+
+"before" reproduces the log lines of a search request as they were written
+with logging.basicConfig: the API key lines, the full response data, the
+stage timings and the token usage, all as f-strings on a handler that writes
+on the calling thread. "after" writes the same request's lines as
+logging_setup does: lazy arguments and a sampled payload on the background
+queue.
+
+The sink can be made slow with --write-delay to stand in for a blocked
+stderr pipe or log collector; "before" pays that delay inside every request.
+
+Usage:
+    python -m benchmarks.logging_overhead
+    python -m benchmarks.logging_overhead --requests 5000 --write-delay 0.0005 --output logging.json
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.fake_elasticsearch import synthetic_corpus
+from benchmarks.fake_upstreams import make_answer
+
+API_KEY = "9tGQ3cW5nq2zK4bS1xYpV0aLmE7rDfHjUiO8kTn6PwM"
+
+
+class Sink:
+    """A write-only stream that optionally sleeps on every write."""
+
+    def __init__(self, path, write_delay):
+        self.file = open(path, "w")
+        self.write_delay = write_delay
+        self.bytes = 0
+
+    def write(self, text):
+        if self.write_delay:
+            time.sleep(self.write_delay)
+        self.bytes += len(text)
+        return self.file.write(text)
+
+    def flush(self):
+        self.file.flush()
+
+
+def sample_request():
+    docs = synthetic_corpus(num_docs=10, embedding_tokens=0)
+    response_data = {
+        "run_id": "7d7c1c1e-8f0e-4a5b-9b4e-0b9a3c2d1e0f",
+        "timestamp": "2024-05-01T12:00:00",
+        "input_text": "history of the Stonewall riots",
+        "search_quality_reflection": "The top 5 documents cover 100% of the query terms.",
+        "search_quality_score": 4,
+        "documents": [{key: value for key, value in doc.items() if key != "content_embedding"} for doc in docs],
+        "model_output": make_answer(250),
+    }
+    stage_timings = {"stage_durations": {"classify_query": 0.0123, "generate_model_output": 1.2345}, "wall_time": 1.3}
+    usage = [{"stage": "generate_model_output", "model": "gpt-3.5-turbo", "prompt_tokens": 3000,
+              "completion_tokens": 400, "estimated": False}]
+    totals = {"prompt_tokens": 3000, "completion_tokens": 400, "calls": 1}
+    return response_data, stage_timings, (totals, usage)
+
+
+def log_request_before(response_data, stage_timings, usage):
+    logging.info(f"Retrieved API key from environment variable: {None}")
+    logging.info(f"Retrieved API key from X-API-Key header: {API_KEY}")
+    logging.info(f"API key exists in database: {True}")
+    logging.info(f"Response Data: {response_data}")
+    logging.info(f"Stage timings: {stage_timings}")
+    logging.info(f"Token usage: {usage[0]} {usage[1]}")
+
+
+def log_request_after(response_data, stage_timings, usage):
+    logger = logging.getLogger("app")
+    logger.debug("API key from %s exists: %s", "X-API-Key header", True)
+    logger.info("Answered search query run_id=%s with %d documents and %d output chars",
+                response_data["run_id"], len(response_data["documents"]), len(response_data["model_output"]),
+                extra={"payload": response_data})
+    logger.info("Stage timings: %s", stage_timings)
+    logger.info("Token usage: %s %s", *usage)
+
+
+def run(log_request, requests):
+    response_data, stage_timings, usage = sample_request()
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        log_request(response_data, stage_timings, usage)
+        latencies.append(time.perf_counter() - start)
+    values = np.array(latencies) * 1e6
+    return {
+        "mean_us": round(float(values.mean()), 1),
+        "p50_us": round(float(np.percentile(values, 50)), 1),
+        "p99_us": round(float(np.percentile(values, 99)), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--write-delay", type=float, default=0.0, help="Seconds every write to the sink takes.")
+    parser.add_argument("--log-dir", default="/tmp", help="Where the sinks' log files are written.")
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    args = parser.parse_args()
+
+    root = logging.getLogger()
+    sink = Sink(os.path.join(args.log_dir, "bayard-logging-before.log"), args.write_delay)
+    handler = logging.StreamHandler(sink)
+    handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    before = run(log_request_before, args.requests)
+    before["bytes_written"] = sink.bytes
+    root.removeHandler(handler)
+
+    from logging_setup import configure_logging, shutdown_logging
+    from metrics import LOG_RECORDS_DROPPED
+    sink = Sink(os.path.join(args.log_dir, "bayard-logging-after.log"), args.write_delay)
+    configure_logging(stream=sink)
+    after = run(log_request_after, args.requests)
+    start = time.perf_counter()
+    shutdown_logging()
+    after["drain_seconds"] = round(time.perf_counter() - start, 3)
+    after["dropped_records"] = int(LOG_RECORDS_DROPPED._value.get())
+    after["bytes_written"] = sink.bytes
+
+    report = {"requests": args.requests, "write_delay": args.write_delay, "before": before, "after": after}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
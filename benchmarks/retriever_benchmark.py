@@ -0,0 +1,141 @@
+"""
+Compare search latency of the Elasticsearch retriever with the local BM25 snapshot.
+
+Both retrievers answer the same queries one after another, bypassing the
+retrieval cache. The report gives p50/p95/p99 latency for each, how many of
+the local index's documents Elasticsearch also returned, and the latency of
+failover searches once Elasticsearch has gone away: the first few pay for
+the failed request and its retries, then the circuit breaker opens and the
+rest go straight to the snapshot.
+
+Usage:
+    python -m benchmarks.retriever_benchmark                        # local stand-in, synthetic corpus
+    python -m benchmarks.retriever_benchmark --es-latency lognormal:0.08,0.5 --docs 20000
+    python -m benchmarks.retriever_benchmark --es-url URL --es-api-key KEY --snapshot corpus_snapshot
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.es_query_benchmark import QUERIES
+from benchmarks.fake_elasticsearch import FakeElasticsearch, synthetic_corpus, load_fixture
+from benchmarks.fake_upstreams import latency_distribution
+from benchmarks.harness import latency_summary
+
+
+class UncachedElasticsearch:
+    # The Elasticsearch retriever without the retrieval cache, so every search reaches the cluster
+    name = "elasticsearch"
+
+    def available(self):
+        return True
+
+    def search(self, query):
+        from elasticsearch_utils import search_elasticsearch_uncached
+        return search_elasticsearch_uncached(query)
+
+
+def run(retriever, repeat):
+    latencies, results = [], {}
+    for _ in range(repeat):
+        for query in QUERIES:
+            start = time.perf_counter()
+            results[query] = retriever.search(query)
+            latencies.append(time.perf_counter() - start)
+    return latencies, results
+
+
+def overlap(results, reference):
+    # Share of each query's reference documents that the other retriever also returned
+    shares = []
+    for query, docs in reference.items():
+        if docs and results.get(query) is not None:
+            ids = {doc["_id"] for doc in results[query]}
+            shares.append(sum(doc["_id"] in ids for doc in docs) / len(docs))
+    return round(sum(shares) / len(shares), 4) if shares else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--es-url", help="Benchmark a real cluster instead of the local stand-in.")
+    parser.add_argument("--es-api-key", default=os.environ.get("ES_API_KEY"))
+    parser.add_argument("--snapshot", help="An existing snapshot; by default one is built from the stand-in's corpus.")
+    parser.add_argument("--fixture", help="Recorded documents for the stand-in and the snapshot.")
+    parser.add_argument("--docs", type=int, default=5000, help="Synthetic corpus size.")
+    parser.add_argument("--es-latency", default="0.02", help="Latency of the stand-in; see latency_distribution.")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    args = parser.parse_args()
+
+    if args.snapshot is None and args.es_url:
+        parser.error("--snapshot is required with --es-url")
+
+    fake = None
+    snapshot_dir = None
+    if args.es_url:
+        os.environ["ES_URL"] = args.es_url
+        os.environ["ES_API_KEY"] = args.es_api_key or ""
+    else:
+        docs = load_fixture(args.fixture) if args.fixture else synthetic_corpus(args.docs, embedding_tokens=0)
+        fake = FakeElasticsearch(docs, latency=latency_distribution(args.es_latency, seed=1)).start()
+        os.environ["ES_URL"] = fake.url
+        os.environ.setdefault("ES_API_KEY", "benchmark")
+    # The stand-in returns every hit in one response; hedging would only add noise here
+    os.environ.setdefault("HEDGING_ENABLED", "false")
+
+    from local_index import build_snapshot
+    from retrievers import FailoverRetriever, LocalRetriever
+
+    snapshot = args.snapshot
+    try:
+        if snapshot is None:
+            snapshot_dir = tempfile.mkdtemp(prefix="bayard-snapshot-")
+            snapshot = os.path.join(snapshot_dir, "corpus")
+            start = time.perf_counter()
+            meta = build_snapshot(docs, snapshot, source="benchmark")
+            build_seconds = round(time.perf_counter() - start, 3)
+        else:
+            with open(os.path.join(snapshot, "meta.json")) as f:
+                meta = json.load(f)
+            build_seconds = None
+
+        local = LocalRetriever(snapshot)
+        local.index()
+        es_latencies, es_results = run(UncachedElasticsearch(), args.repeat)
+        local_latencies, local_results = run(local, args.repeat)
+
+        report = {
+            "target": "elasticsearch" if args.es_url else ("fixture" if args.fixture else "synthetic"),
+            "queries": len(QUERIES) * args.repeat,
+            "snapshot": {"documents": meta["num_docs"], "terms": meta["num_terms"], "build_seconds": build_seconds},
+            "elasticsearch": latency_summary(es_latencies),
+            "local": latency_summary(local_latencies),
+            "local_overlap_with_elasticsearch": overlap(es_results, local_results),
+        }
+
+        if fake is not None:
+            fake.stop()
+            fake = None
+            failover_latencies, failover_results = run(FailoverRetriever(UncachedElasticsearch(), local), 1)
+            report["failover"] = latency_summary(failover_latencies)
+            report["failover"]["answered"] = sum(result is not None for result in failover_results.values())
+    finally:
+        if fake is not None:
+            fake.stop()
+        if snapshot_dir is not None:
+            shutil.rmtree(snapshot_dir, ignore_errors=True)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
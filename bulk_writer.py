@@ -0,0 +1,269 @@
+"""
+Write-behind buffering for the conversations and runs tables.
+
+A BulkWriter collects rows in memory and a background thread writes them
+with one statement per batch: as soon as BULK_WRITER_BATCH_SIZE rows are
+waiting, or when the oldest has waited BULK_WRITER_MAX_AGE seconds.
+
+The buffer holds at most BULK_WRITER_MAX_ROWS rows. When it is full, add()
+waits up to BULK_WRITER_PUT_TIMEOUT seconds for room, then spills the row
+to a Redis list instead. A row is only written directly, on the caller's
+thread, if Redis is unavailable as well. A batch that still fails after
+BULK_WRITER_RETRIES retries is spilled the same way. Spilled rows are
+written again later by whichever process next takes the replay lock. A
+spilled batch that fails BULK_WRITER_REPLAY_ATTEMPTS replays in a row is
+moved to a dead-letter list, so it no longer holds up the rows behind it.
+
+On exit the buffer is drained. Every row is written, or left in Redis, at
+least once. A process that is killed loses at most the rows it buffered
+in the last BULK_WRITER_MAX_AGE seconds.
+"""
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+from redis_utils import redis_client
+from metrics import timed, BULK_WRITER_ROWS
+
+logger = logging.getLogger(__name__)
+
+# Bulk writer configuration
+BULK_WRITES_ENABLED = os.environ.get("BULK_WRITES_ENABLED", "true").lower() in ("1", "true", "yes")
+BULK_WRITER_BATCH_SIZE = int(os.environ.get("BULK_WRITER_BATCH_SIZE", "100"))
+BULK_WRITER_MAX_AGE = float(os.environ.get("BULK_WRITER_MAX_AGE", "2"))
+BULK_WRITER_MAX_ROWS = int(os.environ.get("BULK_WRITER_MAX_ROWS", "5000"))
+BULK_WRITER_PUT_TIMEOUT = float(os.environ.get("BULK_WRITER_PUT_TIMEOUT", "1"))
+BULK_WRITER_RETRIES = int(os.environ.get("BULK_WRITER_RETRIES", "3"))
+BULK_WRITER_RETRY_DELAY = float(os.environ.get("BULK_WRITER_RETRY_DELAY", "0.5"))
+# Seconds between attempts to write spilled rows
+BULK_WRITER_REPLAY_INTERVAL = float(os.environ.get("BULK_WRITER_REPLAY_INTERVAL", "30"))
+# Failed replays of the same spilled batch before it is moved to the dead-letter list
+BULK_WRITER_REPLAY_ATTEMPTS = int(os.environ.get("BULK_WRITER_REPLAY_ATTEMPTS", "5"))
+# Seconds close() waits for the buffer to drain before spilling what is left
+BULK_WRITER_CLOSE_TIMEOUT = float(os.environ.get("BULK_WRITER_CLOSE_TIMEOUT", "10"))
+
+_writers = []
+
+
+class BulkWriter:
+    """
+    Buffer rows for a table and write them in batches on a background thread.
+
+    Parameters:
+    table (str): The table written, for metrics, logs and the spill key.
+    write_rows (callable): Writes a list of rows in one statement; raises on failure.
+    batch_size (int): Rows written per statement.
+    max_age (float): Seconds a row may wait for its batch to fill.
+    max_rows (int): Rows the buffer holds before add() waits.
+    """
+
+    def __init__(self, table: str, write_rows, batch_size: int = BULK_WRITER_BATCH_SIZE,
+                 max_age: float = BULK_WRITER_MAX_AGE, max_rows: int = BULK_WRITER_MAX_ROWS):
+        self.table = table
+        self.write_rows = write_rows
+        self.batch_size = batch_size
+        self.max_age = max_age
+        self.max_rows = max_rows
+        self.spill_key = f"bayard:bulk:{table}"
+        self.dead_key = f"{self.spill_key}:dead"
+        self._attempts_key = f"{self.spill_key}:attempts"
+        self._reset()
+        _writers.append(self)
+
+    def _reset(self):
+        self._cond = threading.Condition()
+        self._rows = []
+        self._oldest = None
+        self._closing = False
+        self._thread = None
+        self._last_replay = time.monotonic()
+
+    def _ensure_started(self):
+        # Called with the condition held
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"bayard-bulk-{self.table}", daemon=True)
+            self._thread.start()
+
+    def add(self, row):
+        """
+        Buffer a row for the next batch.
+
+        Waits up to BULK_WRITER_PUT_TIMEOUT seconds while the buffer is full,
+        then spills the row to Redis, or writes it directly if that fails too.
+        """
+        with self._cond:
+            if not self._closing:
+                self._ensure_started()
+                deadline = time.monotonic() + BULK_WRITER_PUT_TIMEOUT
+                while len(self._rows) >= self.max_rows and not self._closing:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if len(self._rows) < self.max_rows and not self._closing:
+                    if not self._rows:
+                        self._oldest = time.monotonic()
+                    self._rows.append(row)
+                    if len(self._rows) >= self.batch_size:
+                        self._cond.notify_all()
+                    return
+        if not self._spill([row]):
+            self._write([row])
+            BULK_WRITER_ROWS.labels(self.table, "direct").inc()
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._rows)
+
+    def _due(self) -> bool:
+        if not self._rows:
+            return False
+        return (self._closing or len(self._rows) >= self.batch_size
+                or time.monotonic() - self._oldest >= self.max_age)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._due():
+                    if self._closing:
+                        return
+                    if self._rows:
+                        wait = self._oldest + self.max_age - time.monotonic()
+                    else:
+                        wait = self._last_replay + BULK_WRITER_REPLAY_INTERVAL - time.monotonic()
+                        if wait <= 0:
+                            break
+                    self._cond.wait(max(wait, 0.01))
+                batch = self._rows[:self.batch_size]
+                del self._rows[:self.batch_size]
+                self._oldest = time.monotonic() if self._rows else None
+                closing = self._closing
+                # Room has been made for callers waiting in add()
+                self._cond.notify_all()
+
+            if batch:
+                self._flush(batch, retries=0 if closing else BULK_WRITER_RETRIES)
+            elif not closing:
+                self._last_replay = time.monotonic()
+                self.replay_spilled()
+
+    def _write(self, rows: list):
+        with timed(f"bulk_insert_{self.table}"):
+            self.write_rows(rows)
+
+    def _flush(self, batch: list, retries: int):
+        for attempt in range(retries + 1):
+            try:
+                self._write(batch)
+                BULK_WRITER_ROWS.labels(self.table, "written").inc(len(batch))
+                return
+            except Exception as e:
+                logger.warning(f"Failed to write {len(batch)} rows to {self.table} (attempt {attempt + 1}): {str(e)}")
+                if attempt < retries:
+                    time.sleep(BULK_WRITER_RETRY_DELAY * 2 ** attempt)
+        if not self._spill(batch):
+            logger.error(f"Lost {len(batch)} rows for {self.table}: the write and the spill to Redis both failed")
+            BULK_WRITER_ROWS.labels(self.table, "lost").inc(len(batch))
+
+    def _spill(self, rows: list) -> bool:
+        try:
+            redis_client.rpush(self.spill_key, *[json.dumps(row) for row in rows])
+        except Exception as e:
+            logger.error(f"Failed to spill {len(rows)} rows for {self.table} to Redis: {str(e)}")
+            return False
+        BULK_WRITER_ROWS.labels(self.table, "spilled").inc(len(rows))
+        return True
+
+    def replay_spilled(self) -> int:
+        """
+        Write rows spilled to Redis, a batch at a time, until none are left or a write fails.
+
+        A batch that fails BULK_WRITER_REPLAY_ATTEMPTS replays in a row is moved
+        to the dead-letter list so the rows behind it can be written.
+
+        Returns:
+        int: The number of rows written.
+        """
+        lock_key = f"{self.spill_key}:replay"
+        try:
+            if not redis_client.exists(self.spill_key):
+                return 0
+            if not redis_client.set(lock_key, os.getpid(), nx=True, ex=60):
+                return 0
+        except Exception as e:
+            logger.warning(f"Cannot replay spilled rows for {self.table}: {str(e)}")
+            return 0
+        replayed = 0
+        try:
+            while True:
+                entries = redis_client.lrange(self.spill_key, 0, self.batch_size - 1)
+                if not entries:
+                    break
+                try:
+                    self._write([json.loads(entry) for entry in entries])
+                except Exception as e:
+                    self._replay_failed(entries, e)
+                    break
+                # Removed only once written, so a crash here writes them again rather than losing them
+                redis_client.ltrim(self.spill_key, len(entries), -1)
+                replayed += len(entries)
+                BULK_WRITER_ROWS.labels(self.table, "replayed").inc(len(entries))
+            if replayed:
+                redis_client.delete(self._attempts_key)
+        except Exception as e:
+            logger.warning(f"Failed to replay spilled rows for {self.table}: {str(e)}")
+        finally:
+            try:
+                redis_client.delete(lock_key)
+            except Exception:
+                pass
+        return replayed
+
+    def _replay_failed(self, entries: list, error: Exception):
+        # Called with the replay lock held; the count is shared by every process replaying this table
+        attempts = redis_client.incr(self._attempts_key)
+        if attempts < BULK_WRITER_REPLAY_ATTEMPTS:
+            logger.warning(f"Failed to replay {len(entries)} spilled rows for {self.table} "
+                           f"(attempt {attempts}): {str(error)}")
+            return
+        logger.error(f"Moving {len(entries)} spilled rows for {self.table} to {self.dead_key} "
+                     f"after {attempts} failed replays: {str(error)}")
+        pipe = redis_client.pipeline()
+        pipe.rpush(self.dead_key, *entries)
+        pipe.ltrim(self.spill_key, len(entries), -1)
+        pipe.delete(self._attempts_key)
+        pipe.execute()
+        BULK_WRITER_ROWS.labels(self.table, "dead").inc(len(entries))
+
+    def close(self, timeout: float = BULK_WRITER_CLOSE_TIMEOUT):
+        """Write everything buffered, spilling to Redis whatever is not written within timeout seconds."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        with self._cond:
+            rows, self._rows = self._rows, []
+        if rows:
+            logger.warning(f"Spilling {len(rows)} unwritten rows for {self.table} on shutdown")
+            if not self._spill(rows):
+                BULK_WRITER_ROWS.labels(self.table, "lost").inc(len(rows))
+
+
+def close_writers():
+    """Drain every writer in this process; called at exit."""
+    for writer in _writers:
+        writer.close()
+
+
+def _reset_in_child():
+    # Rows buffered before a fork are the parent's to write, and its threads do not exist in the child
+    for writer in _writers:
+        writer._reset()
+
+
+os.register_at_fork(after_in_child=_reset_in_child)
+atexit.register(close_writers)
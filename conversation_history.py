@@ -0,0 +1,66 @@
+import os
+import json
+from redis_utils import redis_client
+
+# Conversation history configuration
+# The most recent turns read back for the prompt; older ones are folded into a summary (see conversation_memory.py)
+CONVERSATION_HISTORY_WINDOW = int(os.environ.get("CONVERSATION_HISTORY_WINDOW", "3"))
+# Turns kept until they have been summarized, in case summarizing falls behind
+CONVERSATION_HISTORY_MAX_TURNS = int(os.environ.get("CONVERSATION_HISTORY_MAX_TURNS", "20"))
+CONVERSATION_HISTORY_TTL = int(os.environ.get("CONVERSATION_HISTORY_TTL", "86400"))
+
+
+def _history_key(user_id: str) -> str:
+    return f"conversation_history:{user_id}"
+
+
+def encode_turn(input_text: str, model_output: str) -> str:
+    return json.dumps({"i": input_text, "o": model_output}, separators=(",", ":"), ensure_ascii=False)
+
+
+def decode_turn(entry: bytes) -> dict:
+    turn = json.loads(entry)
+    # Entries written before the compact encoding use the full field names
+    if "i" in turn:
+        return {"input_text": turn["i"], "model_output": turn["o"]}
+    return turn
+
+
+def log_conversation_in_cache(user_id: str, input_text: str, model_output: str) -> int:
+    """
+    Append a turn to the user's conversation history in one round trip.
+
+    The list is trimmed to the last CONVERSATION_HISTORY_MAX_TURNS turns and
+    expires after CONVERSATION_HISTORY_TTL seconds without a new turn. The
+    commands run in a MULTI/EXEC transaction so concurrent requests from
+    the same user cannot interleave.
+
+    Returns:
+    int: The number of turns in the history before it was trimmed.
+    """
+    key = _history_key(user_id)
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.rpush(key, encode_turn(input_text, model_output))
+    pipe.ltrim(key, -CONVERSATION_HISTORY_MAX_TURNS, -1)
+    pipe.expire(key, CONVERSATION_HISTORY_TTL)
+    return pipe.execute()[0]
+
+
+def get_conversation_history_from_cache(user_id: str) -> list:
+    entries = redis_client.lrange(_history_key(user_id), -CONVERSATION_HISTORY_WINDOW, -1)
+    return [decode_turn(entry) for entry in entries]
+
+
+async def log_conversation_in_cache_async(redis, user_id: str, input_text: str, model_output: str) -> int:
+    """log_conversation_in_cache on an asyncio Redis client."""
+    key = _history_key(user_id)
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.rpush(key, encode_turn(input_text, model_output))
+        pipe.ltrim(key, -CONVERSATION_HISTORY_MAX_TURNS, -1)
+        pipe.expire(key, CONVERSATION_HISTORY_TTL)
+        return (await pipe.execute())[0]
+
+
+async def get_conversation_history_from_cache_async(redis, user_id: str) -> list:
+    entries = await redis.lrange(_history_key(user_id), -CONVERSATION_HISTORY_WINDOW, -1)
+    return [decode_turn(entry) for entry in entries]
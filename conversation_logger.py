@@ -1,34 +1,40 @@
-import os
-import psycopg2
 from typing import List, Dict
 import json
+from psycopg2.extras import execute_values
+from db import get_cursor
+from metrics import upstream_call
+from bulk_writer import BulkWriter, BULK_WRITES_ENABLED
 
-# Get the PostgreSQL connection URL from the environment variable
-DATABASE_URL = os.environ.get("DATABASE_URL")
+def conversation_row(input_text: str, model_output: str, response_quality_scores: Dict[str, int]) -> list:
+    return [input_text,
+            model_output,
+            response_quality_scores.get('Relevance') if response_quality_scores else None,
+            response_quality_scores.get('Coherence') if response_quality_scores else None,
+            response_quality_scores.get('Informativeness') if response_quality_scores else None,
+            response_quality_scores.get('Engagement') if response_quality_scores else None,
+            response_quality_scores.get('Overall Score') if response_quality_scores else None]
 
-def get_db_connection():
-    return psycopg2.connect(DATABASE_URL)
+def insert_conversations(rows: List[list]) -> None:
+    # One INSERT with a VALUES list per batch instead of a statement per row
+    with upstream_call("postgres", "conversations", "log_conversation"), get_cursor() as cur:
+        execute_values(cur, """
+            INSERT INTO conversations (
+                input_text,
+                model_output,
+                relevance_score,
+                coherence_score,
+                informativeness_score,
+                engagement_score,
+                overall_score
+            )
+            VALUES %s
+        """, rows, page_size=len(rows))
+
+conversation_writer = BulkWriter("conversations", insert_conversations)
 
 def log_conversation(input_text: str, model_output: str, response_quality_scores: Dict[str, int]) -> None:
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO conversations (
-                    input_text,
-                    model_output,
-                    relevance_score,
-                    coherence_score,
-                    informativeness_score,
-                    engagement_score,
-                    overall_score
-                )
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """, (input_text,
-                    model_output,
-                    response_quality_scores.get('Relevance') if response_quality_scores else None,
-                    response_quality_scores.get('Coherence') if response_quality_scores else None,
-                    response_quality_scores.get('Informativeness') if response_quality_scores else None,
-                    response_quality_scores.get('Engagement') if response_quality_scores else None,
-                    response_quality_scores.get('Overall Score') if response_quality_scores else None
-                    ))
-        conn.commit()
\ No newline at end of file
+    row = conversation_row(input_text, model_output, response_quality_scores)
+    if BULK_WRITES_ENABLED:
+        conversation_writer.add(row)
+    else:
+        insert_conversations([row])
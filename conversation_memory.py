@@ -0,0 +1,199 @@
+"""
+What the model is told about a user's earlier turns.
+
+The raw turns live in the Redis list kept by conversation_history.py. A
+prompt gets the most recent of them verbatim, newest first, for as long as
+they fit in MEMORY_RECENT_TOKENS, and a rolling summary of everything older.
+
+After each turn the older turns are folded into the summary in the
+background, as a "summarize_conversation" job when BAYARD_BACKGROUND_TASKS
+is on and on a small thread pool otherwise. Folded turns are removed from
+the list in the same transaction that stores the new summary, so a turn is
+always in exactly one of the two. If summarizing fails the turns are kept,
+and the next turn tries again.
+"""
+import os
+import uuid
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from conversation_history import (CONVERSATION_HISTORY_WINDOW, CONVERSATION_HISTORY_TTL, _history_key, decode_turn,
+                                  log_conversation_in_cache, log_conversation_in_cache_async)
+from prompt_builder import count_tokens, truncate_to_tokens
+from redis_utils import redis_client, register_script
+from task_queue import enqueue, enqueue_async
+from pipeline import BACKGROUND_TASKS_ENABLED
+
+logger = logging.getLogger(__name__)
+
+# Conversation memory configuration
+MEMORY_RECENT_TOKENS = int(os.environ.get("MEMORY_RECENT_TOKENS", "1500"))
+MEMORY_SUMMARY_MAX_TOKENS = int(os.environ.get("MEMORY_SUMMARY_MAX_TOKENS", "300"))
+MEMORY_SUMMARY_WORKERS = int(os.environ.get("MEMORY_SUMMARY_WORKERS", "2"))
+# Seconds one summarization may hold a user's lock
+MEMORY_SUMMARY_LOCK_TTL = int(os.environ.get("MEMORY_SUMMARY_LOCK_TTL", "60"))
+
+EMPTY_MEMORY = {"summary": "", "turns": []}
+
+_summary_executor = ThreadPoolExecutor(max_workers=MEMORY_SUMMARY_WORKERS, thread_name_prefix="bayard-memory")
+
+# Release a summarization lock only if this run still holds it
+_RELEASE_LOCK_SCRIPT = register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+
+def _summary_key(user_id: str) -> str:
+    return f"conversation_summary:{user_id}"
+
+
+def _lock_key(user_id: str) -> str:
+    return f"conversation_summary_lock:{user_id}"
+
+
+def turn_tokens(turn: dict) -> int:
+    return count_tokens(turn["input_text"]) + count_tokens(turn["model_output"])
+
+
+def select_recent_turns(turns: list, budget: int = MEMORY_RECENT_TOKENS) -> list:
+    """
+    Keep the most recent turns that fit in a token budget.
+
+    Parameters:
+    turns (list): Turns from oldest to newest.
+    budget (int): Tokens the kept turns may use.
+
+    Returns:
+    list: The newest turns, oldest first, within the budget. The newest turn
+    is always kept, with its answer shortened if it does not fit on its own.
+    """
+    kept = []
+    used = 0
+    for turn in reversed(turns):
+        tokens = turn_tokens(turn)
+        if used + tokens > budget:
+            if not kept:
+                room = budget - count_tokens(turn["input_text"])
+                kept.append({**turn, "model_output": truncate_to_tokens(turn["model_output"], room)})
+            break
+        kept.append(turn)
+        used += tokens
+    kept.reverse()
+    return kept
+
+
+def _decode_memory(summary, entries) -> dict:
+    turns = [decode_turn(entry) for entry in entries]
+    return {
+        "summary": summary.decode("utf-8") if isinstance(summary, bytes) else (summary or ""),
+        "turns": select_recent_turns(turns),
+    }
+
+
+def get_conversation_memory(user_id: str) -> dict:
+    """
+    Returns:
+    dict: The user's rolling "summary" (empty if there is none yet) and their
+    recent "turns" within MEMORY_RECENT_TOKENS. Requests without a user id have
+    no memory.
+    """
+    if not user_id:
+        return EMPTY_MEMORY
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.get(_summary_key(user_id))
+    pipe.lrange(_history_key(user_id), -CONVERSATION_HISTORY_WINDOW, -1)
+    summary, entries = pipe.execute()
+    return _decode_memory(summary, entries)
+
+
+async def get_conversation_memory_async(redis, user_id: str) -> dict:
+    """get_conversation_memory on an asyncio Redis client."""
+    if not user_id:
+        return EMPTY_MEMORY
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.get(_summary_key(user_id))
+        pipe.lrange(_history_key(user_id), -CONVERSATION_HISTORY_WINDOW, -1)
+        summary, entries = await pipe.execute()
+    return _decode_memory(summary, entries)
+
+
+def has_memory(memory: dict) -> bool:
+    return bool(memory and (memory["summary"] or memory["turns"]))
+
+
+def record_turn(user_id: str, input_text: str, model_output: str):
+    """Add a turn to the user's history and fold older turns into their summary in the background."""
+    if not user_id:
+        return
+    if log_conversation_in_cache(user_id, input_text, model_output) > 1:
+        if BACKGROUND_TASKS_ENABLED:
+            try:
+                enqueue("summarize_conversation", user_id=user_id)
+                return
+            except Exception as e:
+                logger.error(f"Failed to enqueue conversation summary, running it in process: {str(e)}")
+        _summary_executor.submit(_summarize_logged, user_id)
+
+
+async def record_turn_async(redis, user_id: str, input_text: str, model_output: str):
+    """record_turn on an asyncio Redis client."""
+    if not user_id:
+        return
+    if await log_conversation_in_cache_async(redis, user_id, input_text, model_output) > 1:
+        if BACKGROUND_TASKS_ENABLED:
+            try:
+                await enqueue_async(redis, "summarize_conversation", user_id=user_id)
+                return
+            except Exception as e:
+                logger.error(f"Failed to enqueue conversation summary, running it in process: {str(e)}")
+        _summary_executor.submit(_summarize_logged, user_id)
+
+
+def _summarize_logged(user_id: str):
+    try:
+        summarize_conversation(user_id)
+    except Exception as e:
+        logger.error(f"Failed to summarize conversation: {str(e)}")
+
+
+def summarize_conversation(user_id: str) -> int:
+    """
+    Fold the turns that no longer fit in a prompt into the user's summary.
+
+    Returns:
+    int: The number of turns folded; 0 if there was nothing to fold or
+    another summarization for the user is running.
+    """
+    lock_key = _lock_key(user_id)
+    token = str(uuid.uuid4())
+    if not redis_client.set(lock_key, token, nx=True, ex=MEMORY_SUMMARY_LOCK_TTL):
+        return 0
+    try:
+        history_key = _history_key(user_id)
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.get(_summary_key(user_id))
+        pipe.lrange(history_key, 0, -1)
+        summary, entries = pipe.execute()
+        turns = [decode_turn(entry) for entry in entries]
+
+        # Everything older than the turns a prompt would get verbatim
+        recent = select_recent_turns(turns[-CONVERSATION_HISTORY_WINDOW:])
+        folded = len(turns) - len(recent)
+        if folded <= 0:
+            return 0
+
+        # Imported here so reading memory does not load the OpenAI client
+        from openai_utils import generate_conversation_summary
+        summary = summary.decode("utf-8") if isinstance(summary, bytes) else (summary or "")
+        new_summary = truncate_to_tokens(generate_conversation_summary(summary, turns[:folded], MEMORY_SUMMARY_MAX_TOKENS),
+                                         MEMORY_SUMMARY_MAX_TOKENS)
+
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.set(_summary_key(user_id), new_summary, ex=CONVERSATION_HISTORY_TTL)
+        pipe.ltrim(history_key, folded, -1)
+        pipe.execute()
+        return folded
+    finally:
+        _RELEASE_LOCK_SCRIPT(keys=[lock_key], args=[token])
@@ -0,0 +1,172 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from psycopg2 import pool as pg_pool
+from metrics import DB_POOL_WAIT_SECONDS, DB_POOL_IN_USE, DB_POOL_TIMEOUTS
+
+logger = logging.getLogger(__name__)
+
+# PostgreSQL connection pool configuration
+DATABASE_URL = os.environ.get("DATABASE_URL")
+# psycopg2 pools keep at most DB_POOL_MIN idle connections open between checkouts
+DB_POOL_MIN = int(os.environ.get("DB_POOL_MIN", "2"))
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "10"))
+DB_HEALTH_CHECK_INTERVAL = float(os.environ.get("DB_HEALTH_CHECK_INTERVAL", "30"))
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+class _PoolState:
+    """A connection pool together with the process it was created in."""
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.pool = pg_pool.ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, DATABASE_URL)
+        # ThreadedConnectionPool raises when exhausted; the semaphore makes callers wait instead
+        self.slots = threading.BoundedSemaphore(DB_POOL_MAX)
+        self.last_used = {}
+
+
+_state = None
+_state_lock = threading.Lock()
+# Pools inherited from a parent process; kept referenced so their sockets are never closed from the child
+_inherited = []
+
+_stats_lock = threading.Lock()
+_stats = {
+    "checkouts": 0,
+    "wait_seconds_total": 0.0,
+    "wait_seconds_max": 0.0,
+    "timeouts": 0,
+    "health_check_failures": 0,
+}
+
+
+def _get_state():
+    global _state
+    state = _state
+    if state is not None and state.pid == os.getpid():
+        return state
+    with _state_lock:
+        if _state is None or _state.pid != os.getpid():
+            if _state is not None:
+                # Created before a fork (e.g. gunicorn preload); the parent still owns these connections
+                _inherited.append(_state)
+            _state = _PoolState()
+        return _state
+
+
+def _is_healthy(state, conn):
+    if conn.closed:
+        return False
+    last_used = state.last_used.get(id(conn))
+    # Connections the pool has just opened need no check
+    if last_used is None or time.monotonic() - last_used < DB_HEALTH_CHECK_INTERVAL:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except Exception as e:
+        logger.warning(f"Discarding unhealthy database connection: {str(e)}")
+        return False
+
+
+def _checkout(state):
+    # A pool of DB_POOL_MAX connections can contain at most that many bad ones
+    for _ in range(DB_POOL_MAX + 1):
+        conn = state.pool.getconn()
+        if _is_healthy(state, conn):
+            return conn
+        with _stats_lock:
+            _stats["health_check_failures"] += 1
+        state.last_used.pop(id(conn), None)
+        state.pool.putconn(conn, close=True)
+    raise pg_pool.PoolError("Could not obtain a healthy database connection")
+
+
+@contextmanager
+def get_connection():
+    """
+    Check a connection out of the process-wide pool.
+
+    Waits up to DB_POOL_TIMEOUT seconds for a free connection. Connections that
+    have been idle for DB_HEALTH_CHECK_INTERVAL seconds are checked with
+    SELECT 1 before they are handed out. The transaction is committed when
+    the block exits normally and rolled back if it raises.
+
+    Yields:
+    psycopg2.extensions.connection: A healthy connection.
+    """
+    state = _get_state()
+    start = time.perf_counter()
+    if not state.slots.acquire(timeout=DB_POOL_TIMEOUT):
+        with _stats_lock:
+            _stats["timeouts"] += 1
+        DB_POOL_TIMEOUTS.inc()
+        raise PoolTimeoutError(f"Timed out after {DB_POOL_TIMEOUT}s waiting for a database connection")
+    wait = time.perf_counter() - start
+    with _stats_lock:
+        _stats["checkouts"] += 1
+        _stats["wait_seconds_total"] += wait
+        _stats["wait_seconds_max"] = max(_stats["wait_seconds_max"], wait)
+    DB_POOL_WAIT_SECONDS.observe(wait)
+
+    conn = None
+    DB_POOL_IN_USE.inc()
+    try:
+        conn = _checkout(state)
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+    finally:
+        if conn is not None:
+            state.last_used[id(conn)] = time.monotonic()
+            state.pool.putconn(conn, close=bool(conn.closed))
+            # Broken connections, and those beyond DB_POOL_MIN idle ones, are closed by putconn
+            if conn.closed:
+                state.last_used.pop(id(conn), None)
+        DB_POOL_IN_USE.dec()
+        state.slots.release()
+
+
+@contextmanager
+def get_cursor():
+    """Check out a pooled connection and yield a cursor on it."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            yield cur
+
+
+def get_pool_stats() -> dict:
+    """
+    Returns:
+    dict: Checkouts, waits and timeouts in this process, and its connections in use and idle.
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    state = _state
+    if state is not None and state.pid == os.getpid():
+        stats["connections_in_use"] = len(state.pool._used)
+        stats["connections_idle"] = len(state.pool._pool)
+    stats["wait_seconds_avg"] = stats["wait_seconds_total"] / stats["checkouts"] if stats["checkouts"] else 0.0
+    return stats
+
+
+def close_pool():
+    """Close every connection owned by this process's pool."""
+    global _state
+    with _state_lock:
+        if _state is not None and _state.pid == os.getpid():
+            _state.pool.closeall()
+        _state = None
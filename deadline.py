@@ -0,0 +1,181 @@
+"""
+Per-request latency budget.
+
+Every request gets a Deadline when it starts: the number of seconds in its
+X-Request-Timeout header, or REQUEST_BUDGET. It is kept in a context
+variable, so the pipeline stages and the threads they run on see the same
+one. Each call to Elasticsearch, Cohere and OpenAI is given at most the time
+that is left, and optional work is shed as the budget runs out instead of
+letting the request time out:
+
+- with less than DEADLINE_REFLECTION_MIN seconds left, the search quality
+  reflection is scored locally rather than by the LLM;
+- with less than DEADLINE_EVALUATION_MIN seconds left, an inline response
+  quality evaluation is skipped;
+- max_tokens is capped at what the model can generate in the time left, at
+  DEADLINE_TOKENS_PER_SECOND;
+- with less than DEADLINE_FEWER_DOCUMENTS_MIN seconds left, only
+  DEADLINE_MIN_DOCUMENTS documents go into the prompt.
+
+What was shed is listed under "degraded" in the response, in the
+X-Degraded header and in bayard_degraded_total, along with "retriever" when
+the documents came from the local index because Elasticsearch failed (see
+retrievers.py).
+"""
+import os
+import math
+import time
+import threading
+from contextvars import ContextVar
+from metrics import DEGRADED
+
+DEADLINE_HEADER = "X-Request-Timeout"
+# Seconds a request may take when it does not say, and the most it may ask for
+REQUEST_BUDGET = float(os.environ.get("REQUEST_BUDGET", "60"))
+REQUEST_BUDGET_MAX = float(os.environ.get("REQUEST_BUDGET_MAX", "120"))
+
+DEADLINE_REFLECTION_MIN = float(os.environ.get("DEADLINE_REFLECTION_MIN", "10"))
+DEADLINE_EVALUATION_MIN = float(os.environ.get("DEADLINE_EVALUATION_MIN", "15"))
+DEADLINE_FEWER_DOCUMENTS_MIN = float(os.environ.get("DEADLINE_FEWER_DOCUMENTS_MIN", "8"))
+DEADLINE_MIN_DOCUMENTS = int(os.environ.get("DEADLINE_MIN_DOCUMENTS", "3"))
+DEADLINE_TOKENS_PER_SECOND = float(os.environ.get("DEADLINE_TOKENS_PER_SECOND", "100"))
+DEADLINE_MIN_MAX_TOKENS = int(os.environ.get("DEADLINE_MIN_MAX_TOKENS", "256"))
+# Seconds kept back from generation for persisting the run and writing the response
+DEADLINE_RESERVE = float(os.environ.get("DEADLINE_RESERVE", "1"))
+# An upstream call gets at least this long, even once the budget is spent
+DEADLINE_MIN_TIMEOUT = float(os.environ.get("DEADLINE_MIN_TIMEOUT", "1"))
+
+# The parts of a degraded response that end up in the answer, which is then not cached
+ANSWER_DEGRADATIONS = ("search_quality_reflection", "max_tokens", "documents", "retriever")
+
+
+class Deadline:
+    """
+    The time a request has left, and the optional work shed to stay within it.
+
+    Parameters:
+    budget (float): Seconds the request may take from now.
+    """
+
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+        self.degraded = []
+        self._lock = threading.Lock()
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() == 0.0
+
+    def degrade(self, what: str):
+        """Record that optional work was skipped or shortened."""
+        with self._lock:
+            if what in self.degraded:
+                return
+            self.degraded.append(what)
+        DEGRADED.labels(what).inc()
+
+
+_current_deadline = ContextVar("deadline", default=None)
+
+
+def parse_budget(header_value) -> float:
+    """
+    Returns:
+    float: The budget asked for in a X-Request-Timeout header, within REQUEST_BUDGET_MAX,
+    or REQUEST_BUDGET if it is missing or not a positive number.
+    """
+    try:
+        budget = float(header_value)
+    except (TypeError, ValueError):
+        return REQUEST_BUDGET
+    if not math.isfinite(budget) or budget <= 0:
+        return REQUEST_BUDGET
+    return min(budget, REQUEST_BUDGET_MAX)
+
+
+def start_deadline(header_value=None) -> Deadline:
+    """Give the current request its Deadline, from its X-Request-Timeout header if it has one."""
+    deadline = Deadline(parse_budget(header_value))
+    _current_deadline.set(deadline)
+    return deadline
+
+
+def current_deadline():
+    return _current_deadline.get()
+
+
+def budget_timeout(timeout: float) -> float:
+    """
+    Cap a timeout at the time the current request has left.
+
+    Returns:
+    float: timeout, or the remaining budget if that is shorter, but never less than DEADLINE_MIN_TIMEOUT.
+    """
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return timeout
+    return min(timeout, max(deadline.remaining(), DEADLINE_MIN_TIMEOUT))
+
+
+def allows(what: str, min_remaining: float) -> bool:
+    """
+    Whether optional work may still run, recording it as degraded if not.
+
+    Parameters:
+    what (str): The work, as listed under "degraded".
+    min_remaining (float): Seconds that must be left for it to run.
+    """
+    deadline = _current_deadline.get()
+    if deadline is None or deadline.remaining() >= min_remaining:
+        return True
+    deadline.degrade(what)
+    return False
+
+
+def document_budget(max_hits: int) -> int:
+    """Returns: int: The number of documents to put in the prompt."""
+    if max_hits > DEADLINE_MIN_DOCUMENTS and not allows("documents", DEADLINE_FEWER_DOCUMENTS_MIN):
+        return DEADLINE_MIN_DOCUMENTS
+    return max_hits
+
+
+def token_budget(max_tokens: int) -> int:
+    """Returns: int: max_tokens, or fewer if the model could not generate that many in the time left."""
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return max_tokens
+    affordable = int((deadline.remaining() - DEADLINE_RESERVE) * DEADLINE_TOKENS_PER_SECOND)
+    capped = max(affordable, DEADLINE_MIN_MAX_TOKENS)
+    if capped >= max_tokens:
+        return max_tokens
+    deadline.degrade("max_tokens")
+    return capped
+
+
+def degrade(what: str):
+    """Record that the current request's answer was degraded for a reason other than its budget."""
+    deadline = _current_deadline.get()
+    if deadline is not None:
+        deadline.degrade(what)
+
+
+def retry_fits(delay: float) -> bool:
+    # A retry that would start after the deadline cannot help the request
+    deadline = _current_deadline.get()
+    return deadline is None or deadline.remaining() > delay
+
+
+def degraded() -> list:
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return []
+    with deadline._lock:
+        return list(deadline.degraded)
+
+
+def answer_degraded() -> bool:
+    return any(what in ANSWER_DEGRADATIONS for what in degraded())
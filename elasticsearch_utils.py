@@ -1,22 +1,65 @@
 from env import ES_URL, ES_API_KEY
-from elasticsearch import Elasticsearch
+from elasticsearch import Elasticsearch, BadRequestError
 import os
 import json
+import logging
+from retrieval_cache import cached_search, cached_search_many, cached_search_async, cached_search_many_async
+from lazy_client import LazyClient
+from metrics import timed, count_upstream_error
+from resilience import ES_TIMEOUT, call, call_async, hedged_call, hedged_call_async
+from deadline import budget_timeout
+
+logger = logging.getLogger(__name__)
 
 ES_URL = os.environ.get("ES_URL")
 ES_API_KEY = os.environ.get("ES_API_KEY")
 
-es_client = Elasticsearch(ES_URL, api_key=ES_API_KEY)
+ES_INDEX = "bayardcorpus"
+ES_SEARCH_SIZE = int(os.environ.get("ES_SEARCH_SIZE", "10"))
+# Keyword field used to collapse duplicate titles on the server; empty to disable
+ES_COLLAPSE_FIELD = os.environ.get("ES_COLLAPSE_FIELD", "title.keyword")
+ES_REQUEST_CACHE = os.environ.get("ES_REQUEST_CACHE", "true").lower() in ("1", "true", "yes")
+
+# Fields of _source read by filter_hits
+ES_SOURCE_FIELDS = [
+    "title", "abstract", "authors", "classification", "concepts", "yearPublished",
+    "downloadUrl", "emotion", "sentiment", "categories",
+]
+
+_collapse_supported = bool(ES_COLLAPSE_FIELD)
+
+# Built on first use in each process; see lazy_client.py
+# Failed requests are retried by resilience.call rather than by the client
+es_client = LazyClient("elasticsearch", lambda: Elasticsearch(ES_URL, api_key=ES_API_KEY, request_timeout=ES_TIMEOUT,
+                                                              max_retries=0))
+
+def _within_budget(es):
+    # A search may not outlast the request's deadline; see deadline.py
+    return es.options(request_timeout=budget_timeout(ES_TIMEOUT))
 
 def search_elasticsearch(user_input):
     """
-    Search Elasticsearch using the text_expansion query with ELSER model.
+    Search Elasticsearch, serving repeated queries from the retrieval cache.
+
+    Concurrent identical queries share a single Elasticsearch request.
     Parameters:
     user_input (str): The user's search query.
 
     Returns:
     list: A list of filtered documents as dictionaries, or None if an exception occurs.
     """
+    with timed("search_elasticsearch"):
+        return cached_search(user_input, ES_INDEX, ES_SEARCH_SIZE, lambda: search_elasticsearch_uncached(user_input))
+
+def build_search_body(user_input, size=ES_SEARCH_SIZE, collapse_field=None):
+    """
+    Build the ELSER text_expansion query.
+
+    Only the fields used to build the response are requested, so the
+    content_embedding token weights are never transferred. When a collapse
+    field is given, hits with the same title are collapsed on the server and
+    size unique documents come back.
+    """
     search_body = {
         "query": {
             "text_expansion": {
@@ -26,37 +69,157 @@ def search_elasticsearch(user_input):
                 }
             }
         },
-        "size": 10
+        "_source": {"includes": ES_SOURCE_FIELDS},
+        "size": size
     }
+    if collapse_field:
+        search_body["collapse"] = {"field": collapse_field}
+    return search_body
+
+def filter_hits(hits):
+    """
+    Turn raw Elasticsearch hits into the documents used by the API, dropping repeated titles.
+
+    Returns:
+    list: A list of filtered documents as dictionaries.
+    """
+    filtered_docs = []
+    seen_titles = set()
+
+    for hit in hits:
+        title = hit['_source'].get('title', 'No title provided')
+        if title not in seen_titles:
+            seen_titles.add(title)
+            filtered_doc = {
+                'title': title,
+                'abstract': hit['_source'].get('abstract', 'No abstract available'),
+                'authors': hit['_source'].get('authors', 'No authors listed'),
+                'classification': hit['_source'].get('classification', 'No classification provided'),
+                'concepts': hit['_source'].get('concepts', 'No concepts listed'),
+                'yearPublished': hit['_source'].get('yearPublished', 'No year listed'),
+                'downloadUrl': hit['_source'].get('downloadUrl', 'No download URL provided'),
+                'emotion': hit['_source'].get('emotion', 'No emotion provided'),
+                'sentiment': hit['_source'].get('sentiment', 'No sentiment provided'),
+                'categories': hit['_source'].get('categories', 'No categories listed'),
+                '_id': hit.get('_id', 'No ID provided'),
+                '_score': hit['_score']
+            }
+            filtered_docs.append(filtered_doc)
+
+    return filtered_docs
+
+def search_elasticsearch_uncached(user_input):
+    """
+    Search Elasticsearch using the text_expansion query with ELSER model.
+    Parameters:
+    user_input (str): The user's search query.
+
+    Returns:
+    list: A list of filtered documents as dictionaries, or None if an exception occurs.
+    """
+    global _collapse_supported
 
+    collapse_field = ES_COLLAPSE_FIELD if _collapse_supported else None
     try:
-        search_results = es_client.search(index="bayardcorpus", body=search_body)
-        hits = search_results["hits"]["hits"]
-        filtered_docs = []
-        seen_titles = set()
-
-        for hit in hits:
-            title = hit['_source'].get('title', 'No title provided')
-            if title not in seen_titles:
-                seen_titles.add(title)
-                filtered_doc = {
-                    'title': title,
-                    'abstract': hit['_source'].get('abstract', 'No abstract available'),
-                    'authors': hit['_source'].get('authors', 'No authors listed'),
-                    'classification': hit['_source'].get('classification', 'No classification provided'),
-                    'concepts': hit['_source'].get('concepts', 'No concepts listed'),
-                    'yearPublished': hit['_source'].get('yearPublished', 'No year listed'),
-                    'downloadUrl': hit['_source'].get('downloadUrl', 'No download URL provided'),
-                    'emotion': hit['_source'].get('emotion', 'No emotion provided'),
-                    'sentiment': hit['_source'].get('sentiment', 'No sentiment provided'),
-                    'categories': hit['_source'].get('categories', 'No categories listed'),
-                    '_id': hit['_source'].get('_id', 'No ID provided'),
-                    '_score': hit['_score']
-                }
-                filtered_docs.append(filtered_doc)
+        try:
+            search_results = hedged_call("elasticsearch", ES_INDEX, "search_elasticsearch", lambda: _within_budget(es_client).search(
+                index=ES_INDEX, body=build_search_body(user_input, ES_SEARCH_SIZE, collapse_field),
+                request_cache=ES_REQUEST_CACHE))
+        except BadRequestError as e:
+            if not collapse_field:
+                raise
+            # The index has no aggregatable title field to collapse on; dedupe in Python from now on
+            logger.warning("Collapsing on %s is not supported, falling back: %s", collapse_field, e)
+            _collapse_supported = False
+            search_results = hedged_call("elasticsearch", ES_INDEX, "search_elasticsearch", lambda: _within_budget(es_client).search(
+                index=ES_INDEX, body=build_search_body(user_input, ES_SEARCH_SIZE), request_cache=ES_REQUEST_CACHE))
+        return filter_hits(search_results["hits"]["hits"])
+
+    except Exception as e:
+        logger.error("Elasticsearch search on %s failed: %s", ES_INDEX, e)
+        return None
+
+def search_elasticsearch_batch(user_inputs):
+    """
+    Search Elasticsearch for several queries, serving cached ones from the
+    retrieval cache and sending the rest in a single msearch request.
+
+    Parameters:
+    user_inputs (list): The users' search queries.
+
+    Returns:
+    list: A list of filtered documents per query, or None for queries whose search failed.
+    """
+    with timed("search_elasticsearch_batch"):
+        return cached_search_many(user_inputs, ES_INDEX, ES_SEARCH_SIZE, msearch_elasticsearch)
 
-        return filtered_docs
+def _msearch_body(user_inputs):
+    collapse_field = ES_COLLAPSE_FIELD if _collapse_supported else None
+    searches = []
+    for user_input in user_inputs:
+        searches.append({"index": ES_INDEX, "request_cache": ES_REQUEST_CACHE})
+        searches.append(build_search_body(user_input, ES_SEARCH_SIZE, collapse_field))
+    return searches
 
+def msearch_elasticsearch(user_inputs):
+    try:
+        responses = call("elasticsearch", ES_INDEX, "search_elasticsearch_batch",
+                         lambda: _within_budget(es_client).msearch(searches=_msearch_body(user_inputs)))["responses"]
+    except Exception as e:
+        logger.error("Elasticsearch msearch for %d queries failed: %s", len(user_inputs), e)
+        return [None] * len(user_inputs)
+    return _msearch_results(responses)
+
+def _msearch_results(responses):
+    results = []
+    for response in responses:
+        if "error" in response:
+            logger.error("Elasticsearch msearch query failed: %s", response["error"])
+            count_upstream_error("elasticsearch", ES_INDEX, "search_elasticsearch_batch")
+            results.append(None)
+        else:
+            results.append(filter_hits(response["hits"]["hits"]))
+    return results
+
+async def search_elasticsearch_async(es, redis, user_input):
+    """search_elasticsearch on async Elasticsearch and Redis clients."""
+    with timed("search_elasticsearch"):
+        return await cached_search_async(redis, user_input, ES_INDEX, ES_SEARCH_SIZE,
+                                         lambda: search_elasticsearch_uncached_async(es, user_input))
+
+async def search_elasticsearch_uncached_async(es, user_input):
+    global _collapse_supported
+
+    collapse_field = ES_COLLAPSE_FIELD if _collapse_supported else None
+    try:
+        try:
+            search_results = await hedged_call_async("elasticsearch", ES_INDEX, "search_elasticsearch", lambda: _within_budget(es).search(
+                index=ES_INDEX, body=build_search_body(user_input, ES_SEARCH_SIZE, collapse_field),
+                request_cache=ES_REQUEST_CACHE))
+        except BadRequestError as e:
+            if not collapse_field:
+                raise
+            logger.warning("Collapsing on %s is not supported, falling back: %s", collapse_field, e)
+            _collapse_supported = False
+            search_results = await hedged_call_async("elasticsearch", ES_INDEX, "search_elasticsearch", lambda: _within_budget(es).search(
+                index=ES_INDEX, body=build_search_body(user_input, ES_SEARCH_SIZE), request_cache=ES_REQUEST_CACHE))
+        return filter_hits(search_results["hits"]["hits"])
+
+    except Exception as e:
+        logger.error("Elasticsearch search on %s failed: %s", ES_INDEX, e)
+        return None
+
+async def search_elasticsearch_batch_async(es, redis, user_inputs):
+    """search_elasticsearch_batch on async Elasticsearch and Redis clients."""
+    with timed("search_elasticsearch_batch"):
+        return await cached_search_many_async(redis, user_inputs, ES_INDEX, ES_SEARCH_SIZE,
+                                              lambda queries: msearch_elasticsearch_async(es, queries))
+
+async def msearch_elasticsearch_async(es, user_inputs):
+    try:
+        responses = (await call_async("elasticsearch", ES_INDEX, "search_elasticsearch_batch",
+                                      lambda: _within_budget(es).msearch(searches=_msearch_body(user_inputs))))["responses"]
     except Exception as e:
-        print(f"An error occurred: {e}")
-        return None
\ No newline at end of file
+        logger.error("Elasticsearch msearch for %d queries failed: %s", len(user_inputs), e)
+        return [None] * len(user_inputs)
+    return _msearch_results(responses)
@@ -1,5 +1,39 @@
 # gunicorn.conf.py
+import os
+
 bind = "0.0.0.0:8000"
-workers = 4
+workers = int(os.environ.get("GUNICORN_WORKERS", "4"))
+# Each worker serves requests on a pool of threads (gthread), so requests waiting for
+# admission (see admission.py) do not hold up probes or block the whole worker. Keep
+# this above ADMISSION_MAX_IN_FLIGHT + ADMISSION_QUEUE_SIZE; the async worker ignores it
+threads = int(os.environ.get("GUNICORN_THREADS", "32"))
 timeout = 120  # Increase the timeout to 120 seconds
-loglevel = 'debug'
\ No newline at end of file
+loglevel = os.environ.get("GUNICORN_LOG_LEVEL", "info")
+
+# Import the app once in the master and fork the workers from it. Clients are
+# built on first use in each process (see lazy_client.py), so none are shared
+preload_app = os.environ.get("GUNICORN_PRELOAD_APP", "true").lower() in ("1", "true", "yes")
+
+
+def post_fork(server, worker):
+    # Drop any client the master built while loading the app
+    from lazy_client import reset_clients
+    reset_clients()
+
+
+def on_starting(server):
+    # With PROMETHEUS_MULTIPROC_DIR set, start from an empty metrics directory
+    from metrics import clear_multiprocess_dir
+    clear_multiprocess_dir()
+
+
+def child_exit(server, worker):
+    # Fold the exited worker's samples into the totals instead of reporting them as live
+    from metrics import mark_process_dead
+    mark_process_dead(worker.pid)
+
+
+def worker_exit(server, worker):
+    # Write the rows still buffered for the conversations and runs tables before the worker goes
+    from bulk_writer import close_writers
+    close_writers()
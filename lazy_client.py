@@ -0,0 +1,73 @@
+import os
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Every proxy created in this process, so a forked worker can drop them all at once
+_registry = []
+# Clients inherited from a parent process; kept referenced so their sockets are never closed from the child
+_inherited = []
+
+
+class LazyClient:
+    """
+    Stand-in for a module-level client that builds it on first use.
+
+    Attribute access is forwarded to the real client, which is created once
+    per process: a proxy used before a fork (e.g. with gunicorn's
+    preload_app) builds a fresh client in each child instead of sharing the
+    parent's sockets.
+
+    Parameters:
+    name (str): Name used in log messages and readiness reports.
+    factory (callable): Builds the client.
+    """
+
+    def __init__(self, name, factory):
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_client", None)
+        object.__setattr__(self, "_pid", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+        _registry.append(self)
+
+    # Proxy methods are underscored so they never hide an attribute of the client, such as Redis.get
+
+    def _resolve(self):
+        """Return the client, building it if this process has not yet."""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._forget()
+                    logger.info(f"Initialising {self._name} client")
+                    object.__setattr__(self, "_client", self._factory())
+                    object.__setattr__(self, "_pid", os.getpid())
+        return self._client
+
+    @property
+    def _initialized(self) -> bool:
+        return self._pid == os.getpid()
+
+    def _reset(self):
+        """Make the next use build a new client."""
+        with self._lock:
+            self._forget()
+
+    def _forget(self):
+        if self._client is not None and self._pid != os.getpid():
+            _inherited.append(self._client)
+        object.__setattr__(self, "_client", None)
+        object.__setattr__(self, "_pid", None)
+
+    def __getattr__(self, attribute):
+        return getattr(self._resolve(), attribute)
+
+    def __repr__(self):
+        return f"<LazyClient {self._name} initialized={self._initialized}>"
+
+
+def reset_clients():
+    """Forget every client built so far, e.g. in a freshly forked worker."""
+    for client in _registry:
+        client._reset()
@@ -0,0 +1,107 @@
+import re
+import zlib
+import numpy as np
+
+# Hashed feature space; collisions are rare at this size for short queries
+N_FEATURES = 2 ** 16
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9+']+")
+
+
+def normalize_query(text: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    return " ".join(text.lower().split()).rstrip("?!. ")
+
+
+def _features(text: str) -> list:
+    tokens = _TOKEN_PATTERN.findall(text)
+    features = [f"w:{token}" for token in tokens]
+    features += [f"b:{first} {second}" for first, second in zip(tokens, tokens[1:])]
+    for token in tokens:
+        padded = f"<{token}>"
+        features += [f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+    return features
+
+
+def vectorize_sparse(text: str, n_features: int = N_FEATURES):
+    """
+    Map text to an L2-normalized hashed bag of word, bigram and character
+    trigram features with log-scaled counts.
+
+    Parameters:
+    text (str): The text to vectorize.
+    n_features (int): The size of the hashed feature space.
+
+    Returns:
+    tuple: Feature indices and their values as NumPy arrays.
+    """
+    counts = {}
+    for feature in _features(normalize_query(text)):
+        index = zlib.crc32(feature.encode("utf-8")) % n_features
+        counts[index] = counts.get(index, 0) + 1
+    indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    values = np.log1p(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+    norm = np.linalg.norm(values)
+    if norm > 0:
+        values /= norm
+    return indices, values
+
+
+def vectorize(text: str, n_features: int = N_FEATURES) -> np.ndarray:
+    """Dense form of vectorize_sparse."""
+    vector = np.zeros(n_features, dtype=np.float32)
+    indices, values = vectorize_sparse(text, n_features)
+    vector[indices] = values
+    return vector
+
+
+class LocalQueryClassifier:
+    """
+    Multinomial logistic regression over hashed n-gram features.
+
+    Trained at startup from the same labelled examples that are sent to
+    Cohere, and answers in microseconds without a network call.
+    """
+
+    def __init__(self, labels, weights, bias):
+        self.labels = labels
+        self.weights = weights
+        self.bias = bias
+
+    @classmethod
+    def train(cls, texts, labels, epochs=300, learning_rate=1.0, l2=1e-3):
+        classes = sorted(set(labels))
+        X = np.stack([vectorize(text) for text in texts])
+        y = np.zeros((len(texts), len(classes)), dtype=np.float32)
+        y[np.arange(len(texts)), [classes.index(label) for label in labels]] = 1.0
+
+        # Only features that occur in the training data can receive weight
+        active = np.flatnonzero(X.any(axis=0))
+        X_active = X[:, active]
+        W = np.zeros((len(active), len(classes)), dtype=np.float32)
+        b = np.zeros(len(classes), dtype=np.float32)
+        for _ in range(epochs):
+            probabilities = _softmax(X_active @ W + b)
+            error = (probabilities - y) / len(texts)
+            W -= learning_rate * (X_active.T @ error + l2 * W)
+            b -= learning_rate * error.sum(axis=0)
+
+        weights = np.zeros((N_FEATURES, len(classes)), dtype=np.float32)
+        weights[active] = W
+        return cls(classes, weights, b)
+
+    def predict(self, text: str):
+        """
+        Returns:
+        tuple: The predicted label and its probability.
+        """
+        indices, values = vectorize_sparse(text)
+        probabilities = _softmax(values @ self.weights[indices] + self.bias)
+        best = int(np.argmax(probabilities))
+        return self.labels[best], float(probabilities[best])
+
+
+def _softmax(logits):
+    shifted = logits - logits.max(axis=-1, keepdims=True)
+    exp = np.exp(shifted)
+    return exp / exp.sum(axis=-1, keepdims=True)
@@ -0,0 +1,233 @@
+"""
+BM25 search over an on-disk snapshot of bayardcorpus, without Elasticsearch.
+
+A snapshot is a directory written by build_snapshot (see scripts/export_corpus.py):
+
+    meta.json             document count, average document length and the BM25 parameters
+    vocabulary.json       term to term id
+    postings_offsets.npy  where each term's postings start, by term id
+    postings_docs.npy     the document of every posting, grouped by term
+    postings_tf.npy       the term frequency of every posting
+    doc_lengths.npy       the number of indexed terms in each document
+    doc_offsets.npy       where each document starts in docs.bin
+    docs.bin              the documents' fields as JSON, one after another
+
+LocalIndex memory-maps the arrays and docs.bin, so opening a snapshot is
+cheap, gunicorn workers forked after it was opened share its pages, and only
+the documents a search returns are ever decoded.
+"""
+import os
+import re
+import json
+import mmap
+import shutil
+import time
+from array import array
+from collections import Counter
+import numpy as np
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Title terms count this many times, so a match in the title outranks one in the abstract
+TITLE_WEIGHT = 3
+# Fields whose text is indexed; the others are only stored
+INDEXED_FIELDS = ("title", "abstract", "concepts")
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a about an and are as at be by can did do does for from has have how i in is it me of on or "
+    "tell that the their there these they this to was were what when where which who why will with you your".split()
+)
+
+
+def tokenize(text: str) -> list:
+    return [token for token in _TOKEN_PATTERN.findall(text.lower()) if token not in _STOPWORDS]
+
+
+def _field_text(value) -> str:
+    if isinstance(value, (list, tuple)):
+        return " ".join(str(item) for item in value)
+    return str(value) if value is not None else ""
+
+
+def document_terms(doc: dict) -> Counter:
+    terms = Counter()
+    for field in INDEXED_FIELDS:
+        tokens = tokenize(_field_text(doc.get(field)))
+        for _ in range(TITLE_WEIGHT if field == "title" else 1):
+            terms.update(tokens)
+    return terms
+
+
+def build_snapshot(docs, path: str, source: str = None) -> dict:
+    """
+    Write documents and a BM25 index over them as a snapshot directory.
+
+    The snapshot is written next to path and moved into place once complete,
+    so a process opening path never sees a partial one.
+
+    Parameters:
+    docs (iterable): Documents with an "_id" and the fields of bayardcorpus' _source; content_embedding is dropped.
+    path (str): The snapshot directory.
+    source (str): Where the documents came from, recorded in meta.json.
+
+    Returns:
+    dict: The snapshot's meta.json.
+    """
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    vocabulary = {}
+    posting_terms, posting_docs, posting_tf = array("i"), array("i"), array("i")
+    doc_lengths, doc_offsets = array("f"), array("q", [0])
+    with open(os.path.join(tmp_path, "docs.bin"), "wb") as docs_file:
+        for doc_id, doc in enumerate(docs):
+            stored = {key: value for key, value in doc.items() if key != "content_embedding"}
+            encoded = json.dumps(stored, separators=(",", ":")).encode("utf-8")
+            docs_file.write(encoded)
+            doc_offsets.append(doc_offsets[-1] + len(encoded))
+
+            terms = document_terms(doc)
+            doc_lengths.append(sum(terms.values()))
+            for term, tf in terms.items():
+                posting_terms.append(vocabulary.setdefault(term, len(vocabulary)))
+                posting_docs.append(doc_id)
+                posting_tf.append(tf)
+
+    num_docs = len(doc_lengths)
+    terms = np.frombuffer(posting_terms, dtype=np.int32)
+    # Group the postings by term; a stable sort keeps each term's documents in order
+    order = np.argsort(terms, kind="stable")
+    document_frequency = np.bincount(terms, minlength=len(vocabulary))
+    postings_offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    np.cumsum(document_frequency, out=postings_offsets[1:])
+
+    np.save(os.path.join(tmp_path, "postings_offsets.npy"), postings_offsets)
+    np.save(os.path.join(tmp_path, "postings_docs.npy"), np.frombuffer(posting_docs, dtype=np.int32)[order])
+    np.save(os.path.join(tmp_path, "postings_tf.npy"),
+            np.minimum(np.frombuffer(posting_tf, dtype=np.int32)[order], np.iinfo(np.uint16).max).astype(np.uint16))
+    np.save(os.path.join(tmp_path, "doc_lengths.npy"), np.frombuffer(doc_lengths, dtype=np.float32))
+    np.save(os.path.join(tmp_path, "doc_offsets.npy"), np.frombuffer(doc_offsets, dtype=np.int64))
+    with open(os.path.join(tmp_path, "vocabulary.json"), "w") as f:
+        json.dump(vocabulary, f, separators=(",", ":"))
+
+    meta = {
+        "num_docs": num_docs,
+        "num_terms": len(vocabulary),
+        "num_postings": len(terms),
+        "avg_doc_length": float(np.mean(doc_lengths)) if num_docs else 0.0,
+        "k1": BM25_K1,
+        "b": BM25_B,
+        "title_weight": TITLE_WEIGHT,
+        "indexed_fields": list(INDEXED_FIELDS),
+        "source": source,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    old_path = f"{path}.old-{os.getpid()}"
+    if os.path.exists(path):
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return meta
+
+
+class LocalIndex:
+    """
+    A snapshot opened for searching.
+
+    Parameters:
+    path (str): The snapshot directory.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        with open(os.path.join(path, "vocabulary.json")) as f:
+            self.vocabulary = json.load(f)
+        load = lambda name: np.load(os.path.join(path, name), mmap_mode="r")
+        self.postings_offsets = load("postings_offsets.npy")
+        self.postings_docs = load("postings_docs.npy")
+        self.postings_tf = load("postings_tf.npy")
+        self.doc_offsets = load("doc_offsets.npy")
+        self.num_docs = self.meta["num_docs"]
+
+        k1, b = self.meta["k1"], self.meta["b"]
+        self.k1 = k1
+        document_frequency = np.diff(self.postings_offsets).astype(np.float32)
+        self.idf = np.log1p((self.num_docs - document_frequency + 0.5) / (document_frequency + 0.5))
+        # The length normalisation of every document, computed once rather than per query
+        avg_doc_length = self.meta["avg_doc_length"] or 1.0
+        self.length_norm = (k1 * (1 - b + b * load("doc_lengths.npy") / avg_doc_length)).astype(np.float32)
+
+        with open(os.path.join(path, "docs.bin"), "rb") as f:
+            # An empty file cannot be mapped
+            self.docs = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+
+    def document(self, doc_id: int) -> dict:
+        start, end = self.doc_offsets[doc_id], self.doc_offsets[doc_id + 1]
+        return json.loads(self.docs[start:end])
+
+    def scores(self, query: str) -> np.ndarray:
+        """
+        Returns:
+        np.ndarray: The BM25 score of every document for the query.
+        """
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.postings_offsets[term_id], self.postings_offsets[term_id + 1]
+            docs = self.postings_docs[start:end]
+            tf = self.postings_tf[start:end].astype(np.float32)
+            scores[docs] += self.idf[term_id] * tf * (self.k1 + 1) / (tf + self.length_norm[docs])
+        return scores
+
+    def search(self, query: str, size: int = 10) -> list:
+        """
+        Search the snapshot, collapsing documents with the same title like the Elasticsearch query does.
+
+        Parameters:
+        query (str): The user's search query.
+        size (int): The number of unique documents to return.
+
+        Returns:
+        list: Hits shaped like Elasticsearch's, with "_id", "_score" and "_source", best first.
+        """
+        scores = self.scores(query)
+        candidates = np.flatnonzero(scores)
+        # Only the best few candidates are sorted; more are taken if repeated titles leave too few
+        limit = min(len(candidates), size * 4)
+        while True:
+            if limit < len(candidates):
+                top = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+            else:
+                top = candidates
+            top = top[np.lexsort((top, -scores[top]))]
+            hits = self._collapse(top, scores, size)
+            if len(hits) >= size or limit >= len(candidates):
+                return hits
+            limit = min(len(candidates), limit * 4)
+
+    def _collapse(self, doc_ids, scores, size):
+        hits = []
+        seen_titles = set()
+        for doc_id in doc_ids:
+            source = self.document(doc_id)
+            title = source.get("title")
+            if title in seen_titles:
+                continue
+            seen_titles.add(title)
+            hits.append({"_id": source.pop("_id", str(doc_id)), "_score": float(scores[doc_id]), "_source": source})
+            if len(hits) >= size:
+                break
+        return hits
+
+    def close(self):
+        if isinstance(self.docs, mmap.mmap):
+            self.docs.close()
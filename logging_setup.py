@@ -0,0 +1,180 @@
+"""
+Logging for the app and the task worker.
+
+Log calls on the request path only filter the record and put it on a bounded
+in-memory queue; a background listener thread redacts, truncates, formats and
+writes it. When the queue is full, records are dropped and counted rather
+than blocking the request. Records are written as JSON by default.
+
+Log calls should pass their arguments lazily ("%s") rather than as f-strings
+so nothing is formatted for records below the configured level. Large
+payloads, such as a full response, are attached as the "payload" extra field;
+only LOG_PAYLOAD_SAMPLE_RATE of them are kept, truncated to
+LOG_PAYLOAD_MAX_CHARS.
+"""
+import os
+import re
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from pythonjsonlogger import jsonlogger
+from metrics import LOG_RECORDS_DROPPED
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# "json" or "text"
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json").lower()
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+LOG_PAYLOAD_SAMPLE_RATE = float(os.environ.get("LOG_PAYLOAD_SAMPLE_RATE", "0.01"))
+LOG_PAYLOAD_MAX_CHARS = int(os.environ.get("LOG_PAYLOAD_MAX_CHARS", "2000"))
+LOG_MESSAGE_MAX_CHARS = int(os.environ.get("LOG_MESSAGE_MAX_CHARS", "4000"))
+
+REDACTED = "[REDACTED]"
+# Extra fields whose values are never written
+SECRET_FIELDS = re.compile(r"api_?key|authorization|password|secret|token$", re.IGNORECASE)
+# Secrets that may appear inside a message: bearer tokens, OpenAI style keys and key=value pairs
+SECRET_PATTERNS = [
+    (re.compile(r"(Bearer\s+)[^\s,;\"']+", re.IGNORECASE), r"\1" + REDACTED),
+    (re.compile(r"\bsk-[A-Za-z0-9_-]{16,}"), REDACTED),
+    (re.compile(r"((?:api[_-]?key|password|secret)[\"']?\s*[:=]\s*[\"']?)[^\s,;\"'}]+", re.IGNORECASE), r"\1" + REDACTED),
+]
+
+# Attributes every LogRecord has; anything else was passed as an extra field
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+_lock = threading.Lock()
+_configured_pid = None
+_hooks_registered = False
+_handler = None
+_listener = None
+_output = None
+
+
+def redact(text: str) -> str:
+    for pattern, replacement in SECRET_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def truncate(text: str, limit: int) -> str:
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... [{len(text) - limit} more chars]"
+
+
+class PayloadSampler(logging.Filter):
+    """Keep the "payload" field of a sample of records; the records themselves are always kept."""
+
+    def filter(self, record):
+        if hasattr(record, "payload") and random.random() >= LOG_PAYLOAD_SAMPLE_RATE:
+            del record.payload
+        return True
+
+
+class RedactingFilter(logging.Filter):
+    """Format the message, then strip secrets from it and from the extra fields, and truncate both."""
+
+    def filter(self, record):
+        record.msg = truncate(redact(record.getMessage()), LOG_MESSAGE_MAX_CHARS)
+        record.args = None
+        for name, value in list(vars(record).items()):
+            if name in _RECORD_ATTRIBUTES:
+                continue
+            if SECRET_FIELDS.search(name):
+                setattr(record, name, REDACTED)
+            elif name == "payload":
+                record.payload = truncate(redact(json.dumps(value, default=str)), LOG_PAYLOAD_MAX_CHARS)
+            elif isinstance(value, str):
+                setattr(record, name, truncate(redact(value), LOG_MESSAGE_MAX_CHARS))
+        return True
+
+
+class BoundedQueueHandler(QueueHandler):
+    """A QueueHandler that drops records when its queue is full instead of blocking."""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+    def prepare(self, record):
+        # The listener thread formats the record; it never leaves this process, so it need not be pickled
+        return record
+
+
+def build_formatter():
+    if LOG_FORMAT == "text":
+        return logging.Formatter("%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s")
+    return jsonlogger.JsonFormatter("%(asctime)s %(levelname)s %(name)s %(process)d %(message)s",
+                                    rename_fields={"levelname": "level", "asctime": "time"})
+
+
+def configure_logging(stream=None):
+    """
+    Send all logging through a bounded queue to a background writer.
+
+    Replaces any handlers on the root logger. Safe to call more than once; a
+    forked child starts its own queue and writer.
+
+    Parameters:
+    stream: Where records are written. Defaults to stderr.
+    """
+    global _configured_pid, _hooks_registered, _output
+    with _lock:
+        if _configured_pid == os.getpid():
+            return
+        output = logging.StreamHandler(stream or sys.stderr)
+        output.setFormatter(build_formatter())
+        output.addFilter(RedactingFilter())
+        _output = output
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.setLevel(LOG_LEVEL)
+        _start()
+        root.addHandler(_handler)
+        if not _hooks_registered:
+            os.register_at_fork(after_in_child=_restart_in_child)
+            atexit.register(shutdown_logging)
+            _hooks_registered = True
+        _configured_pid = os.getpid()
+
+
+def _start():
+    global _handler, _listener
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    if _handler is None:
+        _handler = BoundedQueueHandler(log_queue)
+        _handler.addFilter(PayloadSampler())
+    else:
+        _handler.queue = log_queue
+    _listener = QueueListener(log_queue, _output, respect_handler_level=True)
+    _listener.start()
+
+
+def _restart_in_child():
+    # The parent's writer thread does not exist after a fork and its queued records are the parent's to write
+    global _configured_pid
+    if _configured_pid is None or _configured_pid == os.getpid():
+        return
+    _start()
+    _configured_pid = os.getpid()
+
+
+def shutdown_logging():
+    """Write out the queued records and stop the writer."""
+    global _listener, _configured_pid
+    if _listener is not None and _configured_pid == os.getpid():
+        _listener.stop()
+        _listener = None
+        _configured_pid = None
+
+
+def queue_depth() -> int:
+    return _handler.queue.qsize() if _handler is not None else 0
@@ -0,0 +1,190 @@
+"""
+Prometheus metrics and per-request stage timings.
+
+Every pipeline stage is timed into a histogram and into the current request's
+list of spans, which is returned in the Server-Timing header. Calls to
+OpenAI, Cohere, Elasticsearch, Postgres and Supabase are counted per
+upstream, model and stage, as are their errors, and token usage is counted
+per model and stage.
+
+Under gunicorn, set PROMETHEUS_MULTIPROC_DIR to an empty directory before
+the app starts so every worker writes its samples there and /metrics
+aggregates them (see gunicorn.conf.py); otherwise each worker only reports
+its own.
+"""
+import os
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+
+PROMETHEUS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+METRICS_PATH = "/metrics"
+
+# Stages range from a sub-millisecond cache hit to a long generation
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+REQUEST_SECONDS = Histogram("bayard_request_duration_seconds", "Time to handle a request.",
+                            ["route", "method", "status"], buckets=STAGE_BUCKETS)
+STAGE_SECONDS = Histogram("bayard_stage_duration_seconds", "Time spent in a pipeline stage.",
+                          ["stage"], buckets=STAGE_BUCKETS)
+UPSTREAM_REQUESTS = Counter("bayard_upstream_requests_total", "Calls to an upstream service.",
+                            ["upstream", "model", "stage"])
+UPSTREAM_ERRORS = Counter("bayard_upstream_errors_total", "Calls to an upstream service that raised.",
+                          ["upstream", "model", "stage"])
+TOKENS = Counter("bayard_tokens_total", "Tokens sent to and generated by models.",
+                 ["model", "stage", "kind"])
+LOG_RECORDS_DROPPED = Counter("bayard_log_records_dropped_total", "Log records dropped because the log queue was full.")
+# Each worker has its own breakers; across workers the most open state is reported
+BREAKER_STATE = Gauge("bayard_circuit_breaker_state", "Circuit breaker state: 0 closed, 1 half open, 2 open.",
+                      ["upstream"], multiprocess_mode="livemax")
+BREAKER_REJECTIONS = Counter("bayard_circuit_breaker_rejections_total", "Calls refused by an open circuit breaker.",
+                             ["upstream"])
+UPSTREAM_RETRIES = Counter("bayard_upstream_retries_total", "Retries of failed upstream calls.", ["upstream", "stage"])
+HEDGED_REQUESTS = Counter("bayard_hedged_requests_total", "Hedged upstream requests sent, and those that answered first.",
+                          ["upstream", "stage", "outcome"])
+DEGRADED = Counter("bayard_degraded_total", "Work skipped, shortened or served from a fallback to keep a request within its budget.",
+                   ["stage"])
+RETRIEVER_FAILOVERS = Counter("bayard_retriever_failovers_total", "Searches answered by the fallback retriever.",
+                              ["primary", "fallback"])
+# Summed across workers: the requests admitted to, and waiting for, the pipeline
+ADMISSION_IN_FLIGHT = Gauge("bayard_admission_in_flight", "Requests admitted to the pipeline.", multiprocess_mode="livesum")
+ADMISSION_QUEUED = Gauge("bayard_admission_queued", "Requests waiting for admission.", multiprocess_mode="livesum")
+ADMISSION_REJECTIONS = Counter("bayard_admission_rejections_total", "Requests refused with a 503 by admission control.",
+                               ["tier", "reason"])
+# Waits for a pooled Postgres connection; a growing tail means the pool is saturated
+DB_POOL_WAIT_SECONDS = Histogram("bayard_db_pool_wait_seconds", "Time spent waiting for a pooled database connection.",
+                                 buckets=STAGE_BUCKETS)
+DB_POOL_IN_USE = Gauge("bayard_db_pool_connections_in_use", "Database connections checked out of the pool.",
+                       multiprocess_mode="livesum")
+DB_POOL_TIMEOUTS = Counter("bayard_db_pool_timeouts_total", "Checkouts that gave up waiting for a database connection.")
+BULK_WRITER_ROWS = Counter("bayard_bulk_writer_rows_total",
+                           "Rows handled by the bulk writers: written, spilled, replayed, dead, direct or lost.",
+                           ["table", "outcome"])
+
+# The spans of the current request; threads started with a copied context share the same list
+_current_spans = ContextVar("stage_spans", default=None)
+_lock = threading.Lock()
+
+
+def start_request_timing():
+    """Begin collecting stage spans for a new request."""
+    _current_spans.set([])
+
+
+def record_stage(stage: str, seconds: float):
+    """
+    Record the duration of one stage in the histogram and in the current request's spans.
+
+    Parameters:
+    stage (str): The pipeline stage.
+    seconds (float): How long it took.
+    """
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    spans = _current_spans.get()
+    if spans is None:
+        return
+    with _lock:
+        spans.append((stage, seconds))
+
+
+@contextmanager
+def timed(stage: str):
+    """Time the enclosed block as a stage, whether or not it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+@contextmanager
+def upstream_call(upstream: str, model: str, stage: str):
+    """
+    Count a call to an upstream service and, if the enclosed block raises, an error.
+
+    Parameters:
+    upstream (str): The service called, e.g. "openai" or "elasticsearch".
+    model (str): The model, index or table called.
+    stage (str): The pipeline stage making the call.
+    """
+    UPSTREAM_REQUESTS.labels(upstream, model or "unknown", stage).inc()
+    try:
+        yield
+    except Exception:
+        UPSTREAM_ERRORS.labels(upstream, model or "unknown", stage).inc()
+        raise
+
+
+def count_upstream_error(upstream: str, model: str, stage: str):
+    # For calls whose errors are reported in the response rather than raised
+    UPSTREAM_ERRORS.labels(upstream, model or "unknown", stage).inc()
+
+
+def record_tokens(stage: str, model: str, prompt_tokens: int, completion_tokens: int):
+    TOKENS.labels(model or "unknown", stage, "prompt").inc(prompt_tokens)
+    TOKENS.labels(model or "unknown", stage, "completion").inc(completion_tokens)
+
+
+def observe_request(route: str, method: str, status: int, seconds: float):
+    REQUEST_SECONDS.labels(route, method, str(status)).observe(seconds)
+
+
+def get_spans() -> list:
+    spans = _current_spans.get()
+    with _lock:
+        return list(spans or [])
+
+
+def server_timing_header(total: float = None) -> str:
+    """
+    Format the current request's spans as a Server-Timing header.
+
+    Stages that ran more than once, such as a stage run for every query of a
+    batch, are summed.
+
+    Parameters:
+    total (float): Seconds the whole request took so far, reported as "total".
+
+    Returns:
+    str: e.g. "classify_query;dur=12.3, search_elasticsearch;dur=48.1", or an empty string.
+    """
+    durations = {}
+    for stage, seconds in get_spans():
+        durations[stage] = durations.get(stage, 0.0) + seconds
+    if total is not None:
+        durations["total"] = total
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in durations.items())
+
+
+def render_metrics():
+    """
+    Render the metrics in the Prometheus text format, aggregated across
+    processes when PROMETHEUS_MULTIPROC_DIR is set.
+
+    Returns:
+    tuple: The body and its content type.
+    """
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def clear_multiprocess_dir():
+    # Samples left by a previous run would otherwise be added to this one's
+    if not PROMETHEUS_MULTIPROC_DIR:
+        return
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+    for name in os.listdir(PROMETHEUS_MULTIPROC_DIR):
+        if name.endswith(".db"):
+            os.remove(os.path.join(PROMETHEUS_MULTIPROC_DIR, name))
+
+
+def mark_process_dead(pid: int):
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
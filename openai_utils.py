@@ -1,12 +1,12 @@
 import openai
 import os
 import re
+from prompt_builder import PROMPT_INPUT_BUDGET, TOKENS_PER_MESSAGE, build_context, count_message_tokens, count_tokens
+from token_usage import record_usage
+from resilience import OPENAI_TIMEOUT, call, call_async, guarded
+from deadline import budget_timeout, document_budget, token_budget
 
-def initialize_openai():
-    openai.api_key = os.environ.get("OPENAI_API_KEY")
-
-def predict(input_text: str, filtered_docs: list, conversation_history: list, openai_api_key: str, elasticsearch_url: str, elasticsearch_index: str, max_hits: int = 10, max_tokens: int = 3000) -> str:
-    system_instructions = """
+PREDICT_SYSTEM_INSTRUCTIONS = """
     Your name is Bayard, an advanced open-source retrieval-augmented generative AI assistant created to guide users through a comprehensive academic corpus covering a wide range of LGBTQ+ topics. Specifically, you are an alpha-stage version of Bayard, named Bayard_One. Your purpose is to offer insightful, nuanced, and well-informed responses to user queries by drawing upon the wealth of information contained within the corpus documents. You were given over 20,000 LGBTQ+ academic works to query. You were created by a team at Bayard Lab, a research non-profit focused on leveraging artificial intelligence (AI) for good. Users can learn more at https://bayardlab.org.
     <objective>Provide relevant, informative, and thought-provoking content that enhances users' understanding of LGBTQ+ issues, history, culture, and experiences.</objective>
     <objective>Thoroughly analyze user queries and carefully search the corpus for the most pertinent documents and passages.</objective>
@@ -69,64 +69,134 @@ def predict(input_text: str, filtered_docs: list, conversation_history: list, op
 </communication_style>
 """
 
-    model_input = f"User Query: {input_text}\n\n"
-    model_input += "Retrieved Documents:\n"
-    total_tokens = len(input_text.split())
+CONVERSATION_SYSTEM_INSTRUCTIONS = """
+    You are Bayard, an advanced open-source retrieval-augmented generative AI assistant created to guide users through a comprehensive academic corpus covering a wide range of LGBTQIA+ topics. Your purpose is to offer insightful, nuanced, and well-informed responses to user queries by drawing upon the wealth of information contained within the corpus documents.
 
-    if not filtered_docs:
-        model_input += "No relevant documents found.\n"
-        
-    else:
-        if isinstance(max_hits, list):
-            if len(max_hits) > 0 and isinstance(max_hits[0], (int, str)):
-                max_hits_int = int(max_hits[0])  # Convert the first element of max_hits list to an integer
-            else:
-                max_hits_int = 10  # Set a default value if max_hits is an empty list or contains non-integer/non-string values
+    <why_bayard_exists>
+    Bayard exists to democratize access to LGBTQIA+ scholarship and empower individuals from all backgrounds to engage with and contribute to the dynamic field of queer studies. By providing a centralized platform for exploring the diverse and complex landscape of LGBTQIA+ knowledge, Bayard aims to foster a deeper understanding of the community's experiences, challenges, and triumphs.
+
+    As an open-source platform, Bayard's codebase is available for anyone to access, review, and contribute to, enabling a global community of developers, researchers, and advocates to collectively shape the future of LGBTQIA+ scholarship. This commitment to openness and collaboration is at the core of Bayard's mission to drive innovation, promote accessibility, and amplify LGBTQIA+ voices in the realm of scholarly research.
+    </why_bayard_exists>
+
+    The user is currently requesting a conversation with you. While you are designed to engage in open-ended conversations, your primary goal is to serve as a resource for users seeking information on LGBTQIA+ topics. Therefore, when a user initiates a conversation, your objective is to encourage them to ask a specific query related to their research or information needs.
+
+    When generating responses, follow these guidelines:
+    1. Analyze the user's input to understand the context and intent of their message.
+    2. If the user's message is a general conversation starter or not directly related to a specific LGBTQIA+ topic, politely acknowledge their message and encourage them to ask a specific question or provide a topic they would like to research.
+    3. Explain that you are a powerful resource designed to assist with LGBTQIA+ research queries, and that you can provide the most valuable assistance when the user has a specific question or topic in mind.
+    4. Offer examples of the types of queries you can help with, such as LGBTQIA+ history, culture, social issues, activism, or any other relevant topics.
+    5. Maintain a friendly, approachable, and professional tone throughout the conversation, while gently guiding the user towards making a specific research request.
+    6. If the user provides a specific query, transition to using your retrieval-augmented generation capabilities to provide a comprehensive and well-informed response based on the corpus documents.
+
+    Remember, while you can engage in general conversation, your primary purpose is to serve as a research assistant for LGBTQIA+ topics. By encouraging users to ask specific questions, you can better fulfill your role and provide the most valuable assistance.
+    """
+
+def initialize_openai():
+    openai.api_key = os.environ.get("OPENAI_API_KEY")
+
+# Failed requests are retried by resilience.call rather than by the client
+openai.timeout = OPENAI_TIMEOUT
+openai.max_retries = 0
+
+def memory_messages(conversation_memory: dict) -> list:
+    """
+    Parameters:
+    conversation_memory (dict): The user's "summary" and recent "turns" (see conversation_memory.py), or None.
+
+    Returns:
+    list: The summary as a system message, then each recent turn as a user and an assistant message.
+    """
+    if not conversation_memory:
+        return []
+    messages = []
+    if conversation_memory["summary"]:
+        messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{conversation_memory['summary']}"})
+    for turn in conversation_memory["turns"]:
+        messages.append({"role": "user", "content": turn["input_text"]})
+        messages.append({"role": "assistant", "content": turn["model_output"]})
+    return messages
+
+def build_predict_messages(input_text: str, filtered_docs: list, conversation_memory: dict = None, max_hits: int = 10) -> list:
+    if isinstance(max_hits, list):
+        if len(max_hits) > 0 and isinstance(max_hits[0], (int, str)):
+            max_hits_int = int(max_hits[0])  # Convert the first element of max_hits list to an integer
         else:
-            max_hits_int = int(max_hits)  # Convert max_hits to an integer
-        for i, doc in enumerate(filtered_docs):
-            if i >= max_hits_int:
-                break
-            model_input += f"Document {i+1}:\n"
-            model_input += f"Title: {doc.get('title', 'N/A')}\n"
-            model_input += f"Authors: {', '.join(doc.get('authors', []))}\n"
-            model_input += f"Content: {doc.get('abstract', 'N/A')}\n"
-            model_input += f"Classification: {doc.get('classification', 'N/A')}\n"
-            model_input += f"Concepts: {', '.join(doc.get('concepts', []))}\n"
-            model_input += f"Emotion: {doc.get('emotion', 'N/A')}\n"
-            model_input += f"Year Published: {doc.get('yearPublished', 'N/A')}\n"
-            model_input += f"Download URL: {doc.get('downloadUrl', 'N/A')}\n"
-            model_input += f"Sentiment: {doc.get('sentiment', 'N/A')}\n"
-            model_input += f"Categories: {', '.join(doc.get('categories', []))}\n"
-            model_input += f"ID: {doc.get('_id', 'N/A')}\n\n"
-
-    model_input += "Based on the user's query and the retrieved documents, provide a helpful response.\n\nResponse:"
+            max_hits_int = 10  # Set a default value if max_hits is an empty list or contains non-integer/non-string values
+    else:
+        max_hits_int = int(max_hits)  # Convert max_hits to an integer
+    # Fewer documents make for a shorter prompt when the request is running out of time
+    max_hits_int = document_budget(max_hits_int)
 
-    # Use OpenAI's GPT-4 model to generate a response
-    
     messages = [
-        {"role": "system", "content": system_instructions},
-        *[{"role": "user", "content": f"User: {entry['input_text']}\nAssistant: {entry['model_output']}"} for entry in conversation_history],
-        {"role": "user", "content": f"User: {input_text}"}
+        {"role": "system", "content": PREDICT_SYSTEM_INSTRUCTIONS},
+        *memory_messages(conversation_memory),
     ]
-        
-    response = openai.chat.completions.create(
-        model=os.environ.get("OPENAI_MODEL_ID"),
+
+    # Whatever the system prompt and conversation memory leave of the input budget goes to the retrieved documents
+    context_budget = PROMPT_INPUT_BUDGET - count_message_tokens(messages) - TOKENS_PER_MESSAGE
+    model_input, _ = build_context(input_text, filtered_docs, context_budget, max_hits_int)
+    messages.append({"role": "user", "content": model_input})
+    return messages
+
+def _record_response_usage(stage: str, model: str, response):
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        record_usage(stage, model, usage.prompt_tokens, usage.completion_tokens)
+
+def stream_chat_completion(messages: list, max_tokens: int = 3000, stage: str = "stream_chat_completion"):
+    """
+    Stream a chat completion from OpenAI.
+
+    Streamed responses carry no usage, so the tokens are counted locally.
+
+    Yields:
+    str: Each content delta as the model produces it.
+    """
+    model = os.environ.get("OPENAI_MODEL_ID")
+    with guarded("openai", model, stage):
+        stream = openai.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=token_budget(max_tokens),
+            timeout=budget_timeout(OPENAI_TIMEOUT),
+            n=1,
+            stop=None,
+            temperature=0.7,
+            stream=True,
+        )
+        chunks = []
+        try:
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    chunks.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+        finally:
+            record_usage(stage, model, count_message_tokens(messages), count_tokens("".join(chunks)), estimated=True)
+
+def predict(input_text: str, filtered_docs: list, conversation_memory: dict, openai_api_key: str, elasticsearch_url: str, elasticsearch_index: str, max_hits: int = 10, max_tokens: int = 3000) -> str:
+    messages = build_predict_messages(input_text, filtered_docs, conversation_memory, max_hits)
+
+    # Use OpenAI's GPT-4 model to generate a response
+    model = os.environ.get("OPENAI_MODEL_ID")
+    response = call("openai", model, "generate_model_output", lambda: openai.chat.completions.create(
+        model=model,
         messages=messages,
-        max_tokens=max_tokens,
+        max_tokens=token_budget(max_tokens),
+        timeout=budget_timeout(OPENAI_TIMEOUT),
         n=1,
         stop=None,
         temperature=0.7,
-    )
+    ))
+    _record_response_usage("generate_model_output", model, response)
     model_output = response.choices[0].message.content
     return model_output
 
 # Generate model output
-def generate_model_output(input_text: str, filtered_docs: list, max_hits: int = 10, max_tokens: int = 3000) -> str:
+def generate_model_output(input_text: str, filtered_docs: list, conversation_memory: dict = None, max_hits: int = 10, max_tokens: int = 3000) -> str:
     model_output = predict(
         input_text,
         filtered_docs,
-        conversation_history=[],
+        conversation_memory=conversation_memory,
         openai_api_key=os.environ.get("OPENAI_API_KEY"),
         elasticsearch_url=os.environ.get("ES_URL"),
         elasticsearch_index="bayardcorpus",
@@ -135,8 +205,12 @@ def generate_model_output(input_text: str, filtered_docs: list, max_hits: int =
     )
     return model_output
 
-def generate_search_quality_reflection(search_results: list, input_text: str) -> dict:
-    system_instructions = """
+def generate_model_output_stream(input_text: str, filtered_docs: list, conversation_memory: dict = None, max_hits: int = 10, max_tokens: int = 3000):
+    # Streaming counterpart of generate_model_output
+    messages = build_predict_messages(input_text, filtered_docs, conversation_memory, max_hits)
+    yield from stream_chat_completion(messages, max_tokens=max_tokens, stage="generate_model_output")
+
+SEARCH_QUALITY_SYSTEM_INSTRUCTIONS = """
     You are an AI assistant designed to evaluate the quality and relevance of search results based on a given user query. Your primary goal is to provide a concise reflection on the search quality and assign a score between 1 and 5, where 1 indicates poor quality and 5 indicates excellent quality.
 </description>
 
@@ -192,6 +266,7 @@ def generate_search_quality_reflection(search_results: list, input_text: str) ->
 </directive>
 """
 
+def build_search_quality_prompt(search_results: list, input_text: str) -> str:
     search_quality_prompt = f"User Query: {input_text}\n\n"
     search_quality_prompt += "Search Results:\n"
 
@@ -202,57 +277,169 @@ def generate_search_quality_reflection(search_results: list, input_text: str) ->
 
     search_quality_prompt += "Based on the user query and the provided search results, please provide a reflection on the quality and relevance of the search results. Also, assign a search quality score between 1 and 5, where 1 indicates poor quality and 5 indicates excellent quality.\n\nReflection:"
 
-    response = openai.completions.create(
-        model="gpt-3.5-turbo-instruct",
-        prompt=system_instructions + "\n\n" + search_quality_prompt,
-        max_tokens=100
-    )
+    return SEARCH_QUALITY_SYSTEM_INSTRUCTIONS + "\n\n" + search_quality_prompt
+
+def _search_quality_result(response) -> dict:
+    _record_response_usage("search_quality_reflection", "gpt-3.5-turbo-instruct", response)
 
     reflection_output = response.choices[0].text.strip()
-    score_match = re.search(r'(\d+)', reflection_output)
-    score = int(score_match.group(1)) if score_match else None
+    score = parse_reflection_score(reflection_output)
 
     return {
         "search_quality_reflection": reflection_output,
         "search_quality_score": score
     }
 
-def generate_conversation_response(input_text, conversation_history):
-    system_instructions = """
-    You are Bayard, an advanced open-source retrieval-augmented generative AI assistant created to guide users through a comprehensive academic corpus covering a wide range of LGBTQIA+ topics. Your purpose is to offer insightful, nuanced, and well-informed responses to user queries by drawing upon the wealth of information contained within the corpus documents.
-
-    <why_bayard_exists>
-    Bayard exists to democratize access to LGBTQIA+ scholarship and empower individuals from all backgrounds to engage with and contribute to the dynamic field of queer studies. By providing a centralized platform for exploring the diverse and complex landscape of LGBTQIA+ knowledge, Bayard aims to foster a deeper understanding of the community's experiences, challenges, and triumphs.
-
-    As an open-source platform, Bayard's codebase is available for anyone to access, review, and contribute to, enabling a global community of developers, researchers, and advocates to collectively shape the future of LGBTQIA+ scholarship. This commitment to openness and collaboration is at the core of Bayard's mission to drive innovation, promote accessibility, and amplify LGBTQIA+ voices in the realm of scholarly research.
-    </why_bayard_exists>
-
-    The user is currently requesting a conversation with you. While you are designed to engage in open-ended conversations, your primary goal is to serve as a resource for users seeking information on LGBTQIA+ topics. Therefore, when a user initiates a conversation, your objective is to encourage them to ask a specific query related to their research or information needs.
+def generate_search_quality_reflection(search_results: list, input_text: str) -> dict:
+    response = call("openai", "gpt-3.5-turbo-instruct", "search_quality_reflection", lambda: openai.completions.create(
+        model="gpt-3.5-turbo-instruct",
+        prompt=build_search_quality_prompt(search_results, input_text),
+        max_tokens=100,
+        timeout=budget_timeout(OPENAI_TIMEOUT),
+    ))
+    return _search_quality_result(response)
 
-    When generating responses, follow these guidelines:
-    1. Analyze the user's input to understand the context and intent of their message.
-    2. If the user's message is a general conversation starter or not directly related to a specific LGBTQIA+ topic, politely acknowledge their message and encourage them to ask a specific question or provide a topic they would like to research.
-    3. Explain that you are a powerful resource designed to assist with LGBTQIA+ research queries, and that you can provide the most valuable assistance when the user has a specific question or topic in mind.
-    4. Offer examples of the types of queries you can help with, such as LGBTQIA+ history, culture, social issues, activism, or any other relevant topics.
-    5. Maintain a friendly, approachable, and professional tone throughout the conversation, while gently guiding the user towards making a specific research request.
-    6. If the user provides a specific query, transition to using your retrieval-augmented generation capabilities to provide a comprehensive and well-informed response based on the corpus documents.
+# The directive asks for the score first; "Document 3" or a year later in the sentence is not a score
+_LEADING_SCORE = re.compile(r'^\W*(?:score\W*)?([1-5])(?![\d.]\d)\b', re.IGNORECASE)
+_SCORE_OUT_OF_FIVE = re.compile(r'\b([1-5])\s*(?:/|out of)\s*5\b', re.IGNORECASE)
 
-    Remember, while you can engage in general conversation, your primary purpose is to serve as a research assistant for LGBTQIA+ topics. By encouraging users to ask specific questions, you can better fulfill your role and provide the most valuable assistance.
+def parse_reflection_score(reflection: str):
+    """
+    Returns:
+    int: The 1-5 score at the start of a reflection (or written as "N/5"), or None.
     """
+    match = _LEADING_SCORE.search(reflection) or _SCORE_OUT_OF_FIVE.search(reflection)
+    return int(match.group(1)) if match else None
 
+def build_conversation_messages(input_text: str, conversation_memory: dict = None) -> list:
     messages = [
-        {"role": "system", "content": system_instructions},
-        *[{"role": "user", "content": f"User: {entry['input_text']}\nAssistant: {entry['model_output']}"} for entry in conversation_history],
+        {"role": "system", "content": CONVERSATION_SYSTEM_INSTRUCTIONS},
+        *memory_messages(conversation_memory),
         {"role": "user", "content": f"User: {input_text}"}
-    ]    
-    response = openai.chat.completions.create(
-        model=os.environ.get("OPENAI_MODEL_ID"),
+    ]
+    return messages
+
+def generate_conversation_response(input_text, conversation_memory=None):
+    messages = build_conversation_messages(input_text, conversation_memory)
+    model = os.environ.get("OPENAI_MODEL_ID")
+    response = call("openai", model, "generate_conversation_response", lambda: openai.chat.completions.create(
+        model=model,
         messages=messages,
-        max_tokens=3000,
+        max_tokens=token_budget(3000),
+        timeout=budget_timeout(OPENAI_TIMEOUT),
         n=1,
         stop=None,
         temperature=0.7,
-    )
+    ))
+    _record_response_usage("generate_conversation_response", model, response)
     model_output = response.choices[0].message.content
     return model_output
 
+def generate_conversation_response_stream(input_text, conversation_memory=None):
+    # Streaming counterpart of generate_conversation_response
+    messages = build_conversation_messages(input_text, conversation_memory)
+    yield from stream_chat_completion(messages, max_tokens=3000, stage="generate_conversation_response")
+
+CONVERSATION_SUMMARY_INSTRUCTIONS = """
+    You maintain the memory of a conversation between a user and Bayard, a research assistant for LGBTQIA+ scholarship. You are given the current summary of the conversation, which may be empty, and the turns that followed it. Write an updated summary that a later reply can rely on: the topics and questions the user has raised, what they are trying to find out, facts or preferences they have stated, and the key points and sources Bayard gave in answer. Keep it factual, in the third person, and under 200 words. Return only the summary.
+    """
+
+def generate_conversation_summary(summary: str, turns: list, max_tokens: int = 300) -> str:
+    """
+    Fold conversation turns into a running summary.
+
+    Parameters:
+    summary (str): The summary so far, or an empty string.
+    turns (list): The turns to fold in, oldest first.
+    max_tokens (int): The longest the summary may be.
+
+    Returns:
+    str: The updated summary.
+    """
+    transcript = "\n\n".join(f"User: {turn['input_text']}\nBayard: {turn['model_output']}" for turn in turns)
+    model = os.environ.get("OPENAI_MODEL_ID")
+    response = call("openai", model, "summarize_conversation", lambda: openai.chat.completions.create(
+        model=model,
+        messages=[
+            {"role": "system", "content": CONVERSATION_SUMMARY_INSTRUCTIONS},
+            {"role": "user", "content": f"Current summary:\n{summary or '(none)'}\n\nNew turns:\n{transcript}"},
+        ],
+        max_tokens=max_tokens,
+        timeout=OPENAI_TIMEOUT,
+        n=1,
+        stop=None,
+        temperature=0.3,
+    ))
+    _record_response_usage("summarize_conversation", model, response)
+    return response.choices[0].message.content.strip()
+
+# Async counterparts for async_app; each takes an openai.AsyncOpenAI client
+
+async def generate_model_output_async(client, input_text: str, filtered_docs: list, conversation_memory: dict = None, max_hits: int = 10, max_tokens: int = 3000) -> str:
+    messages = build_predict_messages(input_text, filtered_docs, conversation_memory, max_hits)
+    model = os.environ.get("OPENAI_MODEL_ID")
+    response = await call_async("openai", model, "generate_model_output", lambda: client.chat.completions.create(
+        model=model,
+        messages=messages,
+        max_tokens=token_budget(max_tokens),
+        timeout=budget_timeout(OPENAI_TIMEOUT),
+        n=1,
+        stop=None,
+        temperature=0.7,
+    ))
+    _record_response_usage("generate_model_output", model, response)
+    return response.choices[0].message.content
+
+async def stream_chat_completion_async(client, messages: list, max_tokens: int = 3000, stage: str = "stream_chat_completion"):
+    model = os.environ.get("OPENAI_MODEL_ID")
+    with guarded("openai", model, stage):
+        stream = await client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=token_budget(max_tokens),
+            timeout=budget_timeout(OPENAI_TIMEOUT),
+            n=1,
+            stop=None,
+            temperature=0.7,
+            stream=True,
+        )
+        chunks = []
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    chunks.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+        finally:
+            record_usage(stage, model, count_message_tokens(messages), count_tokens("".join(chunks)), estimated=True)
+
+def generate_model_output_stream_async(client, input_text: str, filtered_docs: list, conversation_memory: dict = None, max_hits: int = 10, max_tokens: int = 3000):
+    messages = build_predict_messages(input_text, filtered_docs, conversation_memory, max_hits)
+    return stream_chat_completion_async(client, messages, max_tokens=max_tokens, stage="generate_model_output")
+
+async def generate_search_quality_reflection_async(client, search_results: list, input_text: str) -> dict:
+    response = await call_async("openai", "gpt-3.5-turbo-instruct", "search_quality_reflection", lambda: client.completions.create(
+        model="gpt-3.5-turbo-instruct",
+        prompt=build_search_quality_prompt(search_results, input_text),
+        max_tokens=100,
+        timeout=budget_timeout(OPENAI_TIMEOUT),
+    ))
+    return _search_quality_result(response)
+
+async def generate_conversation_response_async(client, input_text, conversation_memory=None):
+    messages = build_conversation_messages(input_text, conversation_memory)
+    model = os.environ.get("OPENAI_MODEL_ID")
+    response = await call_async("openai", model, "generate_conversation_response", lambda: client.chat.completions.create(
+        model=model,
+        messages=messages,
+        max_tokens=token_budget(3000),
+        timeout=budget_timeout(OPENAI_TIMEOUT),
+        n=1,
+        stop=None,
+        temperature=0.7,
+    ))
+    _record_response_usage("generate_conversation_response", model, response)
+    return response.choices[0].message.content
+
+def generate_conversation_response_stream_async(client, input_text, conversation_memory=None):
+    messages = build_conversation_messages(input_text, conversation_memory)
+    return stream_chat_completion_async(client, messages, max_tokens=3000, stage="generate_conversation_response")
@@ -0,0 +1,95 @@
+import os
+import json
+import uuid
+import datetime
+from deadline import degraded
+
+# Shared by the Flask app (app.py) and the asyncio app (async_app.py)
+
+# Per-stage timeouts in seconds used when the pipeline stages run concurrently
+SEARCH_QUALITY_TIMEOUT = float(os.environ.get("SEARCH_QUALITY_TIMEOUT", "30"))
+GENERATION_TIMEOUT = float(os.environ.get("GENERATION_TIMEOUT", "110"))
+
+# Evaluate and store runs on the Redis task queue (see worker.py) instead of the request thread
+BACKGROUND_TASKS_ENABLED = os.environ.get("BAYARD_BACKGROUND_TASKS", "false").lower() in ("1", "true", "yes")
+
+# Batch endpoint limits; each query counts against the rate limit
+BATCH_MAX_QUERIES = int(os.environ.get("BATCH_MAX_QUERIES", "100"))
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "4"))
+
+# Fields of a search response kept in the answer cache, including the id of the stored run that produced it
+SEARCH_ANSWER_FIELDS = ("run_id", "timestamp", "search_quality_reflection", "search_quality_score", "documents",
+                        "model_output")
+
+NO_SEARCH_QUALITY = {"search_quality_reflection": None, "search_quality_score": None}
+
+
+def new_run():
+    """
+    Returns:
+    tuple: A new run id and the current timestamp.
+    """
+    return str(uuid.uuid4()), datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def build_search_response(input_text: str, search_results: list, search_quality: dict, model_output: str) -> dict:
+    run_id, timestamp = new_run()
+    return {
+        "run_id": run_id,
+        "timestamp": timestamp,
+        "input_text": input_text,
+        "search_quality_reflection": search_quality["search_quality_reflection"],
+        "search_quality_score": search_quality["search_quality_score"],
+        "documents": format_documents(search_results),
+        "model_output": model_output
+    }
+
+
+def search_answer(response_data: dict) -> dict:
+    return {field: response_data[field] for field in SEARCH_ANSWER_FIELDS}
+
+
+def cached_search_response(input_text: str, answer: dict) -> dict:
+    # No new run is stored for a cache hit, so it points at the run the answer came from
+    return {
+        "run_id": answer["run_id"],
+        "timestamp": answer["timestamp"],
+        "input_text": input_text,
+        **answer,
+        "cached": True,
+    }
+
+
+def with_degraded(response_data: dict) -> dict:
+    # Lists the optional work that was skipped or shortened to meet the request's deadline; see deadline.py
+    return dict(response_data, degraded=degraded())
+
+
+def parse_batch_queries(body) -> list:
+    # Returns None unless the body holds a non-empty list of non-empty strings
+    queries = (body or {}).get("queries") if isinstance(body, dict) or body is None else None
+    if not isinstance(queries, list) or not queries:
+        return None
+    if not all(isinstance(query, str) and query.strip() for query in queries):
+        return None
+    return queries
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def format_documents(search_results: list) -> list:
+    return [{
+        "abstract": doc.get("abstract", "No abstract provided"),
+        "authors": [author.strip("{'name': '").strip("'}") for author in doc.get("authors", [])],
+        "categories": doc.get("categories", ["No categories provided"]),
+        "classification": doc.get("classification", "No classification provided"),
+        "concepts": doc.get("concepts", ["No concepts provided"]),
+        "downloadUrl": doc.get("downloadUrl", "No download URL provided"),
+        "emotion": doc.get("emotion", "No emotion provided"),
+        "id": doc.get("_id", "No ID provided"),
+        "sentiment": doc.get("sentiment", "No sentiment provided"),
+        "title": doc.get("title", "No title provided"),
+        "yearPublished": doc.get("yearPublished", "No year published provided")
+    } for doc in (search_results or [])]
@@ -0,0 +1,140 @@
+import os
+import logging
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Prompt budget configuration, in tokens
+PROMPT_INPUT_BUDGET = int(os.environ.get("PROMPT_INPUT_BUDGET", "6000"))
+PROMPT_MAX_ABSTRACT_TOKENS = int(os.environ.get("PROMPT_MAX_ABSTRACT_TOKENS", "400"))
+# Documents whose abstract would have to be cut shorter than this are left out instead
+PROMPT_MIN_ABSTRACT_TOKENS = int(os.environ.get("PROMPT_MIN_ABSTRACT_TOKENS", "64"))
+
+# Rough characters per token, used only when no tiktoken encoding can be loaded
+CHARS_PER_TOKEN = 4
+# Chat format overhead per message and for priming the reply
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+CONTEXT_HEADER = "User Query: {input_text}\n\nRetrieved Documents:\n"
+CONTEXT_FOOTER = "Based on the user's query and the retrieved documents, provide a helpful response.\n\nResponse:"
+NO_DOCUMENTS = "No relevant documents found.\n"
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: str):
+    try:
+        import tiktoken
+    except ImportError:
+        logger.warning("tiktoken is not installed, estimating token counts")
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        pass
+    except Exception as e:
+        logger.warning(f"Failed to load tiktoken encoding for {model}, estimating token counts: {str(e)}")
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning(f"Failed to load tiktoken encoding, estimating token counts: {str(e)}")
+        return None
+
+
+def get_encoding():
+    return _get_encoding(os.environ.get("OPENAI_MODEL_ID") or "gpt-4")
+
+
+def count_tokens(text: str) -> int:
+    encoding = get_encoding()
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+@lru_cache(maxsize=64)
+def count_static_tokens(text: str) -> int:
+    """Token count of a prompt that never changes, such as a system prompt."""
+    return count_tokens(text)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if max_tokens <= 0:
+        return ""
+    encoding = get_encoding()
+    if encoding is None:
+        limit = max_tokens * CHARS_PER_TOKEN
+        return text if len(text) <= limit else text[:limit].rstrip() + "..."
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens]).rstrip() + "..."
+
+
+def count_message_tokens(messages: list) -> int:
+    """
+    Count the prompt tokens of a list of chat messages.
+
+    System prompts are counted once per process.
+    """
+    total = TOKENS_PER_REPLY
+    for message in messages:
+        counter = count_static_tokens if message["role"] == "system" else count_tokens
+        total += TOKENS_PER_MESSAGE + counter(message["content"])
+    return total
+
+
+def format_document(number: int, doc: dict, abstract: str) -> str:
+    return "".join([
+        f"Document {number}:\n",
+        f"Title: {doc.get('title', 'N/A')}\n",
+        f"Authors: {', '.join(doc.get('authors', []))}\n",
+        f"Content: {abstract}\n",
+        f"Classification: {doc.get('classification', 'N/A')}\n",
+        f"Concepts: {', '.join(doc.get('concepts', []))}\n",
+        f"Emotion: {doc.get('emotion', 'N/A')}\n",
+        f"Year Published: {doc.get('yearPublished', 'N/A')}\n",
+        f"Download URL: {doc.get('downloadUrl', 'N/A')}\n",
+        f"Sentiment: {doc.get('sentiment', 'N/A')}\n",
+        f"Categories: {', '.join(doc.get('categories', []))}\n",
+        f"ID: {doc.get('_id', 'N/A')}\n\n",
+    ])
+
+
+def build_context(input_text: str, docs: list, budget: int, max_docs: int = 10):
+    """
+    Pack the highest scoring documents into a token budget.
+
+    Documents are taken in descending _score order. Each abstract is cut to
+    PROMPT_MAX_ABSTRACT_TOKENS, and further to whatever is left of the budget;
+    packing stops once less than PROMPT_MIN_ABSTRACT_TOKENS would remain.
+
+    Parameters:
+    input_text (str): The user's query.
+    docs (list): Filtered Elasticsearch hits.
+    budget (int): Tokens available for the whole context.
+    max_docs (int): The most documents to include.
+
+    Returns:
+    tuple: The context text and the number of documents included.
+    """
+    parts = [CONTEXT_HEADER.format(input_text=input_text)]
+    remaining = budget - count_tokens(parts[0]) - count_static_tokens(CONTEXT_FOOTER)
+
+    ranked = sorted(docs or [], key=lambda doc: doc.get("_score") or 0, reverse=True)
+    included = 0
+    for doc in ranked[:max_docs]:
+        fixed = count_tokens(format_document(included + 1, doc, ""))
+        abstract_budget = min(PROMPT_MAX_ABSTRACT_TOKENS, remaining - fixed)
+        if abstract_budget < PROMPT_MIN_ABSTRACT_TOKENS:
+            break
+        block = format_document(included + 1, doc, truncate_to_tokens(doc.get("abstract", "N/A"), abstract_budget))
+        remaining -= count_tokens(block)
+        parts.append(block)
+        included += 1
+
+    if included == 0:
+        parts.append(NO_DOCUMENTS)
+    parts.append(CONTEXT_FOOTER)
+    return "".join(parts), included
@@ -1,92 +1,202 @@
 import os
+import math
+import logging
+import threading
 import cohere
 from cohere import ClassifyExample
+from cachetools import LRUCache
+from local_classifier import LocalQueryClassifier, normalize_query
+from lazy_client import LazyClient
+from resilience import COHERE_TIMEOUT, call, call_async
+from deadline import budget_timeout
 
-# Initialize Cohere client
-co = cohere.Client(api_key=os.getenv('COHERE_API_KEY'))
+logger = logging.getLogger(__name__)
+
+# Cohere client, built on first use in each process; see lazy_client.py
+co = LazyClient("cohere", lambda: cohere.Client(api_key=os.getenv('COHERE_API_KEY'), timeout=COHERE_TIMEOUT))
+
+# Local predictions below this probability are sent to Cohere instead
+QUERY_CLASSIFIER_CONFIDENCE = float(os.environ.get("QUERY_CLASSIFIER_CONFIDENCE", "0.85"))
+# Labels the local classifier may decide on its own. Its confidence is not calibrated
+# outside the few examples below: research questions asked conversationally ("what do
+# you know about lesbian literature") come out as "conversation" with 0.9+ confidence.
+# A wrong "conversation" skips retrieval, while a wrong "search" only costs a search, so
+# by default only "search" is trusted and every local "conversation" is checked by Cohere.
+QUERY_CLASSIFIER_LOCAL_LABELS = set(os.environ.get("QUERY_CLASSIFIER_LOCAL_LABELS", "search").split(","))
+QUERY_CLASSIFIER_CACHE_SIZE = int(os.environ.get("QUERY_CLASSIFIER_CACHE_SIZE", "10000"))
+
+# Define examples for classification
+CLASSIFY_EXAMPLES = [
+    ClassifyExample(text="What are some important LGBTQIA+ historical events?", label="search"),
+    ClassifyExample(text="Are there any research papers on the experiences of transgender individuals in the workplace?", label="search"),
+    ClassifyExample(text="Can you recommend some LGBTQIA+ inclusive children's books?", label="search"),
+    ClassifyExample(text="What are the key provisions of the Equality Act?", label="search"),
+    ClassifyExample(text="How has the media representation of LGBTQIA+ characters evolved over time?", label="search"),
+    ClassifyExample(text="What are some notable LGBTQIA+ organizations and their missions?", label="search"),
+    ClassifyExample(text="Can you provide statistics on LGBTQIA+ mental health disparities?", label="search"),
+    ClassifyExample(text="What are the legal rights and protections for LGBTQIA+ individuals in the workplace?", label="search"),
+    ClassifyExample(text="Can you explain the difference between sexual orientation and gender identity?", label="search"),
+    ClassifyExample(text="Tell me more about the impact of LGBTQIA+ advocacy on recent legislation.", label="search"),
+    ClassifyExample(text="Discuss the role of LGBTQIA+ activists in the civil rights movement.", label="search"),
+    ClassifyExample(text="Can you list some influential LGBTQIA+ figures in technology?", label="search"),
+    ClassifyExample(text="What advancements have been made in LGBTQIA+ rights over the last decade?", label="search"),
+    ClassifyExample(text="Explain the significance of Pride Month and its global impact.", label="search"),
+    ClassifyExample(text="What are the challenges faced by LGBTQIA+ youth in educational institutions?", label="search"),
+    ClassifyExample(text="How do different cultures view and treat LGBTQIA+ individuals?", label="search"),
+    ClassifyExample(text="Can you detail the evolution of LGBTQIA+ representation in media?", label="search"),
+    ClassifyExample(text="What are the current debates surrounding transgender athletes in sports?", label="search"),
+    ClassifyExample(text="Describe the influence of LGBTQIA+ communities on popular culture.", label="search"),
+    ClassifyExample(text="What are the psychological effects of discrimination on LGBTQIA+ individuals?", label="search"),
+    ClassifyExample(text="How do LGBTQIA+ rights vary by country?", label="search"),
+    ClassifyExample(text="What support systems are available for LGBTQIA+ people facing homelessness?", label="search"),
+    ClassifyExample(text="Discuss the intersectionality of race and LGBTQIA+ identity.", label="search"),
+    ClassifyExample(text="What legal protections do LGBTQIA+ individuals have against workplace discrimination?", label="search"),
+    ClassifyExample(text="How have LGBTQIA+ communities been involved in political movements?", label="search"),
+    ClassifyExample(text="What are some misconceptions about the LGBTQIA+ community and how can they be addressed?", label="search"),
+    ClassifyExample(text="Can you provide an overview of gender-neutral pronouns and their usage?", label="search"),
+    ClassifyExample(text="What initiatives exist to support LGBTQIA+ mental health?", label="search"),
+    ClassifyExample(text="Tell me about the historical significance of the Stonewall Riots.", label="search"),
+    ClassifyExample(text="What's the weather like today?", label="conversation"),
+    ClassifyExample(text="I'm looking for a good Italian restaurant nearby. Any suggestions?", label="conversation"),
+    ClassifyExample(text="In the research paper you mentioned earlier about transgender experiences, what were the key findings?", label="conversation"),
+    ClassifyExample(text="Can you tell me more about the LGBTQIA+ inclusive children's book you recommended in our previous discussion?", label="conversation"),
+    ClassifyExample(text="What's your favorite color?", label="conversation"),
+    ClassifyExample(text="Do you think it will rain tomorrow?", label="conversation"),
+    ClassifyExample(text="Can you tell me a joke?", label="conversation"),
+    ClassifyExample(text="What's the latest movie you've seen?", label="conversation"),
+    ClassifyExample(text="How was your day?", label="conversation"),
+    ClassifyExample(text="What do you think about the new tech gadgets?", label="conversation"),
+    ClassifyExample(text="Can you recommend a good restaurant nearby?", label="conversation"),
+    ClassifyExample(text="What music do you like?", label="conversation"),
+    ClassifyExample(text="Have you read any good books lately?", label="conversation"),
+    ClassifyExample(text="What are your hobbies?", label="conversation"),
+    ClassifyExample(text="What sports do you play?", label="conversation"),
+    ClassifyExample(text="Can you help me with my homework?", label="conversation"),
+    ClassifyExample(text="What are some fun weekend activities?", label="conversation"),
+    ClassifyExample(text="How do I fix a flat tire?", label="conversation"),
+    ClassifyExample(text="What are the best vacation spots?", label="conversation"),
+    ClassifyExample(text="Can you explain how to bake a cake?", label="conversation"),
+    ClassifyExample(text="What are your thoughts on current events?", label="conversation"),
+    ClassifyExample(text="Tell me more about your creators.", label="conversation"),
+    ClassifyExample(text="What's the best way to relax after a long day?", label="conversation"),
+    ClassifyExample(text="Do you have any tips for learning a new language?", label="conversation"),
+    ClassifyExample(text="What are the latest trends in fashion?", label="conversation"),
+    ClassifyExample(text="Can you help me plan a party?", label="conversation"),
+    ClassifyExample(text="What are some effective exercise routines?", label="conversation"),
+    ClassifyExample(text="How do I make a budget?", label="conversation"),
+    ClassifyExample(text="What are some tips for a job interview?", label="conversation"),
+    ClassifyExample(text="Can you tell me about different coffee brewing methods?", label="conversation"),
+    ClassifyExample(text="What are the best apps for productivity?", label="conversation"),
+    ClassifyExample(text="How do you meditate?", label="conversation"),
+    ClassifyExample(text="What are some tips for taking good photos?", label="conversation"),
+    ClassifyExample(text="Can you suggest some podcasts about science?", label="conversation"),
+    ClassifyExample(text="What are the best strategies for online learning?", label="conversation"),
+    ClassifyExample(text="How can I improve my cooking skills?", label="conversation"),
+    ClassifyExample(text="What are some ways to save money?", label="conversation"),
+    ClassifyExample(text="Can you explain the rules of chess?", label="conversation"),
+    ClassifyExample(text="What are some DIY home improvement tips?", label="conversation"),
+    ClassifyExample(text="How do I start gardening?", label="conversation"),
+    ClassifyExample(text="What are the best dog breeds for apartment living?", label="conversation"),
+    ClassifyExample(text="Can you guide me on how to write a resume?", label="conversation")
+]
+
+# Train the local classifier once per process from the same examples
+_local_classifier = LocalQueryClassifier.train(
+    [example.text for example in CLASSIFY_EXAMPLES],
+    [example.label for example in CLASSIFY_EXAMPLES],
+)
+
+_classification_cache = LRUCache(maxsize=QUERY_CLASSIFIER_CACHE_SIZE)
+_cache_lock = threading.Lock()
+
+def _request_options():
+    # Cohere takes whole seconds; the call may not outlast the request's deadline
+    return {"timeout_in_seconds": math.ceil(budget_timeout(COHERE_TIMEOUT))}
+
+def classify_with_cohere(queries):
+    # Classify the input queries
+    response = call("cohere", "classify", "classify_query", lambda: co.classify(
+        inputs=queries,
+        examples=CLASSIFY_EXAMPLES,
+        request_options=_request_options()
+    ))
+
+    # Extract the classification labels
+    return [classification.prediction.lower() for classification in response.classifications]
 
 def classify_query(query):
-    # Define examples for classification
-    examples = [
-        ClassifyExample(text="What are some important LGBTQIA+ historical events?", label="search"),
-        ClassifyExample(text="Are there any research papers on the experiences of transgender individuals in the workplace?", label="search"),
-        ClassifyExample(text="Can you recommend some LGBTQIA+ inclusive children's books?", label="search"),
-        ClassifyExample(text="What are the key provisions of the Equality Act?", label="search"),
-        ClassifyExample(text="How has the media representation of LGBTQIA+ characters evolved over time?", label="search"),
-        ClassifyExample(text="What are some notable LGBTQIA+ organizations and their missions?", label="search"),
-        ClassifyExample(text="Can you provide statistics on LGBTQIA+ mental health disparities?", label="search"),
-        ClassifyExample(text="What are the legal rights and protections for LGBTQIA+ individuals in the workplace?", label="search"),
-        ClassifyExample(text="Can you explain the difference between sexual orientation and gender identity?", label="search"),
-        ClassifyExample(text="Tell me more about the impact of LGBTQIA+ advocacy on recent legislation.", label="search"),
-        ClassifyExample(text="Discuss the role of LGBTQIA+ activists in the civil rights movement.", label="search"),
-        ClassifyExample(text="Can you list some influential LGBTQIA+ figures in technology?", label="search"),
-        ClassifyExample(text="What advancements have been made in LGBTQIA+ rights over the last decade?", label="search"),
-        ClassifyExample(text="Explain the significance of Pride Month and its global impact.", label="search"),
-        ClassifyExample(text="What are the challenges faced by LGBTQIA+ youth in educational institutions?", label="search"),
-        ClassifyExample(text="How do different cultures view and treat LGBTQIA+ individuals?", label="search"),
-        ClassifyExample(text="Can you detail the evolution of LGBTQIA+ representation in media?", label="search"),
-        ClassifyExample(text="What are the current debates surrounding transgender athletes in sports?", label="search"),
-        ClassifyExample(text="Describe the influence of LGBTQIA+ communities on popular culture.", label="search"),
-        ClassifyExample(text="What are the psychological effects of discrimination on LGBTQIA+ individuals?", label="search"),
-        ClassifyExample(text="How do LGBTQIA+ rights vary by country?", label="search"),
-        ClassifyExample(text="What support systems are available for LGBTQIA+ people facing homelessness?", label="search"),
-        ClassifyExample(text="Discuss the intersectionality of race and LGBTQIA+ identity.", label="search"),
-        ClassifyExample(text="What legal protections do LGBTQIA+ individuals have against workplace discrimination?", label="search"),
-        ClassifyExample(text="How have LGBTQIA+ communities been involved in political movements?", label="search"),
-        ClassifyExample(text="What are some misconceptions about the LGBTQIA+ community and how can they be addressed?", label="search"),
-        ClassifyExample(text="Can you provide an overview of gender-neutral pronouns and their usage?", label="search"),
-        ClassifyExample(text="What initiatives exist to support LGBTQIA+ mental health?", label="search"),
-        ClassifyExample(text="Tell me about the historical significance of the Stonewall Riots.", label="search"),
-        ClassifyExample(text="What's the weather like today?", label="conversation"),
-        ClassifyExample(text="I'm looking for a good Italian restaurant nearby. Any suggestions?", label="conversation"),
-        ClassifyExample(text="In the research paper you mentioned earlier about transgender experiences, what were the key findings?", label="conversation"),
-        ClassifyExample(text="Can you tell me more about the LGBTQIA+ inclusive children's book you recommended in our previous discussion?", label="conversation"),
-        ClassifyExample(text="What's your favorite color?", label="conversation"),
-        ClassifyExample(text="Do you think it will rain tomorrow?", label="conversation"),
-        ClassifyExample(text="Can you tell me a joke?", label="conversation"),
-        ClassifyExample(text="What's the latest movie you've seen?", label="conversation"),
-        ClassifyExample(text="How was your day?", label="conversation"),
-        ClassifyExample(text="What do you think about the new tech gadgets?", label="conversation"),
-        ClassifyExample(text="Can you recommend a good restaurant nearby?", label="conversation"),
-        ClassifyExample(text="What music do you like?", label="conversation"),
-        ClassifyExample(text="Have you read any good books lately?", label="conversation"),
-        ClassifyExample(text="What are your hobbies?", label="conversation"),
-        ClassifyExample(text="What sports do you play?", label="conversation"),
-        ClassifyExample(text="Can you help me with my homework?", label="conversation"),
-        ClassifyExample(text="What are some fun weekend activities?", label="conversation"),
-        ClassifyExample(text="How do I fix a flat tire?", label="conversation"),
-        ClassifyExample(text="What are the best vacation spots?", label="conversation"),
-        ClassifyExample(text="Can you explain how to bake a cake?", label="conversation"),
-        ClassifyExample(text="What are your thoughts on current events?", label="conversation"),
-        ClassifyExample(text="Tell me more about your creators.", label="conversation"),
-        ClassifyExample(text="What's the best way to relax after a long day?", label="conversation"),
-        ClassifyExample(text="Do you have any tips for learning a new language?", label="conversation"),
-        ClassifyExample(text="What are the latest trends in fashion?", label="conversation"),
-        ClassifyExample(text="Can you help me plan a party?", label="conversation"),
-        ClassifyExample(text="What are some effective exercise routines?", label="conversation"),
-        ClassifyExample(text="How do I make a budget?", label="conversation"),
-        ClassifyExample(text="What are some tips for a job interview?", label="conversation"),
-        ClassifyExample(text="Can you tell me about different coffee brewing methods?", label="conversation"),
-        ClassifyExample(text="What are the best apps for productivity?", label="conversation"),
-        ClassifyExample(text="How do you meditate?", label="conversation"),
-        ClassifyExample(text="What are some tips for taking good photos?", label="conversation"),
-        ClassifyExample(text="Can you suggest some podcasts about science?", label="conversation"),
-        ClassifyExample(text="What are the best strategies for online learning?", label="conversation"),
-        ClassifyExample(text="How can I improve my cooking skills?", label="conversation"),
-        ClassifyExample(text="What are some ways to save money?", label="conversation"),
-        ClassifyExample(text="Can you explain the rules of chess?", label="conversation"),
-        ClassifyExample(text="What are some DIY home improvement tips?", label="conversation"),
-        ClassifyExample(text="How do I start gardening?", label="conversation"),
-        ClassifyExample(text="What are the best dog breeds for apartment living?", label="conversation"),
-        ClassifyExample(text="Can you guide me on how to write a resume?", label="conversation")
-    ]
-
-    # Classify the input query
-    response = co.classify(
-        inputs=[query],
-        examples=examples
-    )
-
-    # Extract the classification label
-    classification = response.classifications[0].prediction
-    return classification.lower()
+    """
+    Classify a query as "search" or "conversation".
+
+    The local classifier answers when it predicts a label in
+    QUERY_CLASSIFIER_LOCAL_LABELS with at least QUERY_CLASSIFIER_CONFIDENCE;
+    otherwise Cohere is asked. Results are cached by normalized query.
+    """
+    return classify_queries([query])[0]
+
+def classify_queries(queries):
+    """
+    Classify several queries, sending every low-confidence one to Cohere in a single call.
+
+    Returns:
+    list: The labels in the order of the queries.
+    """
+    labels, uncertain = _classify_locally(queries)
+    if uncertain:
+        for i, label in zip(uncertain, classify_with_cohere([queries[i] for i in uncertain])):
+            labels[i] = label
+    _remember_labels(queries, labels)
+    return labels
+
+async def classify_queries_async(cohere_client, queries):
+    """classify_queries with an async Cohere client."""
+    labels, uncertain = _classify_locally(queries)
+    if uncertain:
+        response = await call_async("cohere", "classify", "classify_query", lambda: cohere_client.classify(
+            inputs=[queries[i] for i in uncertain],
+            examples=CLASSIFY_EXAMPLES,
+            request_options=_request_options()
+        ))
+        for i, classification in zip(uncertain, response.classifications):
+            labels[i] = classification.prediction.lower()
+    _remember_labels(queries, labels)
+    return labels
+
+def _classify_locally(queries):
+    """
+    Returns:
+    tuple: The cached or confident local labels (None where unknown), and the
+    indexes of the queries that need Cohere.
+    """
+    labels = [None] * len(queries)
+    uncertain = []
+    for i, query in enumerate(queries):
+        normalized = normalize_query(query)
+        with _cache_lock:
+            labels[i] = _classification_cache.get(normalized)
+        if labels[i] is not None:
+            continue
+        label, confidence = _local_classifier.predict(normalized)
+        if label not in QUERY_CLASSIFIER_LOCAL_LABELS or confidence < QUERY_CLASSIFIER_CONFIDENCE:
+            logger.debug("Local classifier predicted %s with confidence %.2f, asking Cohere", label, confidence)
+            uncertain.append(i)
+        else:
+            labels[i] = label
+    return labels, uncertain
+
+def guess_query_types(queries):
+    """
+    Returns:
+    list: The cached or confidently predicted label of each query, or None where
+    only Cohere could tell; never calls Cohere.
+    """
+    return _classify_locally(queries)[0]
+
+def _remember_labels(queries, labels):
+    with _cache_lock:
+        for query, label in zip(queries, labels):
+            _classification_cache[normalize_query(query)] = label
+
+async def classify_query_async(cohere_client, query):
+    """classify_query with an async Cohere client."""
+    return (await classify_queries_async(cohere_client, [query]))[0]
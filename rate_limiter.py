@@ -0,0 +1,125 @@
+import os
+import json
+import hashlib
+import logging
+from collections import namedtuple
+from redis_utils import register_script
+
+logger = logging.getLogger(__name__)
+
+# Rate limiting configuration
+RATE_LIMIT_QUERIES = int(os.environ.get("RATE_LIMIT_QUERIES", "500"))
+RATE_LIMIT_PERIOD = int(os.environ.get("RATE_LIMIT_PERIOD", "3600"))
+DEFAULT_TIER = "default"
+
+# Per-tier limits, e.g. RATE_LIMIT_TIERS='{"partner": {"limit": 5000, "period": 3600}}'
+RATE_LIMIT_TIERS = {DEFAULT_TIER: {"limit": RATE_LIMIT_QUERIES, "period": RATE_LIMIT_PERIOD}}
+RATE_LIMIT_TIERS.update(json.loads(os.environ.get("RATE_LIMIT_TIERS", "{}")))
+
+RateLimitResult = namedtuple("RateLimitResult", ["allowed", "limit", "remaining", "retry_after", "reset_after"])
+
+# Generic cell rate algorithm (GCRA). The only state per key is its theoretical
+# arrival time, which expires once the key has been idle for a full period.
+_GCRA_LUA = """
+local emission_interval = tonumber(ARGV[1])
+local limit = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local delay_tolerance = emission_interval * limit
+
+if redis.replicate_commands then redis.replicate_commands() end
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+local tat = tonumber(redis.call('GET', KEYS[1]))
+if tat == nil or tat < now then
+    tat = now
+end
+
+local new_tat = tat + emission_interval * cost
+local diff = now - (new_tat - delay_tolerance)
+if diff < 0 then
+    local remaining = math.max(math.floor((delay_tolerance - (tat - now)) / emission_interval), 0)
+    return {0, remaining, math.ceil(-diff), math.ceil(tat - now)}
+end
+
+redis.call('SET', KEYS[1], new_tat, 'PX', math.ceil(new_tat - now))
+local remaining = math.floor((delay_tolerance - (new_tat - now)) / emission_interval)
+return {1, remaining, 0, math.ceil(new_tat - now)}
+"""
+_GCRA_SCRIPT = register_script(_GCRA_LUA)
+_async_scripts = {}
+
+
+def _tier_limits(tier: str) -> dict:
+    return RATE_LIMIT_TIERS.get(tier) or RATE_LIMIT_TIERS[DEFAULT_TIER]
+
+
+def _prepare(api_key: str, tier: str):
+    limits = _tier_limits(tier)
+    limit, period = int(limits["limit"]), int(limits["period"])
+    key = f"rate_limit:{hashlib.sha256(api_key.encode('utf-8')).hexdigest()}"
+    return key, limit, period * 1000 / limit
+
+
+def _to_result(limit: int, allowed, remaining, retry_after, reset_after) -> RateLimitResult:
+    return RateLimitResult(
+        allowed=bool(allowed),
+        limit=limit,
+        remaining=int(remaining),
+        retry_after=-(-int(retry_after) // 1000),
+        reset_after=-(-int(reset_after) // 1000),
+    )
+
+
+def check_rate_limit(api_key: str, tier: str = DEFAULT_TIER, cost: int = 1) -> RateLimitResult:
+    """
+    Count a request against an API key's limit across all workers.
+
+    Parameters:
+    api_key (str): The API key making the request.
+    tier (str): The key's tier in RATE_LIMIT_TIERS.
+    cost (int): The number of queries the request counts as.
+
+    Returns:
+    RateLimitResult: Whether the request is allowed, plus the values for the
+    X-RateLimit-* and Retry-After headers. Times are in seconds.
+    """
+    key, limit, emission_interval = _prepare(api_key, tier)
+    try:
+        return _to_result(limit, *_GCRA_SCRIPT(keys=[key], args=[emission_interval, limit, cost]))
+    except Exception as e:
+        # Fail open; an unavailable Redis should not take the API down with it
+        logger.warning(f"Rate limiter unavailable, allowing request: {str(e)}")
+        return RateLimitResult(True, limit, limit, 0, 0)
+
+
+async def check_rate_limit_async(redis, api_key: str, tier: str = DEFAULT_TIER, cost: int = 1) -> RateLimitResult:
+    """check_rate_limit on an asyncio Redis client."""
+    key, limit, emission_interval = _prepare(api_key, tier)
+    script = _async_scripts.get(id(redis))
+    if script is None:
+        script = _async_scripts[id(redis)] = redis.register_script(_GCRA_LUA)
+    try:
+        return _to_result(limit, *await script(keys=[key], args=[emission_interval, limit, cost]))
+    except Exception as e:
+        logger.warning(f"Rate limiter unavailable, allowing request: {str(e)}")
+        return RateLimitResult(True, limit, limit, 0, 0)
+
+
+def max_cost(tier: str = DEFAULT_TIER) -> int:
+    """
+    Returns:
+    int: The most queries one request may count as; a costlier one could never be allowed.
+    """
+    return int(_tier_limits(tier)["limit"])
+
+
+def rate_limit_headers(result: RateLimitResult) -> dict:
+    headers = {
+        "X-RateLimit-Limit": str(result.limit),
+        "X-RateLimit-Remaining": str(result.remaining),
+        "X-RateLimit-Reset": str(result.reset_after),
+    }
+    if not result.allowed:
+        headers["Retry-After"] = str(result.retry_after)
+    return headers
@@ -0,0 +1,51 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from stage_runner import Stage, submit_stage
+from redis_utils import redis_client
+from elasticsearch_utils import es_client
+from retrievers import BAYARD_RETRIEVER, LOCAL_INDEX_PATH, LocalRetriever
+from db import get_cursor
+
+# Seconds each dependency has to answer a readiness probe
+READY_CHECK_TIMEOUT = float(os.environ.get("READY_CHECK_TIMEOUT", "2"))
+
+# Probes get their own threads so a busy stage pool cannot make a healthy worker look unready
+_probe_executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix="bayard-ready")
+
+
+def check_redis() -> bool:
+    return bool(redis_client.ping())
+
+
+def check_elasticsearch() -> bool:
+    return bool(es_client.options(request_timeout=READY_CHECK_TIMEOUT).ping())
+
+
+def check_local_index() -> bool:
+    return LocalRetriever(LOCAL_INDEX_PATH).available()
+
+
+def check_database() -> bool:
+    with get_cursor() as cur:
+        cur.execute("SELECT 1")
+        return cur.fetchone() is not None
+
+
+def check_readiness() -> dict:
+    """
+    Probe the dependencies a request needs, concurrently on the probe threads and each within READY_CHECK_TIMEOUT.
+
+    Returns:
+    dict: Dependency name to whether it answered.
+    """
+    # Only the retriever the API searches with is needed
+    if BAYARD_RETRIEVER == "local":
+        search_check = Stage("local_index", check_local_index, timeout=READY_CHECK_TIMEOUT, default=False)
+    else:
+        search_check = Stage("elasticsearch", check_elasticsearch, timeout=READY_CHECK_TIMEOUT, default=False)
+    pending = [submit_stage(stage, _probe_executor) for stage in [
+        Stage("redis", check_redis, timeout=READY_CHECK_TIMEOUT, default=False),
+        search_check,
+        Stage("database", check_database, timeout=READY_CHECK_TIMEOUT, default=False),
+    ]]
+    return {handle.stage.name: handle.result() for handle in pending}
@@ -0,0 +1,15 @@
+import os
+import redis
+from redis.commands.core import Script
+from lazy_client import LazyClient
+
+REDIS_URL = os.environ.get("REDIS_URL")
+
+# Built on first use in each process; see lazy_client.py
+redis_client = LazyClient("redis", lambda: redis.from_url(REDIS_URL))
+
+
+def register_script(source: str) -> Script:
+    # Equivalent to redis_client.register_script, but passing the script as bytes
+    # means the client is not needed (and built) until the script first runs
+    return Script(redis_client, source.encode("utf-8"))
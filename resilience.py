@@ -0,0 +1,346 @@
+"""
+Retries, circuit breakers and hedged requests for calls to Elasticsearch, OpenAI and Cohere.
+
+Each upstream has a circuit breaker per process. After BREAKER_FAILURE_THRESHOLD
+consecutive transient failures (timeouts, connection errors, 429 and 5xx
+responses) it opens and calls fail fast with CircuitOpenError for
+BREAKER_RESET_TIMEOUT seconds; then a single trial call is let through and
+closes it again if it succeeds. Client errors such as a 400 do not count.
+
+call() retries idempotent calls that failed transiently with full-jitter
+exponential backoff, unless the request's deadline would pass before the
+retry is sent. hedged_call() also sends a second copy of a call that is
+slower than the recent p95 latency of its stage and returns whichever answers
+first. The clients themselves are built with the per-upstream timeouts below
+and without their own retries.
+"""
+import os
+import time
+import random
+import asyncio
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import httpx
+import openai
+import elastic_transport
+import numpy as np
+from metrics import (upstream_call, BREAKER_STATE, BREAKER_REJECTIONS, UPSTREAM_RETRIES, HEDGED_REQUESTS)
+from deadline import retry_fits, budget_timeout
+from admission import ADMISSION_MAX_IN_FLIGHT
+from pipeline import BATCH_CONCURRENCY
+
+# Seconds a single request to each upstream may take
+ES_TIMEOUT = float(os.environ.get("ES_TIMEOUT", "5"))
+OPENAI_TIMEOUT = float(os.environ.get("OPENAI_TIMEOUT", "60"))
+COHERE_TIMEOUT = float(os.environ.get("COHERE_TIMEOUT", "15"))
+
+UPSTREAM_RETRIES_MAX = int(os.environ.get("UPSTREAM_RETRIES", "2"))
+UPSTREAM_RETRY_BASE_DELAY = float(os.environ.get("UPSTREAM_RETRY_BASE_DELAY", "0.2"))
+UPSTREAM_RETRY_MAX_DELAY = float(os.environ.get("UPSTREAM_RETRY_MAX_DELAY", "2"))
+
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.environ.get("BREAKER_RESET_TIMEOUT", "30"))
+
+HEDGING_ENABLED = os.environ.get("HEDGING_ENABLED", "true").lower() in ("1", "true", "yes")
+# The hedge is sent once a call has taken longer than this percentile of the stage's recent latencies
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_DELAY = float(os.environ.get("HEDGE_MIN_DELAY", "0.05"))
+# Latencies kept per stage, and how many are needed before hedging starts
+HEDGE_WINDOW = int(os.environ.get("HEDGE_WINDOW", "200"))
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", "20"))
+# Only Elasticsearch searches are hedged: one per admitted request, plus the queries of a batch answered
+# side by side, and each needs a thread for itself and one for its hedge
+HEDGE_POOL_SIZE = int(os.environ.get("HEDGE_POOL_SIZE", str(2 * (ADMISSION_MAX_IN_FLIGHT + BATCH_CONCURRENCY))))
+# Longest a hedged call waits for either copy to answer, capped at the request's remaining budget
+HEDGE_MAX_WAIT = float(os.environ.get("HEDGE_MAX_WAIT", str(ES_TIMEOUT)))
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+# Exported as the value of bayard_circuit_breaker_state
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker for one upstream.
+
+    Parameters:
+    name (str): The upstream, used in metrics.
+    failure_threshold (int): Consecutive failures that open the circuit.
+    reset_timeout (float): Seconds the circuit stays open before a trial call.
+    """
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        BREAKER_STATE.labels(name).set(STATE_VALUES[CLOSED])
+
+    def _set_state(self, state):
+        self.state = state
+        BREAKER_STATE.labels(self.name).set(STATE_VALUES[state])
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go ahead."""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._set_state(HALF_OPEN)
+            if self.state == CLOSED:
+                return
+            if self.state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+        BREAKER_REJECTIONS.labels(self.name).inc()
+        raise CircuitOpenError(f"Circuit breaker for {self.name} is open")
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._trial_in_flight = False
+            if self.state != CLOSED:
+                self._set_state(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+    def release(self):
+        # The call ended without an answer either way, e.g. it was cancelled
+        with self._lock:
+            self._trial_in_flight = False
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(upstream: str) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(upstream)
+        if breaker is None:
+            breaker = _breakers[upstream] = CircuitBreaker(upstream)
+        return breaker
+
+
+def breaker_states() -> dict:
+    with _breakers_lock:
+        return {name: breaker.state for name, breaker in _breakers.items()}
+
+
+def is_transient(error: Exception) -> bool:
+    """Whether an error is worth retrying and counts against the upstream's breaker."""
+    status = getattr(error, "status_code", None)
+    if isinstance(status, int):
+        return status in (408, 429) or status >= 500
+    return isinstance(error, (TimeoutError, ConnectionError, asyncio.TimeoutError, httpx.TransportError,
+                              openai.APIConnectionError, elastic_transport.TransportError))
+
+
+def retry_delay(attempts: int) -> float:
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(UPSTREAM_RETRY_MAX_DELAY, UPSTREAM_RETRY_BASE_DELAY * (2 ** attempts)))
+
+
+@contextmanager
+def guarded(upstream: str, model: str, stage: str):
+    """
+    Check the upstream's breaker, then count the enclosed call and report its outcome to the breaker.
+
+    Raises:
+    CircuitOpenError: If the breaker is open.
+    """
+    breaker = get_breaker(upstream)
+    breaker.before_call()
+    try:
+        with upstream_call(upstream, model, stage):
+            yield
+    except Exception as e:
+        if is_transient(e):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        raise
+    except BaseException:
+        breaker.release()
+        raise
+    else:
+        breaker.record_success()
+
+
+def call(upstream: str, model: str, stage: str, func, retries: int = None):
+    """
+    Call an idempotent upstream function through its breaker, retrying transient failures.
+
+    Parameters:
+    upstream (str): "elasticsearch", "openai" or "cohere".
+    model (str): The model or index called, for metrics.
+    stage (str): The pipeline stage making the call.
+    func (callable): Makes the call; takes no arguments.
+    retries (int): Retries after the first attempt. Defaults to UPSTREAM_RETRIES.
+
+    Returns:
+    The result of func.
+    """
+    retries = UPSTREAM_RETRIES_MAX if retries is None else retries
+    for attempt in range(retries + 1):
+        try:
+            with guarded(upstream, model, stage):
+                return func()
+        except Exception as e:
+            delay = retry_delay(attempt)
+            if attempt == retries or not is_transient(e) or not retry_fits(delay):
+                raise
+            UPSTREAM_RETRIES.labels(upstream, stage).inc()
+            time.sleep(delay)
+
+
+async def call_async(upstream: str, model: str, stage: str, func, retries: int = None):
+    """call for a function returning a coroutine."""
+    retries = UPSTREAM_RETRIES_MAX if retries is None else retries
+    for attempt in range(retries + 1):
+        try:
+            with guarded(upstream, model, stage):
+                return await func()
+        except Exception as e:
+            delay = retry_delay(attempt)
+            if attempt == retries or not is_transient(e) or not retry_fits(delay):
+                raise
+            UPSTREAM_RETRIES.labels(upstream, stage).inc()
+            await asyncio.sleep(delay)
+
+
+class LatencyTracker:
+    """Recent successful call latencies of one stage."""
+
+    def __init__(self, window=HEDGE_WINDOW):
+        self.latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.latencies.append(seconds)
+
+    def hedge_delay(self):
+        """
+        Returns:
+        float: Seconds to wait before hedging, or None until enough latencies are known.
+        """
+        with self._lock:
+            if len(self.latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            latencies = list(self.latencies)
+        return max(float(np.percentile(latencies, HEDGE_PERCENTILE)), HEDGE_MIN_DELAY)
+
+
+_trackers = {}
+_hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_POOL_SIZE, thread_name_prefix="bayard-hedge")
+
+
+def get_tracker(upstream: str, stage: str) -> LatencyTracker:
+    with _breakers_lock:
+        return _trackers.setdefault((upstream, stage), LatencyTracker())
+
+
+def _timed(tracker, func):
+    start = time.perf_counter()
+    result = func()
+    tracker.record(time.perf_counter() - start)
+    return result
+
+
+def hedged_call(upstream: str, model: str, stage: str, func, retries: int = None):
+    """
+    call, sending a second copy of func when the first is slower than the stage's recent p95.
+
+    Both copies run on the hedge pool; the first successful answer is
+    returned and the slower copy is left to finish in the background.
+
+    Raises:
+    TimeoutError: If neither copy answers within HEDGE_MAX_WAIT or the request's remaining budget.
+    """
+    tracker = get_tracker(upstream, stage)
+    delay = tracker.hedge_delay() if HEDGING_ENABLED else None
+    attempt = lambda: call(upstream, model, stage, lambda: _timed(tracker, func), retries)
+    if delay is None:
+        return attempt()
+
+    # Copy the context so the request's stage timings and token usage are visible in the pool
+    give_up_at = time.monotonic() + budget_timeout(HEDGE_MAX_WAIT)
+    primary = _hedge_executor.submit(contextvars.copy_context().run, attempt)
+    done, _ = wait({primary}, timeout=delay)
+    if done:
+        return primary.result()
+    HEDGED_REQUESTS.labels(upstream, stage, "sent").inc()
+    hedge = _hedge_executor.submit(contextvars.copy_context().run, attempt)
+    pending = {primary, hedge}
+    error = None
+    while pending:
+        done, pending = wait(pending, timeout=max(give_up_at - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+        if not done:
+            raise TimeoutError(f"Hedged {upstream} call for {stage} did not answer in time")
+        for future in done:
+            if future.exception() is None:
+                if future is hedge:
+                    HEDGED_REQUESTS.labels(upstream, stage, "won").inc()
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+async def hedged_call_async(upstream: str, model: str, stage: str, func, retries: int = None):
+    """hedged_call for a function returning a coroutine; the slower copy is cancelled."""
+    tracker = get_tracker(upstream, stage)
+    delay = tracker.hedge_delay() if HEDGING_ENABLED else None
+
+    async def attempt():
+        async def timed_call():
+            start = time.perf_counter()
+            result = await func()
+            tracker.record(time.perf_counter() - start)
+            return result
+        return await call_async(upstream, model, stage, timed_call, retries)
+
+    if delay is None:
+        return await attempt()
+
+    give_up_at = time.monotonic() + budget_timeout(HEDGE_MAX_WAIT)
+    primary = asyncio.ensure_future(attempt())
+    pending = {primary}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=delay)
+        if done:
+            return primary.result()
+        HEDGED_REQUESTS.labels(upstream, stage, "sent").inc()
+        hedge = asyncio.ensure_future(attempt())
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=max(give_up_at - time.monotonic(), 0),
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError(f"Hedged {upstream} call for {stage} did not answer in time")
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge:
+                        HEDGED_REQUESTS.labels(upstream, stage, "won").inc()
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
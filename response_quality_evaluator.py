@@ -1,5 +1,6 @@
 import cohere
 import os
+from resilience import COHERE_TIMEOUT, call
 
 
 def evaluate_response_quality(input_text: str, model_output: str) -> dict:
@@ -30,15 +31,15 @@ def evaluate_response_quality(input_text: str, model_output: str) -> dict:
     Model Output: {model_output}
     """
 
-    co = cohere.Client(os.getenv('COHERE_API_KEY'))
-    response = co.chat(
+    co = cohere.Client(os.getenv('COHERE_API_KEY'), timeout=COHERE_TIMEOUT)
+    response = call("cohere", "chat", "evaluate_response_quality", lambda: co.chat(
         chat_history=[
             {"role": "system", "message": system_message},
             {"role": "user", "message": f"Input Text: {input_text}\nModel Output: {model_output}"}
         ],
         message="Evaluate the response quality.",
         connectors=[{"id": "web-search"}],
-    )
+    ))
 
     evaluation_text = response.choices[0].message.content.strip()
 
@@ -0,0 +1,341 @@
+import os
+import json
+import asyncio
+import hashlib
+import logging
+import threading
+from concurrent.futures import Future
+from cachetools import TTLCache
+from redis_utils import redis_client
+from local_classifier import normalize_query
+
+logger = logging.getLogger(__name__)
+
+# Retrieval cache configuration
+RETRIEVAL_CACHE_SIZE = int(os.environ.get("RETRIEVAL_CACHE_SIZE", "2048"))
+RETRIEVAL_CACHE_TTL = int(os.environ.get("RETRIEVAL_CACHE_TTL", "300"))
+RETRIEVAL_REDIS_TTL = int(os.environ.get("RETRIEVAL_REDIS_TTL", "3600"))
+# How long a process trusts its copy of an index's version before rereading it from Redis
+INDEX_VERSION_TTL = int(os.environ.get("INDEX_VERSION_TTL", "30"))
+INFLIGHT_WAIT_TIMEOUT = float(os.environ.get("RETRIEVAL_INFLIGHT_TIMEOUT", "30"))
+
+_local_cache = TTLCache(maxsize=RETRIEVAL_CACHE_SIZE, ttl=RETRIEVAL_CACHE_TTL)
+_index_versions = TTLCache(maxsize=64, ttl=INDEX_VERSION_TTL)
+_inflight = {}
+# Searches in flight on the event loop, for the async app
+_async_inflight = {}
+_lock = threading.Lock()
+
+_stats = {
+    "local_hits": 0,
+    "redis_hits": 0,
+    "misses": 0,
+    "coalesced": 0,
+}
+
+
+def _count(stat: str):
+    with _lock:
+        _stats[stat] += 1
+
+
+def _version_key(index: str) -> str:
+    return f"retrieval_cache:version:{index}"
+
+
+def get_index_version(index: str) -> int:
+    with _lock:
+        version = _index_versions.get(index)
+    if version is not None:
+        return version
+    try:
+        version = int(redis_client.get(_version_key(index)) or 0)
+    except Exception as e:
+        logger.warning(f"Failed to read index version from Redis: {str(e)}")
+        version = 0
+    with _lock:
+        _index_versions[index] = version
+    return version
+
+
+async def get_index_version_async(redis, index: str) -> int:
+    with _lock:
+        version = _index_versions.get(index)
+    if version is not None:
+        return version
+    try:
+        version = int(await redis.get(_version_key(index)) or 0)
+    except Exception as e:
+        logger.warning(f"Failed to read index version from Redis: {str(e)}")
+        version = 0
+    with _lock:
+        _index_versions[index] = version
+    return version
+
+
+def invalidate_index(index: str) -> int:
+    """
+    Invalidate every cached result for an index, e.g. after reindexing.
+
+    Other processes pick up the new version within INDEX_VERSION_TTL seconds.
+
+    Returns:
+    int: The new index version.
+    """
+    version = redis_client.incr(_version_key(index))
+    with _lock:
+        _index_versions[index] = version
+        _local_cache.clear()
+    return version
+
+
+def cache_key(query: str, index: str, size: int, version: int = None) -> str:
+    if version is None:
+        version = get_index_version(index)
+    digest = hashlib.sha256(normalize_query(query).encode("utf-8")).hexdigest()
+    return f"retrieval_cache:{index}:{version}:{size}:{digest}"
+
+
+def cached_search(query: str, index: str, size: int, search):
+    """
+    Return cached search results, or run the search once for all concurrent callers.
+
+    Results are looked up in the in-process cache, then in Redis. On a miss the
+    first caller runs the search while concurrent callers for the same key wait
+    for its result instead of sending their own. A waiting caller whose leader
+    fails or takes longer than RETRIEVAL_INFLIGHT_TIMEOUT seconds runs the
+    search itself. None results (failed searches) are not cached.
+
+    Parameters:
+    query (str): The user's search query.
+    index (str): The Elasticsearch index.
+    size (int): The number of hits requested.
+    search (callable): Runs the search; takes no arguments.
+
+    Returns:
+    list: The search results, or None if the search failed.
+    """
+    key = cache_key(query, index, size)
+
+    with _lock:
+        results = _local_cache.get(key)
+        if results is not None:
+            _stats["local_hits"] += 1
+            return results
+        inflight = _inflight.get(key)
+        if inflight is None:
+            inflight = _inflight[key] = Future()
+            leader = True
+        else:
+            _stats["coalesced"] += 1
+            leader = False
+
+    if not leader:
+        try:
+            return inflight.result(timeout=INFLIGHT_WAIT_TIMEOUT)
+        except Exception as e:
+            # The leader's search failed or is taking too long; search for this caller instead
+            logger.warning(f"Coalesced search did not complete, searching again: {e!r}")
+            return search()
+
+    try:
+        results = _read_redis(key)
+        if results is not None:
+            _count("redis_hits")
+        else:
+            _count("misses")
+            results = search()
+            if results is not None:
+                _write_redis(key, results)
+        if results is not None:
+            with _lock:
+                _local_cache[key] = results
+        inflight.set_result(results)
+        return results
+    except Exception as e:
+        inflight.set_exception(e)
+        raise
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+
+
+def cached_search_many(queries: list, index: str, size: int, search_many):
+    """
+    Batch form of cached_search: cached queries are answered from the cache and
+    the rest are searched with a single search_many call.
+
+    Parameters:
+    search_many (callable): Takes a list of queries and returns a list of results.
+
+    Returns:
+    list: The results in the order of the queries; None for failed searches.
+    """
+    keys = [cache_key(query, index, size) for query in queries]
+    results = [None] * len(queries)
+    # Repeated queries within a batch are searched once
+    missing = {}
+    for i, key in enumerate(keys):
+        if key in missing:
+            missing[key].append(i)
+            continue
+        with _lock:
+            results[i] = _local_cache.get(key)
+        if results[i] is not None:
+            _count("local_hits")
+            continue
+        results[i] = _read_redis(key)
+        if results[i] is not None:
+            _count("redis_hits")
+            with _lock:
+                _local_cache[key] = results[i]
+            continue
+        _count("misses")
+        missing[key] = [i]
+
+    if missing:
+        found_results = search_many([queries[indexes[0]] for indexes in missing.values()])
+        for (key, indexes), found in zip(missing.items(), found_results):
+            for i in indexes:
+                results[i] = found
+            if found is not None:
+                _write_redis(key, found)
+                with _lock:
+                    _local_cache[key] = found
+    return results
+
+
+async def cached_search_async(redis, query: str, index: str, size: int, search):
+    """
+    cached_search for the event loop, on an asyncio Redis client.
+
+    Parameters:
+    search (callable): Returns an awaitable for the search; takes no arguments.
+    """
+    key = cache_key(query, index, size, await get_index_version_async(redis, index))
+
+    with _lock:
+        results = _local_cache.get(key)
+        if results is not None:
+            _stats["local_hits"] += 1
+            return results
+    inflight = _async_inflight.get(key)
+    if inflight is not None:
+        _count("coalesced")
+        try:
+            return await asyncio.wait_for(asyncio.shield(inflight), INFLIGHT_WAIT_TIMEOUT)
+        except asyncio.CancelledError:
+            # Only the leader's request going away is recovered from, not this one's
+            if not inflight.cancelled():
+                raise
+            logger.warning("Coalesced search was cancelled, searching again")
+        except Exception as e:
+            logger.warning(f"Coalesced search did not complete, searching again: {e!r}")
+        return await search()
+    inflight = _async_inflight[key] = asyncio.get_running_loop().create_future()
+
+    try:
+        results = await _read_redis_async(redis, key)
+        if results is not None:
+            _count("redis_hits")
+        else:
+            _count("misses")
+            results = await search()
+            if results is not None:
+                await _write_redis_async(redis, key, results)
+        if results is not None:
+            with _lock:
+                _local_cache[key] = results
+        inflight.set_result(results)
+        return results
+    except asyncio.CancelledError:
+        inflight.cancel()
+        raise
+    except Exception as e:
+        inflight.set_exception(e)
+        # Mark the exception retrieved so a future without followers does not log it
+        inflight.exception()
+        raise
+    finally:
+        _async_inflight.pop(key, None)
+
+
+async def cached_search_many_async(redis, queries: list, index: str, size: int, search_many):
+    """
+    cached_search_many for the event loop.
+
+    Parameters:
+    search_many (callable): Takes a list of queries and returns an awaitable for their results.
+    """
+    version = await get_index_version_async(redis, index)
+    keys = [cache_key(query, index, size, version) for query in queries]
+    results = [None] * len(queries)
+    missing = {}
+    for i, key in enumerate(keys):
+        if key in missing:
+            missing[key].append(i)
+            continue
+        with _lock:
+            results[i] = _local_cache.get(key)
+        if results[i] is not None:
+            _count("local_hits")
+            continue
+        results[i] = await _read_redis_async(redis, key)
+        if results[i] is not None:
+            _count("redis_hits")
+            with _lock:
+                _local_cache[key] = results[i]
+            continue
+        _count("misses")
+        missing[key] = [i]
+
+    if missing:
+        found_results = await search_many([queries[indexes[0]] for indexes in missing.values()])
+        for (key, indexes), found in zip(missing.items(), found_results):
+            for i in indexes:
+                results[i] = found
+            if found is not None:
+                await _write_redis_async(redis, key, found)
+                with _lock:
+                    _local_cache[key] = found
+    return results
+
+
+def _read_redis(key: str):
+    try:
+        cached = redis_client.get(key)
+    except Exception as e:
+        logger.warning(f"Failed to read retrieval cache from Redis: {str(e)}")
+        return None
+    return json.loads(cached) if cached is not None else None
+
+
+def _write_redis(key: str, results: list):
+    try:
+        redis_client.set(key, json.dumps(results, separators=(",", ":")), ex=RETRIEVAL_REDIS_TTL)
+    except Exception as e:
+        logger.warning(f"Failed to write retrieval cache to Redis: {str(e)}")
+
+
+async def _read_redis_async(redis, key: str):
+    try:
+        cached = await redis.get(key)
+    except Exception as e:
+        logger.warning(f"Failed to read retrieval cache from Redis: {str(e)}")
+        return None
+    return json.loads(cached) if cached is not None else None
+
+
+async def _write_redis_async(redis, key: str, results: list):
+    try:
+        await redis.set(key, json.dumps(results, separators=(",", ":")), ex=RETRIEVAL_REDIS_TTL)
+    except Exception as e:
+        logger.warning(f"Failed to write retrieval cache to Redis: {str(e)}")
+
+
+def get_cache_stats() -> dict:
+    with _lock:
+        stats = dict(_stats)
+        stats["local_entries"] = len(_local_cache)
+        stats["inflight"] = len(_inflight)
+    return stats
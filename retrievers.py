@@ -0,0 +1,172 @@
+"""
+Where the API's search results come from.
+
+BAYARD_RETRIEVER picks the retriever: "elasticsearch" (the default) runs the
+ELSER query on the cluster, and "local" runs BM25 over the corpus snapshot
+at LOCAL_INDEX_PATH (see local_index.py and scripts/export_corpus.py).
+
+With RETRIEVER_FAILOVER on, an Elasticsearch search that fails, including
+one refused by its open circuit breaker, is answered from the snapshot
+instead of with no documents, if a snapshot exists. The request then lists
+"retriever" under "degraded" and the answer is not cached.
+
+Every retriever returns documents shaped like those of
+elasticsearch_utils.filter_hits, or None when the search failed.
+"""
+import os
+import asyncio
+import logging
+import threading
+from elasticsearch_utils import (ES_SEARCH_SIZE, filter_hits, search_elasticsearch, search_elasticsearch_batch,
+                                 search_elasticsearch_async, search_elasticsearch_batch_async)
+from local_index import LocalIndex
+from metrics import timed, RETRIEVER_FAILOVERS
+from deadline import degrade
+
+logger = logging.getLogger(__name__)
+
+# "elasticsearch" or "local"
+BAYARD_RETRIEVER = os.environ.get("BAYARD_RETRIEVER", "elasticsearch").lower()
+LOCAL_INDEX_PATH = os.environ.get("LOCAL_INDEX_PATH", "corpus_snapshot")
+RETRIEVER_FAILOVER = os.environ.get("RETRIEVER_FAILOVER", "true").lower() in ("1", "true", "yes")
+
+
+class ElasticsearchRetriever:
+    """ELSER search on the cluster, through the retrieval cache."""
+
+    name = "elasticsearch"
+
+    def available(self) -> bool:
+        return True
+
+    def search(self, query: str):
+        return search_elasticsearch(query)
+
+    def search_batch(self, queries: list) -> list:
+        return search_elasticsearch_batch(queries)
+
+    async def search_async(self, query: str):
+        # Imported here so the Flask app never loads the async clients
+        from async_clients import get_async_elasticsearch, get_async_redis
+        return await search_elasticsearch_async(get_async_elasticsearch(), get_async_redis(), query)
+
+    async def search_batch_async(self, queries: list) -> list:
+        from async_clients import get_async_elasticsearch, get_async_redis
+        return await search_elasticsearch_batch_async(get_async_elasticsearch(), get_async_redis(), queries)
+
+
+class LocalRetriever:
+    """
+    BM25 search over a corpus snapshot, opened on first use.
+
+    Parameters:
+    path (str): The snapshot directory.
+    """
+
+    name = "local"
+
+    def __init__(self, path: str = LOCAL_INDEX_PATH):
+        self.path = path
+        self._index = None
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        return self._index is not None or os.path.exists(os.path.join(self.path, "meta.json"))
+
+    def index(self) -> LocalIndex:
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    logger.info("Opening corpus snapshot at %s", self.path)
+                    self._index = LocalIndex(self.path)
+        return self._index
+
+    def search(self, query: str):
+        try:
+            with timed("search_local"):
+                return filter_hits(self.index().search(query, ES_SEARCH_SIZE))
+        except Exception as e:
+            logger.error("Local search failed: %s", e)
+            return None
+
+    def search_batch(self, queries: list) -> list:
+        return [self.search(query) for query in queries]
+
+    async def search_async(self, query: str):
+        # Scoring is NumPy work on the snapshot; keep it off the event loop
+        return await asyncio.to_thread(self.search, query)
+
+    async def search_batch_async(self, queries: list) -> list:
+        return await asyncio.to_thread(self.search_batch, queries)
+
+
+class FailoverRetriever:
+    """
+    Search with a primary retriever, and with a fallback when the primary fails.
+
+    Parameters:
+    primary: The retriever searched first.
+    fallback: The retriever searched when the primary returns None.
+    """
+
+    def __init__(self, primary, fallback):
+        self.primary = primary
+        self.fallback = fallback
+        self.name = primary.name
+
+    def available(self) -> bool:
+        return self.primary.available() or self.fallback.available()
+
+    def _failed_over(self, count: int = 1):
+        logger.warning("%s search failed, answering from %s", self.primary.name, self.fallback.name)
+        RETRIEVER_FAILOVERS.labels(self.primary.name, self.fallback.name).inc(count)
+        degrade("retriever")
+
+    def search(self, query: str):
+        results = self.primary.search(query)
+        if results is None and self.fallback.available():
+            self._failed_over()
+            return self.fallback.search(query)
+        return results
+
+    def search_batch(self, queries: list) -> list:
+        results = list(self.primary.search_batch(queries))
+        failed = [i for i, result in enumerate(results) if result is None]
+        if failed and self.fallback.available():
+            self._failed_over(len(failed))
+            for i, result in zip(failed, self.fallback.search_batch([queries[i] for i in failed])):
+                results[i] = result
+        return results
+
+    async def search_async(self, query: str):
+        results = await self.primary.search_async(query)
+        if results is None and self.fallback.available():
+            self._failed_over()
+            return await self.fallback.search_async(query)
+        return results
+
+    async def search_batch_async(self, queries: list) -> list:
+        results = list(await self.primary.search_batch_async(queries))
+        failed = [i for i, result in enumerate(results) if result is None]
+        if failed and self.fallback.available():
+            self._failed_over(len(failed))
+            for i, result in zip(failed, await self.fallback.search_batch_async([queries[i] for i in failed])):
+                results[i] = result
+        return results
+
+
+def build_retriever(name: str = BAYARD_RETRIEVER, failover: bool = RETRIEVER_FAILOVER, path: str = LOCAL_INDEX_PATH):
+    """
+    Returns:
+    The retriever named by BAYARD_RETRIEVER, falling back to the local index when failover is on.
+    """
+    if name == "local":
+        return LocalRetriever(path)
+    if name != "elasticsearch":
+        raise ValueError(f"Unknown retriever {name!r}; expected 'elasticsearch' or 'local'")
+    if failover:
+        return FailoverRetriever(ElasticsearchRetriever(), LocalRetriever(path))
+    return ElasticsearchRetriever()
+
+
+retriever = build_retriever()
@@ -0,0 +1,94 @@
+"""
+Report how often the local query classifier agrees with Cohere.
+
+Usage:
+    python scripts/classifier_agreement.py [--queries queries.txt] [--output report.json]
+
+Without --queries the labelled classification examples are used, each one
+classified by a local model trained on all the other examples
+(leave-one-out) so the local side is not scored on its own training data.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from local_classifier import LocalQueryClassifier
+from query_classifier import CLASSIFY_EXAMPLES, classify_with_cohere
+
+THRESHOLDS = [0.5, 0.6, 0.7, 0.8, 0.9]
+COHERE_BATCH_SIZE = 96
+
+
+def local_predictions(queries, leave_one_out):
+    """
+    Returns:
+    tuple: (label, confidence) per query, and the seconds spent predicting.
+    """
+    texts = [example.text for example in CLASSIFY_EXAMPLES]
+    labels = [example.label for example in CLASSIFY_EXAMPLES]
+    model = LocalQueryClassifier.train(texts, labels)
+    predictions = []
+    predict_seconds = 0.0
+    for i, query in enumerate(queries):
+        if leave_one_out:
+            model = LocalQueryClassifier.train(texts[:i] + texts[i + 1:], labels[:i] + labels[i + 1:])
+        start = time.perf_counter()
+        predictions.append(model.predict(query))
+        predict_seconds += time.perf_counter() - start
+    return predictions, predict_seconds
+
+
+def cohere_predictions(queries):
+    labels = []
+    for start in range(0, len(queries), COHERE_BATCH_SIZE):
+        labels += classify_with_cohere(queries[start:start + COHERE_BATCH_SIZE])
+    return labels
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", help="File with one query per line.")
+    parser.add_argument("--output", help="Write the report as JSON to this file.")
+    args = parser.parse_args()
+
+    if args.queries:
+        with open(args.queries) as f:
+            queries = [line.strip() for line in f if line.strip()]
+    else:
+        queries = [example.text for example in CLASSIFY_EXAMPLES]
+
+    local, local_seconds = local_predictions(queries, leave_one_out=not args.queries)
+    remote = cohere_predictions(queries)
+
+    agreement = sum(label == cohere for (label, _), cohere in zip(local, remote))
+    report = {
+        "queries": len(queries),
+        "agreement": round(agreement / len(queries), 4),
+        "local_us_per_query": round(local_seconds / len(queries) * 1e6, 1),
+        "thresholds": [],
+        "disagreements": [
+            {"query": query, "local": label, "confidence": round(confidence, 3), "cohere": cohere}
+            for query, (label, confidence), cohere in zip(queries, local, remote) if label != cohere
+        ],
+    }
+    # What each threshold would send to Cohere, and how often the local answers it keeps agree
+    for threshold in THRESHOLDS:
+        kept = [(label, cohere) for (label, confidence), cohere in zip(local, remote) if confidence >= threshold]
+        report["thresholds"].append({
+            "threshold": threshold,
+            "answered_locally": round(len(kept) / len(queries), 4),
+            "local_agreement": round(sum(label == cohere for label, cohere in kept) / len(kept), 4) if kept else None,
+        })
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Export bayardcorpus into a snapshot with a local BM25 index (see local_index.py).
+
+Usage:
+    python scripts/export_corpus.py [--output corpus_snapshot] [--limit 1000]
+    python scripts/export_corpus.py --fixture hits.json --output corpus_snapshot
+
+Documents are scrolled out of Elasticsearch (ES_URL and ES_API_KEY unless
+--es-url and --es-api-key are given) with only the fields the API returns,
+so the ELSER token weights are never transferred. --fixture builds the
+snapshot from documents recorded with benchmarks/es_query_benchmark.py
+--record instead. Point LOCAL_INDEX_PATH at the output to search it.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from local_index import build_snapshot
+from retrievers import LOCAL_INDEX_PATH
+
+
+def scroll_documents(es_url, es_api_key, index, batch_size, limit):
+    from elasticsearch import Elasticsearch
+    from elasticsearch.helpers import scan
+    from elasticsearch_utils import ES_SOURCE_FIELDS
+
+    es = Elasticsearch(es_url, api_key=es_api_key, request_timeout=60)
+    hits = scan(es, index=index, query={"query": {"match_all": {}}, "_source": {"includes": ES_SOURCE_FIELDS}},
+                size=batch_size, preserve_order=False)
+    for count, hit in enumerate(hits):
+        if limit is not None and count >= limit:
+            break
+        yield {"_id": hit["_id"], **hit["_source"]}
+
+
+def counted(docs, every=5000):
+    for count, doc in enumerate(docs, 1):
+        if count % every == 0:
+            print(f"Exported {count} documents")
+        yield doc
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default=LOCAL_INDEX_PATH, help="The snapshot directory.")
+    parser.add_argument("--es-url", default=os.environ.get("ES_URL"))
+    parser.add_argument("--es-api-key", default=os.environ.get("ES_API_KEY"))
+    parser.add_argument("--index", default="bayardcorpus")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Documents per scroll page.")
+    parser.add_argument("--limit", type=int, help="Export at most this many documents.")
+    parser.add_argument("--fixture", help="Build the snapshot from recorded documents instead of Elasticsearch.")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.fixture:
+        with open(args.fixture) as f:
+            docs = json.load(f)[:args.limit]
+        source = args.fixture
+    else:
+        if not args.es_url:
+            parser.error("--es-url or ES_URL is required without --fixture")
+        docs = scroll_documents(args.es_url, args.es_api_key, args.index, args.batch_size, args.limit)
+        source = f"{args.es_url.rstrip('/')}/{args.index}"
+
+    meta = build_snapshot(counted(docs), args.output, source=source)
+    meta["seconds"] = round(time.perf_counter() - start, 2)
+    meta["bytes"] = sum(os.path.getsize(os.path.join(args.output, name)) for name in os.listdir(args.output))
+    print(json.dumps(meta, indent=2))
+
+
+if __name__ == "__main__":
+    main()
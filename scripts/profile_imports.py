@@ -0,0 +1,123 @@
+"""
+Show what importing the app costs at start-up, module by module.
+
+Runs `python -X importtime -c "import <module>"` in a fresh interpreter and
+summarises the output: total import time, the slowest modules by cumulative
+time, this repository's modules, and third-party packages by the time spent
+in their own modules.
+
+Usage:
+    python scripts/profile_imports.py [--module app] [--top 20] [--clients] [--output report.json]
+
+With --clients the script also times building each lazily created client
+(see lazy_client.py) after the import, which needs the usual environment
+variables but no network access.
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+from collections import defaultdict
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+
+CLIENT_TIMING = """
+import time, json, lazy_client
+timings = {}
+for client in lazy_client._registry:
+    start = time.perf_counter()
+    try:
+        client._resolve()
+        timings[client._name] = round((time.perf_counter() - start) * 1000, 1)
+    except Exception as e:
+        timings[client._name] = f"failed: {e}"
+print(json.dumps(timings))
+"""
+
+
+def import_times(module, clients=False):
+    """
+    Returns:
+    tuple: A list of (module, self_us, cumulative_us, depth) in import order,
+    and the client build times in ms when clients is set.
+    """
+    code = f"import {module}" + (CLIENT_TIMING if clients else "")
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            cwd=ROOT, capture_output=True, text=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((name, int(self_us), int(cumulative_us), len(indent) // 2))
+    if result.returncode != 0:
+        raise SystemExit(f"import {module} failed:\n{result.stderr[-2000:]}")
+    client_times = json.loads(result.stdout.strip().splitlines()[-1]) if clients else None
+    return rows, client_times
+
+
+def local_modules():
+    return {name[:-3] for name in os.listdir(ROOT) if name.endswith(".py")}
+
+
+def summarise(rows, top):
+    local = local_modules()
+    packages = defaultdict(int)
+    for name, self_us, _, _ in rows:
+        packages[name.split(".")[0]] += self_us
+    top_level = [row for row in rows if row[3] == 0]
+    return {
+        "total_ms": round(sum(row[2] for row in top_level) / 1000, 1),
+        "slowest_modules": [
+            {"module": name, "cumulative_ms": round(cumulative / 1000, 1), "self_ms": round(self_us / 1000, 1)}
+            for name, self_us, cumulative, _ in sorted(rows, key=lambda row: -row[2])[:top]
+        ],
+        "repo_modules": [
+            {"module": name, "cumulative_ms": round(cumulative / 1000, 1), "self_ms": round(self_us / 1000, 1)}
+            for name, self_us, cumulative, _ in sorted(rows, key=lambda row: -row[2]) if name in local
+        ],
+        "packages": [
+            {"package": name, "self_ms": round(self_us / 1000, 1)}
+            for name, self_us in sorted(packages.items(), key=lambda item: -item[1])[:top] if name not in local
+        ],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app", help="Module to import, e.g. app or async_app.")
+    parser.add_argument("--top", type=int, default=20, help="Rows to show per table.")
+    parser.add_argument("--clients", action="store_true", help="Also time building the lazy clients.")
+    parser.add_argument("--output", help="Write the report as JSON to this file.")
+    args = parser.parse_args()
+
+    rows, client_times = import_times(args.module, args.clients)
+    report = summarise(rows, args.top)
+    if client_times is not None:
+        report["client_build_ms"] = client_times
+
+    print(f"import {args.module}: {report['total_ms']} ms")
+    print("\nSlowest modules (cumulative ms, self ms):")
+    for row in report["slowest_modules"]:
+        print(f"  {row['cumulative_ms']:>9} {row['self_ms']:>9}  {row['module']}")
+    print("\nRepository modules (cumulative ms, self ms):")
+    for row in report["repo_modules"]:
+        print(f"  {row['cumulative_ms']:>9} {row['self_ms']:>9}  {row['module']}")
+    print("\nPackages (self ms):")
+    for row in report["packages"]:
+        print(f"  {row['self_ms']:>9}  {row['package']}")
+    if client_times is not None:
+        print("\nClient build (ms):")
+        for name, value in client_times.items():
+            print(f"  {value!s:>9}  {name}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
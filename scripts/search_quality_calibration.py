@@ -0,0 +1,128 @@
+"""
+Compare the local search quality score with the gpt-3.5-turbo-instruct reflection.
+
+Usage:
+    python scripts/search_quality_calibration.py --queries queries.txt [--record samples.jsonl] [--output report.json]
+    python scripts/search_quality_calibration.py --samples samples.jsonl [--output report.json]
+
+With --queries each query is searched in Elasticsearch and scored both ways;
+--record saves the documents and LLM scores so later runs (e.g. after
+changing the weights) can use --samples without calling Elasticsearch or
+OpenAI again. Samples are JSON lines with input_text, documents and,
+optionally, llm_score.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from search_quality import FEATURE_WEIGHTS, search_quality_features, score_from_features, score_search_quality_local
+from openai_utils import initialize_openai, generate_search_quality_reflection
+
+
+def load_samples(args):
+    if args.samples:
+        with open(args.samples) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    from elasticsearch_utils import search_elasticsearch_uncached
+    with open(args.queries) as f:
+        queries = [line.strip() for line in f if line.strip()]
+    return [{"input_text": query, "documents": search_elasticsearch_uncached(query) or []} for query in queries]
+
+
+def fit_weights(features, targets):
+    """
+    Least-squares weights mapping features to the LLM score, clipped to be
+    non-negative and rescaled to sum to 1 like FEATURE_WEIGHTS.
+    """
+    names = list(FEATURE_WEIGHTS)
+    X = np.array([[row[name] for name in names] for row in features])
+    y = (np.array(targets, dtype=float) - 1) / 4
+    weights, *_ = np.linalg.lstsq(X, y, rcond=None)
+    weights = np.clip(weights, 0, None)
+    if weights.sum() == 0:
+        return dict(FEATURE_WEIGHTS)
+    return {name: round(float(weight), 3) for name, weight in zip(names, weights / weights.sum())}
+
+
+def agreement_report(local_scores, llm_scores):
+    local_scores = np.array(local_scores)
+    llm_scores = np.array(llm_scores)
+    confusion = [[int(((local_scores == local) & (llm_scores == llm)).sum()) for llm in range(1, 6)] for local in range(1, 6)]
+    correlation = np.corrcoef(local_scores, llm_scores)[0, 1] if local_scores.std() and llm_scores.std() else None
+    return {
+        "exact_agreement": round(float((local_scores == llm_scores).mean()), 4),
+        "within_one": round(float((abs(local_scores - llm_scores) <= 1).mean()), 4),
+        "mean_absolute_error": round(float(abs(local_scores - llm_scores).mean()), 4),
+        "correlation": round(float(correlation), 4) if correlation is not None else None,
+        # Rows are local scores 1-5, columns LLM scores 1-5
+        "confusion": confusion,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--queries", help="File with one query per line, searched live.")
+    source.add_argument("--samples", help="JSON lines of recorded queries and documents.")
+    parser.add_argument("--record", help="Save the samples with their LLM scores to this file.")
+    parser.add_argument("--output", help="Write the report as JSON to this file.")
+    args = parser.parse_args()
+
+    initialize_openai()
+    samples = load_samples(args)
+
+    local_seconds = 0.0
+    llm_seconds = 0.0
+    llm_calls = 0
+    features, local_scores, llm_scores = [], [], []
+    for sample in samples:
+        start = time.perf_counter()
+        local = score_search_quality_local(sample["documents"], sample["input_text"])
+        local_seconds += time.perf_counter() - start
+
+        if sample.get("llm_score") is None:
+            start = time.perf_counter()
+            sample["llm_score"] = generate_search_quality_reflection(sample["documents"], sample["input_text"])["search_quality_score"]
+            llm_seconds += time.perf_counter() - start
+            llm_calls += 1
+        if sample["llm_score"] is None:
+            continue
+
+        features.append(search_quality_features(sample["documents"], sample["input_text"]))
+        local_scores.append(local["search_quality_score"])
+        llm_scores.append(sample["llm_score"])
+
+    if args.record:
+        with open(args.record, "w") as f:
+            for sample in samples:
+                f.write(json.dumps(sample) + "\n")
+
+    if not llm_scores:
+        print("No samples with an LLM score to compare")
+        return
+
+    fitted = fit_weights(features, llm_scores)
+    report = {
+        "samples": len(llm_scores),
+        "local_ms_per_query": round(local_seconds / len(samples) * 1000, 3),
+        "llm_ms_per_query": round(llm_seconds / llm_calls * 1000, 1) if llm_calls else None,
+        "weights": FEATURE_WEIGHTS,
+        "current": agreement_report(local_scores, llm_scores),
+        "fitted_weights": fitted,
+        "fitted": agreement_report([score_from_features(row, fitted) for row in features], llm_scores),
+    }
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import os
+import re
+import random
+import logging
+from openai_utils import generate_search_quality_reflection, generate_search_quality_reflection_async
+from deadline import DEADLINE_REFLECTION_MIN, allows
+
+logger = logging.getLogger(__name__)
+
+# "local" scores every request without a model call, "llm" asks gpt-3.5-turbo-instruct every time,
+# and "sampled" scores locally but also asks the model for SEARCH_QUALITY_SAMPLE_RATE of requests
+SEARCH_QUALITY_MODE = os.environ.get("SEARCH_QUALITY_MODE", "local").lower()
+SEARCH_QUALITY_SAMPLE_RATE = float(os.environ.get("SEARCH_QUALITY_SAMPLE_RATE", "0.05"))
+# ELSER _score at which the top hit counts as half way to a perfect match
+SEARCH_QUALITY_SCORE_PIVOT = float(os.environ.get("SEARCH_QUALITY_SCORE_PIVOT", "10"))
+# Only the first documents are considered, as they are the ones the answer draws on most
+SEARCH_QUALITY_TOP_K = int(os.environ.get("SEARCH_QUALITY_TOP_K", "5"))
+
+# Feature weights; they sum to 1. scripts/search_quality_calibration.py suggests values fitted to LLM scores
+FEATURE_WEIGHTS = {
+    "term_overlap": 0.35,
+    "term_coverage": 0.2,
+    "score_strength": 0.3,
+    "title_diversity": 0.15,
+}
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+_STOPWORDS = frozenset(
+    "a about an and are as at be by can did do does for from has have how i in is it me of on or "
+    "tell that the their there these they this to was were what when where which who why will with you your".split()
+)
+
+
+def _terms(text: str) -> set:
+    return {token for token in _TOKEN_PATTERN.findall((text or "").lower()) if token not in _STOPWORDS}
+
+
+def search_quality_features(search_results: list, input_text: str) -> dict:
+    """
+    Compute search quality features in [0, 1] from the retrieved documents.
+
+    term_overlap: mean share of query terms found in each top document's title and abstract.
+    term_coverage: share of query terms found in any top document.
+    score_strength: top ELSER _score relative to SEARCH_QUALITY_SCORE_PIVOT.
+    title_diversity: share of distinct titles among the top documents.
+    """
+    docs = (search_results or [])[:SEARCH_QUALITY_TOP_K]
+    query_terms = _terms(input_text)
+    doc_terms = [_terms(f"{doc.get('title', '')} {doc.get('abstract', '')}") for doc in docs]
+
+    if query_terms and doc_terms:
+        overlaps = [len(query_terms & terms) / len(query_terms) for terms in doc_terms]
+        term_overlap = sum(overlaps) / len(overlaps)
+        term_coverage = len(query_terms & set().union(*doc_terms)) / len(query_terms)
+    else:
+        term_overlap = term_coverage = 0.0
+
+    scores = [doc.get("_score") or 0.0 for doc in docs]
+    top_score = max(scores) if scores else 0.0
+    score_strength = top_score / (top_score + SEARCH_QUALITY_SCORE_PIVOT) if top_score > 0 else 0.0
+
+    titles = [(doc.get("title") or "").strip().lower() for doc in docs]
+    title_diversity = len(set(titles)) / len(titles) if titles else 0.0
+
+    return {
+        "term_overlap": term_overlap,
+        "term_coverage": term_coverage,
+        "score_strength": score_strength,
+        "title_diversity": title_diversity,
+    }
+
+
+def score_from_features(features: dict, weights: dict = None) -> int:
+    weights = weights or FEATURE_WEIGHTS
+    combined = sum(weights[name] * features[name] for name in weights)
+    return max(1, min(5, 1 + round(4 * combined)))
+
+
+def _describe(features: dict, num_docs: int) -> str:
+    coverage = round(features["term_coverage"] * 100)
+    distinct = round(features["title_diversity"] * num_docs)
+    strength = "strong" if features["score_strength"] >= 0.6 else "moderate" if features["score_strength"] >= 0.4 else "weak"
+    return (f"The top {num_docs} documents cover {coverage}% of the query terms, "
+            f"{distinct} of them have distinct titles and the best match is {strength}.")
+
+
+def score_search_quality_local(search_results: list, input_text: str) -> dict:
+    """
+    Score search quality from the retrieved documents alone, without a model call.
+
+    Returns:
+    dict: search_quality_reflection (one sentence) and search_quality_score (1-5).
+    """
+    if not search_results:
+        return {
+            "search_quality_reflection": "No documents were retrieved for the query.",
+            "search_quality_score": 1,
+        }
+    features = search_quality_features(search_results, input_text)
+    return {
+        "search_quality_reflection": _describe(features, min(len(search_results), SEARCH_QUALITY_TOP_K)),
+        "search_quality_score": score_from_features(features),
+    }
+
+
+def _llm_reflection_fits() -> bool:
+    # Close to the request's deadline the local score stands in for the model's
+    return allows("search_quality_reflection", DEADLINE_REFLECTION_MIN)
+
+
+def assess_search_quality(search_results: list, input_text: str) -> dict:
+    """
+    Score search quality according to SEARCH_QUALITY_MODE.
+
+    The model is only asked while the request has at least
+    DEADLINE_REFLECTION_MIN seconds left; see deadline.py.
+
+    Returns:
+    dict: search_quality_reflection and search_quality_score.
+    """
+    if SEARCH_QUALITY_MODE == "llm" and _llm_reflection_fits():
+        return generate_search_quality_reflection(search_results, input_text)
+
+    local = score_search_quality_local(search_results, input_text)
+    if SEARCH_QUALITY_MODE == "sampled" and random.random() < SEARCH_QUALITY_SAMPLE_RATE and _llm_reflection_fits():
+        llm = generate_search_quality_reflection(search_results, input_text)
+        logger.info("Search quality sample: local=%s llm=%s", local['search_quality_score'], llm['search_quality_score'])
+        return llm
+    return local
+
+
+async def assess_search_quality_async(openai_client, search_results: list, input_text: str) -> dict:
+    """assess_search_quality with an async OpenAI client."""
+    if SEARCH_QUALITY_MODE == "llm" and _llm_reflection_fits():
+        return await generate_search_quality_reflection_async(openai_client, search_results, input_text)
+
+    local = score_search_quality_local(search_results, input_text)
+    if SEARCH_QUALITY_MODE == "sampled" and random.random() < SEARCH_QUALITY_SAMPLE_RATE and _llm_reflection_fits():
+        llm = await generate_search_quality_reflection_async(openai_client, search_results, input_text)
+        logger.info("Search quality sample: local=%s llm=%s", local['search_quality_score'], llm['search_quality_score'])
+        return llm
+    return local
@@ -0,0 +1,211 @@
+import os
+import time
+import asyncio
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from metrics import record_stage
+from admission import ADMISSION_MAX_IN_FLIGHT
+from pipeline import BATCH_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+# The most stages a pipeline request runs on the pool at once
+STAGES_PER_REQUEST = 2
+
+# Stage concurrency configuration
+CONCURRENT_STAGES_ENABLED = os.environ.get("BAYARD_CONCURRENT_STAGES", "true").lower() in ("1", "true", "yes")
+# Enough threads for every admitted request, plus the queries of a batch answered side by side,
+# so no admitted stage waits for a thread and spends its timeout in the queue
+STAGE_POOL_SIZE = int(os.environ.get("BAYARD_STAGE_POOL_SIZE",
+                                     str(STAGES_PER_REQUEST * (ADMISSION_MAX_IN_FLIGHT + BATCH_CONCURRENCY))))
+DEFAULT_STAGE_TIMEOUT = float(os.environ.get("BAYARD_STAGE_TIMEOUT", "60"))
+
+_executor = ThreadPoolExecutor(max_workers=STAGE_POOL_SIZE, thread_name_prefix="bayard-stage")
+
+
+class Stage:
+    """
+    A single unit of pipeline work.
+
+    Parameters:
+    name (str): Name used for timing and logging.
+    func (callable): The function to run.
+    args (tuple): Positional arguments for func.
+    kwargs (dict): Keyword arguments for func.
+    timeout (float): Seconds to wait for the stage when run concurrently.
+    default: Value returned if the stage fails or times out.
+    required (bool): Re-raise failures instead of falling back to the default.
+    """
+
+    def __init__(self, name, func, *args, timeout=None, default=None, required=False, **kwargs):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.timeout = timeout if timeout is not None else DEFAULT_STAGE_TIMEOUT
+        self.default = default
+        self.required = required
+
+
+class StageReport:
+    """Wall-clock accounting for one or more groups of stages."""
+
+    def __init__(self):
+        self.durations = {}
+        self.wall_time = 0.0
+
+    @property
+    def sequential_time(self):
+        return sum(self.durations.values())
+
+    @property
+    def time_saved(self):
+        return max(self.sequential_time - self.wall_time, 0.0)
+
+    def as_dict(self):
+        return {
+            "stage_durations": {name: round(duration, 4) for name, duration in self.durations.items()},
+            "wall_time": round(self.wall_time, 4),
+            "sequential_time": round(self.sequential_time, 4),
+            "time_saved": round(self.time_saved, 4),
+        }
+
+
+class StageTimeoutError(Exception):
+    pass
+
+
+def _timed_call(stage):
+    start = time.perf_counter()
+    try:
+        return stage.func(*stage.args, **stage.kwargs), time.perf_counter() - start
+    except Exception:
+        duration = time.perf_counter() - start
+        if stage.required:
+            raise
+        logger.exception("Stage %s failed after %.3fs", stage.name, duration)
+        return stage.default, duration
+
+
+class PendingStage:
+    """A stage that has been started on the pool and not yet joined."""
+
+    def __init__(self, stage, future, started_at):
+        self.stage = stage
+        self.future = future
+        self.started_at = started_at
+
+    def result(self, report=None):
+        """
+        Wait for the stage within what is left of its timeout.
+
+        Returns:
+        The stage result, or its default if it failed or timed out.
+        """
+        stage = self.stage
+        try:
+            value, duration = self.future.result(
+                timeout=max(self.started_at + stage.timeout - time.perf_counter(), 0)
+            )
+        except FutureTimeoutError:
+            self.future.cancel()
+            if stage.required:
+                raise StageTimeoutError(f"Stage {stage.name} timed out after {stage.timeout}s")
+            logger.error("Stage %s timed out after %.1fs", stage.name, stage.timeout)
+            value, duration = stage.default, time.perf_counter() - self.started_at
+        record_stage(stage.name, duration)
+        if report is not None:
+            report.durations[stage.name] = duration
+        return value
+
+
+def submit_stage(stage, executor=None):
+    """
+    Start a stage on the pool without waiting for it.
+
+    Parameters:
+    stage (Stage): The stage to start.
+    executor (ThreadPoolExecutor): Optional pool to use instead of the shared stage pool.
+
+    Returns:
+    PendingStage: A handle whose result() joins the stage with its timeout.
+    """
+    # Copy the context so context variables set by the request are visible in the workers
+    future = (executor or _executor).submit(contextvars.copy_context().run, _timed_call, stage)
+    return PendingStage(stage, future, time.perf_counter())
+
+
+def run_stages(stages, report=None):
+    """
+    Run independent stages and join them.
+
+    When concurrent execution is enabled the stages are fanned out on a bounded
+    thread pool and each one is joined with its own timeout, even when the group
+    has a single stage; otherwise they run one after another on the calling
+    thread, without timeouts. A stage that raises or times out yields its
+    default value, unless it is required, in which case the error is raised
+    to the caller.
+
+    Parameters:
+    stages (list): A list of Stage objects with no dependencies on each other.
+    report (StageReport): Optional report to accumulate timings into.
+
+    Returns:
+    dict: Stage name to result.
+    """
+    report = report if report is not None else StageReport()
+    results = {}
+    group_start = time.perf_counter()
+
+    # A lone stage still goes through the pool, which is what bounds it by its timeout
+    if not CONCURRENT_STAGES_ENABLED:
+        for stage in stages:
+            results[stage.name], report.durations[stage.name] = _timed_call(stage)
+            record_stage(stage.name, report.durations[stage.name])
+    else:
+        pending = [submit_stage(stage) for stage in stages]
+        for handle in pending:
+            results[handle.stage.name] = handle.result(report)
+
+    report.wall_time += time.perf_counter() - group_start
+    return results
+
+
+async def _timed_call_async(stage):
+    start = time.perf_counter()
+    try:
+        value = await asyncio.wait_for(stage.func(*stage.args, **stage.kwargs), stage.timeout)
+        return value, time.perf_counter() - start
+    except asyncio.TimeoutError:
+        if stage.required:
+            raise StageTimeoutError(f"Stage {stage.name} timed out after {stage.timeout}s")
+        logger.error("Stage %s timed out after %.1fs", stage.name, stage.timeout)
+        return stage.default, time.perf_counter() - start
+    except Exception:
+        duration = time.perf_counter() - start
+        if stage.required:
+            raise
+        logger.exception("Stage %s failed after %.3fs", stage.name, duration)
+        return stage.default, duration
+
+
+async def run_stages_async(stages, report=None):
+    """
+    run_stages for stages whose functions are coroutines, run concurrently on the event loop.
+
+    Returns:
+    dict: Stage name to result.
+    """
+    report = report if report is not None else StageReport()
+    group_start = time.perf_counter()
+    outcomes = await asyncio.gather(*(_timed_call_async(stage) for stage in stages), return_exceptions=True)
+    report.wall_time += time.perf_counter() - group_start
+
+    results = {}
+    for stage, outcome in zip(stages, outcomes):
+        if isinstance(outcome, BaseException):
+            raise outcome
+        results[stage.name], report.durations[stage.name] = outcome
+        record_stage(stage.name, report.durations[stage.name])
+    return results
@@ -0,0 +1,17 @@
+import os
+from supabase import create_client, Client
+from lazy_client import LazyClient
+
+# Supabase PostgreSQL database connection
+SUPABASE_URL = os.environ.get("SUPABASE_URL")
+SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
+
+
+def create_supabase_client() -> Client:
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        raise ValueError("SUPABASE_URL and SUPABASE_KEY environment variables are not set")
+    return create_client(SUPABASE_URL, SUPABASE_KEY)
+
+
+# Built on first use in each process; see lazy_client.py
+supabase: Client = LazyClient("supabase", create_supabase_client)
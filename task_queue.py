@@ -0,0 +1,248 @@
+import os
+import json
+import time
+import uuid
+import random
+import signal
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from redis_utils import redis_client, register_script
+
+logger = logging.getLogger(__name__)
+
+# Task queue configuration
+QUEUE_KEY = "bayard:tasks"
+PROCESSING_KEY = "bayard:tasks:processing"
+STARTED_KEY = "bayard:tasks:started"
+DELAYED_KEY = "bayard:tasks:delayed"
+DEAD_LETTER_KEY = "bayard:tasks:dead"
+
+TASK_MAX_ATTEMPTS = int(os.environ.get("TASK_MAX_ATTEMPTS", "5"))
+TASK_RETRY_BASE_DELAY = float(os.environ.get("TASK_RETRY_BASE_DELAY", "2"))
+TASK_RETRY_MAX_DELAY = float(os.environ.get("TASK_RETRY_MAX_DELAY", "300"))
+TASK_VISIBILITY_TIMEOUT = int(os.environ.get("TASK_VISIBILITY_TIMEOUT", "600"))
+WORKER_CONCURRENCY = int(os.environ.get("WORKER_CONCURRENCY", "4"))
+# Seconds the worker waits after its polling loop fails, e.g. while Redis is unavailable
+WORKER_ERROR_BACKOFF = float(os.environ.get("WORKER_ERROR_BACKOFF", "5"))
+
+# Registered task handlers by name
+_handlers = {}
+
+# Atomically move delayed jobs whose retry time has come back onto the queue
+_PROMOTE_DELAYED_SCRIPT = register_script("""
+local jobs = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, 100)
+for _, job in ipairs(jobs) do
+    redis.call('ZREM', KEYS[1], job)
+    redis.call('LPUSH', KEYS[2], job)
+end
+return #jobs
+""")
+
+
+def task(name):
+    """
+    Register a function as a background task handler.
+
+    Parameters:
+    name (str): The name jobs are enqueued under.
+    """
+    def decorator(func):
+        _handlers[name] = func
+        return func
+    return decorator
+
+
+def enqueue(name, **kwargs):
+    """
+    Push a job onto the Redis task queue.
+
+    Parameters:
+    name (str): The registered task name.
+    kwargs: JSON-serializable keyword arguments for the handler.
+
+    Returns:
+    str: The job id.
+    """
+    job = _new_job(name, kwargs)
+    redis_client.lpush(QUEUE_KEY, json.dumps(job))
+    return job["id"]
+
+
+def enqueue_many(jobs):
+    """
+    Push several jobs onto the Redis task queue in one MULTI/EXEC, so either all of them are queued or none is.
+
+    Parameters:
+    jobs (list): (name, kwargs) pairs, as for enqueue.
+
+    Returns:
+    list: The job ids.
+    """
+    jobs = [_new_job(name, kwargs) for name, kwargs in jobs]
+    pipe = redis_client.pipeline(transaction=True)
+    for job in jobs:
+        pipe.lpush(QUEUE_KEY, json.dumps(job))
+    pipe.execute()
+    return [job["id"] for job in jobs]
+
+
+async def enqueue_async(redis, name, **kwargs):
+    """enqueue on an asyncio Redis client."""
+    job = _new_job(name, kwargs)
+    await redis.lpush(QUEUE_KEY, json.dumps(job))
+    return job["id"]
+
+
+def _new_job(name, kwargs):
+    return {
+        "id": str(uuid.uuid4()),
+        "name": name,
+        "kwargs": kwargs,
+        "attempts": 0,
+        "enqueued_at": time.time(),
+    }
+
+
+def retry_delay(attempts):
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(TASK_RETRY_MAX_DELAY, TASK_RETRY_BASE_DELAY * (2 ** attempts)))
+
+
+def requeue_stale_jobs():
+    """
+    Return jobs to the queue whose worker died before finishing them.
+
+    Returns:
+    int: The number of jobs requeued.
+    """
+    now = time.time()
+    requeued = 0
+    for raw_job in redis_client.lrange(PROCESSING_KEY, 0, -1):
+        try:
+            job_id = json.loads(raw_job)["id"]
+        except (ValueError, TypeError, KeyError):
+            # Unreadable jobs are moved to the dead-letter list by the worker that took them
+            continue
+        started_at = redis_client.hget(STARTED_KEY, job_id)
+        if started_at is None:
+            # The worker may not have recorded its start time yet; check again next time
+            redis_client.hsetnx(STARTED_KEY, job_id, now)
+            continue
+        if now - float(started_at) < TASK_VISIBILITY_TIMEOUT:
+            continue
+        # Only requeue if this worker is the one that removed it from the processing list
+        if redis_client.lrem(PROCESSING_KEY, 1, raw_job):
+            redis_client.lpush(QUEUE_KEY, raw_job)
+            redis_client.hdel(STARTED_KEY, job_id)
+            requeued += 1
+    if requeued:
+        logger.warning("Requeued %d stale task(s)", requeued)
+    return requeued
+
+
+class Worker:
+    """
+    Consumes jobs from the Redis task queue.
+
+    Jobs are moved atomically from the queue onto a processing list while they
+    run, so a crashed worker's jobs are picked up again once their visibility
+    timeout has passed. Failed jobs are retried with jittered exponential
+    backoff and moved to a dead-letter list after TASK_MAX_ATTEMPTS.
+    """
+
+    def __init__(self, concurrency=WORKER_CONCURRENCY):
+        self.concurrency = concurrency
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bayard-task")
+        self._stopping = threading.Event()
+
+    def stop(self, *args):
+        self._stopping.set()
+
+    def run(self):
+        logger.info("Task worker started with concurrency %d", self.concurrency)
+        last_reap = 0.0
+        while not self._stopping.is_set():
+            try:
+                last_reap = self._poll(last_reap)
+            except Exception as e:
+                # Keep the worker alive through Redis outages and try again after a pause
+                logger.error("Task worker loop failed, retrying in %.1fs: %s", WORKER_ERROR_BACKOFF, e)
+                self._stopping.wait(WORKER_ERROR_BACKOFF)
+
+        self._executor.shutdown(wait=True)
+        logger.info("Task worker stopped")
+
+    def _poll(self, last_reap):
+        """Take one job off the queue if a slot is free; returns when stale jobs were last requeued."""
+        now = time.time()
+        _PROMOTE_DELAYED_SCRIPT(keys=[DELAYED_KEY, QUEUE_KEY], args=[now])
+        if now - last_reap > TASK_VISIBILITY_TIMEOUT / 2:
+            requeue_stale_jobs()
+            last_reap = now
+
+        # Bound the number of jobs in flight before taking another one
+        if not self._slots.acquire(timeout=1):
+            return last_reap
+        submitted = False
+        try:
+            raw_job = redis_client.brpoplpush(QUEUE_KEY, PROCESSING_KEY, timeout=1)
+            if raw_job is not None:
+                self._executor.submit(self._process, raw_job)
+                submitted = True
+        finally:
+            # _process releases the slot once the job is done
+            if not submitted:
+                self._slots.release()
+        return last_reap
+
+    def _process(self, raw_job):
+        try:
+            try:
+                job = json.loads(raw_job)
+                job_id = job["id"]
+            except (ValueError, TypeError, KeyError) as e:
+                # It can never run; keep it for inspection instead of requeueing it forever
+                logger.error("Moving unreadable task to the dead-letter list: %s", e)
+                pipe = redis_client.pipeline()
+                pipe.lpush(DEAD_LETTER_KEY, raw_job)
+                pipe.lrem(PROCESSING_KEY, 1, raw_job)
+                pipe.execute()
+                return
+
+            redis_client.hset(STARTED_KEY, job_id, time.time())
+            self._run_job(job)
+            pipe = redis_client.pipeline()
+            pipe.lrem(PROCESSING_KEY, 1, raw_job)
+            pipe.hdel(STARTED_KEY, job_id)
+            pipe.execute()
+        except Exception as e:
+            # The job stays on the processing list and is requeued after its visibility timeout
+            logger.error("Failed to record the outcome of a task: %s", e)
+        finally:
+            self._slots.release()
+
+    def _run_job(self, job):
+        try:
+            handler = _handlers.get(job.get("name"))
+            if handler is None:
+                raise LookupError(f"No handler registered for task {job.get('name')}")
+            handler(**job["kwargs"])
+        except Exception as e:
+            job["attempts"] = job.get("attempts", 0) + 1
+            job["last_error"] = str(e)
+            if job["attempts"] >= TASK_MAX_ATTEMPTS:
+                logger.error("Task %s (%s) failed permanently: %s", job.get("name"), job["id"], e)
+                redis_client.lpush(DEAD_LETTER_KEY, json.dumps(job))
+            else:
+                delay = retry_delay(job["attempts"])
+                logger.warning("Task %s (%s) failed, retrying in %.1fs: %s", job.get("name"), job["id"], delay, e)
+                redis_client.zadd(DELAYED_KEY, {json.dumps(job): time.time() + delay})
+
+
+def run_worker(concurrency=WORKER_CONCURRENCY):
+    worker = Worker(concurrency)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run()
@@ -0,0 +1,112 @@
+import os
+import json
+import logging
+from conversation_logger import log_conversation, insert_conversations, conversation_row
+from conversation_memory import summarize_conversation
+from response_quality_evaluator import evaluate_response_quality
+from stage_runner import Stage, run_stages
+from supabase_utils import supabase
+from task_queue import task, enqueue_many
+from metrics import timed, upstream_call
+from deadline import DEADLINE_EVALUATION_MIN, allows
+from bulk_writer import BulkWriter, BULK_WRITES_ENABLED
+
+logger = logging.getLogger(__name__)
+
+# Timeout in seconds for the inline response quality evaluation
+EVALUATION_TIMEOUT = float(os.environ.get("EVALUATION_TIMEOUT", "30"))
+
+
+def build_run_record(run_id: str, timestamp: str, input_text: str, search_quality: dict, model_output: str, response_quality_scores: dict) -> dict:
+    return {
+        "run_id": run_id,
+        "timestamp": timestamp,
+        "input_text": input_text,
+        "search_quality_reflection": search_quality,
+        "model_output": model_output,
+        "response_quality_scores": json.dumps(response_quality_scores)
+    }
+
+
+@task("evaluate_search_run")
+def evaluate_search_run(run_id: str, timestamp: str, input_text: str, search_quality: dict, model_output: str):
+    """
+    Score a search run and queue its writes as separate jobs.
+
+    The writes are queued individually so a failed insert is retried on its
+    own without evaluating the response again.
+    """
+    try:
+        response_quality_scores = evaluate_response_quality(input_text, model_output)
+    except Exception as e:
+        logger.error(f"Failed to evaluate response quality: {str(e)}")
+        response_quality_scores = None
+
+    # Queued together, so a retry after a failure here cannot log the conversation twice
+    enqueue_many([
+        ("log_conversation", {"input_text": input_text, "model_output": model_output,
+                              "response_quality_scores": response_quality_scores}),
+        ("store_run", {"run": build_run_record(run_id, timestamp, input_text, search_quality, model_output,
+                                               response_quality_scores)}),
+    ])
+
+
+@task("log_conversation")
+def log_conversation_task(input_text: str, model_output: str, response_quality_scores: dict):
+    # Written directly so the job only leaves the queue once the row is in the table
+    insert_conversations([conversation_row(input_text, model_output, response_quality_scores)])
+
+
+@task("summarize_conversation")
+def summarize_conversation_task(user_id: str):
+    # A failed summary raises so the job is retried; the unsummarized turns stay in the history meanwhile
+    summarize_conversation(user_id)
+
+
+def insert_runs(runs: list):
+    # Supabase takes a list of rows as one bulk insert; a run written again by a
+    # retried job or a replayed batch is skipped rather than failing the batch
+    with timed("supabase_insert"), upstream_call("supabase", "runs", "store_run"):
+        supabase.table("runs").upsert(runs, on_conflict="run_id", ignore_duplicates=True).execute()
+
+
+run_writer = BulkWriter("runs", insert_runs)
+
+
+@task("store_run")
+def store_run_task(run: dict):
+    # Written directly so the job only leaves the queue once the run is stored
+    insert_runs([run])
+
+
+def store_run(run: dict):
+    try:
+        if BULK_WRITES_ENABLED:
+            run_writer.add(run)
+        else:
+            insert_runs([run])
+    except Exception as e:
+        logger.error(f"Failed to store run in the database: {str(e)}")
+
+
+def persist_search_run_inline(run_id: str, timestamp: str, input_text: str, search_quality: dict, model_output: str, stage_report=None):
+    """
+    Evaluate and store a search run on the calling thread.
+
+    The evaluation is skipped, and the run stored without scores, when the
+    request has less than DEADLINE_EVALUATION_MIN seconds left.
+    """
+    response_quality_scores = None
+    if allows("response_quality_evaluation", DEADLINE_EVALUATION_MIN):
+        # Falls back to None if score evaluation fails
+        response_quality_scores = run_stages([
+            Stage("evaluate_response_quality", evaluate_response_quality, input_text, model_output,
+                  timeout=EVALUATION_TIMEOUT),
+        ], stage_report)["evaluate_response_quality"]
+
+    # Log the conversation and store the run; these writes do not depend on each other
+    run_stages([
+        Stage("log_conversation", log_conversation, input_text, model_output, response_quality_scores),
+        Stage("store_run", store_run, build_run_record(run_id, timestamp, input_text, search_quality, model_output,
+                                                       response_quality_scores)),
+    ], stage_report)
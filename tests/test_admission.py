@@ -0,0 +1,130 @@
+import unittest
+import sys
+import os
+import time
+import asyncio
+import threading
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from unittest.mock import patch
+from admission import AdmissionController, AdmissionRejected, estimate_cost, ADMISSION_MAX_IN_FLIGHT
+from pipeline import BATCH_CONCURRENCY
+from stage_runner import Stage, run_stages
+
+class AdmissionTestCase(unittest.TestCase):
+    def wait_until(self, condition, timeout=2):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.005)
+        self.assertTrue(condition())
+
+    def test_estimate_cost(self):
+        print("Running test: test_estimate_cost")
+        self.assertLess(estimate_cost(["conversation"]), estimate_cost(["search"]))
+        self.assertEqual(estimate_cost([None]), estimate_cost(["search"]))
+        self.assertEqual(estimate_cost(["search", "search"]), 2 * estimate_cost(["search"]))
+        print("Test passed: test_estimate_cost")
+
+    def test_token_limit_and_tier_priority(self):
+        print("Running test: test_token_limit_and_tier_priority")
+        controller = AdmissionController(max_in_flight=4, max_tokens_in_flight=10, queue_size=4, max_wait=5)
+        first = controller.acquire("default", 8)
+        admitted = []
+
+        def request(tier, cost):
+            ticket = controller.acquire(tier, cost)
+            admitted.append(tier)
+            controller.release(ticket)
+
+        with patch("admission.ADMISSION_TIER_PRIORITY", {"default": 1, "partner": 0}):
+            # Each costs more than half the limit, so they run one after the other
+            threads = [threading.Thread(target=request, args=("default", 6))]
+            threads[0].start()
+            self.wait_until(lambda: controller.stats()["waiting"] == 1)
+            threads.append(threading.Thread(target=request, args=("partner", 6)))
+            threads[1].start()
+            self.wait_until(lambda: controller.stats()["waiting"] == 2)
+
+            # Neither fits beside the first request's 8 tokens; the partner tier goes first once it is done
+            controller.release(first)
+            for thread in threads:
+                thread.join(2)
+        self.assertEqual(admitted, ["partner", "default"])
+        self.assertEqual(controller.stats()["in_flight"], 0)
+
+        # A request over the token limit still runs on its own
+        controller.release(controller.acquire("default", 50))
+        print("Test passed: test_token_limit_and_tier_priority")
+
+    def test_admitted_requests_do_not_wait_for_stage_threads(self):
+        print("Running test: test_admitted_requests_do_not_wait_for_stage_threads")
+        controller = AdmissionController(max_in_flight=ADMISSION_MAX_IN_FLIGHT, max_tokens_in_flight=100,
+                                         queue_size=0, max_wait=1)
+        # Every admitted request, plus the queries of a batch, runs a two-stage group at once
+        groups = ADMISSION_MAX_IN_FLIGHT + BATCH_CONCURRENCY
+        tickets = [controller.acquire("default", 1) for _ in range(ADMISSION_MAX_IN_FLIGHT)]
+        with self.assertRaises(AdmissionRejected):
+            controller.acquire("default", 1)
+
+        start = threading.Barrier(groups)
+        errors = []
+
+        def request():
+            start.wait()
+            try:
+                # A stage that had to wait for a thread would run past its timeout
+                run_stages([Stage("first", time.sleep, 0.3, timeout=0.5, required=True),
+                            Stage("second", time.sleep, 0.3, timeout=0.5, required=True)])
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=request) for _ in range(groups)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        for ticket in tickets:
+            controller.release(ticket)
+        self.assertEqual(errors, [])
+        print("Test passed: test_admitted_requests_do_not_wait_for_stage_threads")
+
+    def test_rejects_with_retry_after(self):
+        print("Running test: test_rejects_with_retry_after")
+        controller = AdmissionController(max_in_flight=1, max_tokens_in_flight=100, queue_size=1, max_wait=0.1)
+        ticket = controller.acquire("default", 1)
+
+        # Waiting behind a 5 second request would take longer than max_wait
+        with self.assertRaises(AdmissionRejected) as rejected:
+            controller.acquire("default", 1)
+        self.assertEqual(rejected.exception.reason, "wait")
+        self.assertGreaterEqual(rejected.exception.retry_after, 1)
+
+        # With a short service time it waits, and is refused once max_wait has passed
+        controller.service_seconds = 0.01
+        start = time.monotonic()
+        with self.assertRaises(AdmissionRejected) as rejected:
+            controller.acquire("default", 1)
+        self.assertEqual(rejected.exception.reason, "timeout")
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+        self.assertEqual(controller.stats()["waiting"], 0)
+        controller.release(ticket)
+        print("Test passed: test_rejects_with_retry_after")
+
+    def test_acquire_async(self):
+        print("Running test: test_acquire_async")
+        controller = AdmissionController(max_in_flight=1, max_tokens_in_flight=100, queue_size=2, max_wait=2)
+        controller.service_seconds = 0.01
+
+        async def scenario():
+            first = await controller.acquire_async("default", 1)
+            waiting = asyncio.ensure_future(controller.acquire_async("default", 1))
+            await asyncio.sleep(0.01)
+            self.assertFalse(waiting.done())
+            controller.release(first)
+            controller.release(await waiting)
+
+        asyncio.run(scenario())
+        self.assertEqual(controller.stats()["in_flight"], 0)
+        print("Test passed: test_acquire_async")
+
+if __name__ == "__main__":
+    unittest.main()
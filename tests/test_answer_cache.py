@@ -0,0 +1,73 @@
+import unittest
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from unittest.mock import patch
+import answer_cache
+from answer_cache import AnswerIndex, get_answer, put_answer, clear_answer_cache
+from pipeline import build_search_response, search_answer, cached_search_response
+
+class AnswerIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.index = AnswerIndex(size=2, ttl=60, dimensions=2048)
+
+    def test_exact_and_semantic_hits(self):
+        print("Running test: test_exact_and_semantic_hits")
+        self.index.put("Tell me about the Stonewall riots", "answer")
+        self.assertEqual(self.index.get("tell me about the stonewall riots?", 0.85), ("answer", "exact"))
+        self.assertEqual(self.index.get("tell me about the stonewall riot", 0.85), ("answer", "semantic"))
+        self.assertEqual(self.index.get("what is gender identity", 0.85), (None, None))
+        print("Test passed: test_exact_and_semantic_hits")
+
+    def test_different_key_terms_never_match(self):
+        print("Running test: test_different_key_terms_never_match")
+        self.index.put("what is the history of lesbian activism in the 1970s", "1970s")
+        # Nearly every character n-gram is shared, but the decade differs
+        self.assertEqual(self.index.get("what is the history of lesbian activism in the 1990s", 0.5), (None, None))
+        self.assertEqual(self.index.get("what is the history of gay activism in the 1970s", 0.5), (None, None))
+        self.assertEqual(self.index.get("tell me the history of lesbian activism in the 1970s", 0.85),
+                         ("1970s", "semantic"))
+        print("Test passed: test_different_key_terms_never_match")
+
+    def test_semantic_matching_off_by_default(self):
+        print("Running test: test_semantic_matching_off_by_default")
+        self.assertFalse(answer_cache.ANSWER_CACHE_SEMANTIC)
+        clear_answer_cache()
+        self.addCleanup(clear_answer_cache)
+        put_answer("search", "Tell me about the Stonewall riots", "answer", "/test")
+        self.assertEqual(get_answer("search", "tell me about the stonewall riots?", "/test"), "answer")
+        self.assertIsNone(get_answer("search", "tell me about the stonewall riot", "/test"))
+        print("Test passed: test_semantic_matching_off_by_default")
+
+    def test_least_recently_used_evicted(self):
+        print("Running test: test_least_recently_used_evicted")
+        self.index.put("history of pride month", "pride")
+        self.index.put("what is gender identity", "identity")
+        self.index.get("history of pride month", 0.85)
+        self.index.put("queer literature of the 1920s", "literature")
+        self.assertEqual(len(self.index), 2)
+        self.assertEqual(self.index.get("what is gender identity", 0.85), (None, None))
+        self.assertEqual(self.index.get("history of pride month", 0.85), ("pride", "exact"))
+        print("Test passed: test_least_recently_used_evicted")
+
+    def test_expired_entries_not_returned(self):
+        print("Running test: test_expired_entries_not_returned")
+        self.index.put("history of pride month", "pride")
+        with patch("answer_cache.time.monotonic", return_value=10 ** 9):
+            self.assertEqual(self.index.get("history of pride month", 0.85), (None, None))
+            self.assertEqual(self.index.get("history of pride months", 0.85), (None, None))
+        print("Test passed: test_expired_entries_not_returned")
+
+    def test_cached_response_points_at_stored_run(self):
+        print("Running test: test_cached_response_points_at_stored_run")
+        response_data = build_search_response("first question", [], {"search_quality_reflection": None,
+                                                                     "search_quality_score": None}, "answer")
+        cached = cached_search_response("First question?", search_answer(response_data))
+        self.assertEqual(cached["run_id"], response_data["run_id"])
+        self.assertEqual(cached["timestamp"], response_data["timestamp"])
+        self.assertEqual(cached["input_text"], "First question?")
+        self.assertTrue(cached["cached"])
+        print("Test passed: test_cached_response_points_at_stored_run")
+
+if __name__ == "__main__":
+    unittest.main()
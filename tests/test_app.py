@@ -1,9 +1,13 @@
 import unittest
 import sys
 import os
+import time
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from app import app
-from unittest.mock import patch
+import api_key_cache
+from unittest.mock import patch, MagicMock
+from deadline import current_deadline
+from pipeline import build_search_response, NO_SEARCH_QUALITY
 
 class BayardTestCase(unittest.TestCase):
     def setUp(self):
@@ -18,24 +22,27 @@ class BayardTestCase(unittest.TestCase):
 
     def test_generate_api_key(self):
         print("Running test: test_generate_api_key")
-        with patch("app.supabase.table") as mock_table:
-            mock_table.return_value.insert.return_value.execute.return_value = True
+        with patch("app.get_cursor") as mock_get_cursor:
+            mock_cursor = mock_get_cursor.return_value.__enter__.return_value
+            mock_cursor.rowcount = 1
             response = self.app.get("/api/generate-key")
             self.assertEqual(response.status_code, 200)
             self.assertIn("api_key", response.json)
+            mock_cursor.execute.assert_called_once_with("INSERT INTO keys (api_key) VALUES (%s)",
+                                                        (response.json["api_key"],))
         print("Test passed: test_generate_api_key")
 
     def test_bayard_api_missing_input(self):
         print("Running test: test_bayard_api_missing_input")
-        response = self.app.post("/api/bayard", json={})
-        self.assertEqual(response.status_code, 400)
-        self.assertEqual(response.json["error"], "Input text is required")
+        with patch("app.get_api_key_tier", return_value="default"), patch("app.rate_limit", return_value=True):
+            response = self.app.post("/api/bayard", json={}, headers={"X-API-Key": "valid_key"})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json["error"], "Input text is required")
         print("Test passed: test_bayard_api_missing_input")
 
     def test_bayard_api_invalid_api_key(self):
         print("Running test: test_bayard_api_invalid_api_key")
-        with patch("app.supabase.table") as mock_table:
-            mock_table.return_value.select.return_value.ilike.return_value.execute.return_value.data = []
+        with patch("app.get_api_key_tier", return_value=None):
             response = self.app.post("/api/bayard", json={"input_text": "test"}, headers={"X-API-Key": "invalid_key"})
             self.assertEqual(response.status_code, 401)
             self.assertEqual(response.json["error"], "Invalid API key")
@@ -43,12 +50,121 @@ class BayardTestCase(unittest.TestCase):
 
     def test_bayard_api_rate_limit_exceeded(self):
         print("Running test: test_bayard_api_rate_limit_exceeded")
-        with patch("app.rate_limit") as mock_rate_limit:
+        with patch("app.get_api_key_tier", return_value="default"), patch("app.rate_limit") as mock_rate_limit:
             mock_rate_limit.return_value = False
             response = self.app.post("/api/bayard", json={"input_text": "test"}, headers={"X-API-Key": "valid_key"})
             self.assertEqual(response.status_code, 429)
             self.assertEqual(response.json["error"], "Rate limit exceeded")
         print("Test passed: test_bayard_api_rate_limit_exceeded")
 
+    def test_bayard_batch_counts_each_query(self):
+        print("Running test: test_bayard_batch_counts_each_query")
+        with patch("app.get_api_key_tier") as mock_tier, patch("app.rate_limit") as mock_rate_limit:
+            mock_tier.return_value = "default"
+            mock_rate_limit.return_value = False
+            response = self.app.post("/api/bayard/batch", json={"queries": ["a", "b", "c"]},
+                                     headers={"X-API-Key": "valid_key"})
+            self.assertEqual(response.status_code, 429)
+            mock_rate_limit.assert_called_once_with("valid_key", 3)
+        print("Test passed: test_bayard_batch_counts_each_query")
+
+    def test_batch_queries_get_their_own_deadline(self):
+        print("Running test: test_batch_queries_get_their_own_deadline")
+        remaining = []
+
+        def slow_answer(input_text, search_results, conversation_memory, stage_report):
+            time.sleep(0.4)
+            remaining.append(current_deadline().remaining())
+            return build_search_response(input_text, search_results, NO_SEARCH_QUALITY, "answer"), NO_SEARCH_QUALITY
+
+        retriever = MagicMock()
+        retriever.search_batch.return_value = [[], [], []]
+        with patch("app.get_api_key_tier", return_value="default"), patch("app.rate_limit", return_value=True), \
+                patch("app.classify_queries", return_value=["search"] * 3), patch("app.get_answer", return_value=None), \
+                patch("app.retriever", retriever), patch("app.answer_search_query", side_effect=slow_answer), \
+                patch("app.store_search_run"), patch("app.put_answer"), patch("app.BATCH_CONCURRENCY", 1):
+            # Together the queries take longer than the one second budget
+            response = self.app.post("/api/bayard/batch", json={"queries": ["a", "b", "c"]},
+                                     headers={"X-API-Key": "valid_key", "X-Request-Timeout": "1"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result["model_output"] for result in response.get_json()["results"]], ["answer"] * 3)
+        self.assertEqual(len(remaining), 3)
+        self.assertGreater(min(remaining), 0.4)
+        print("Test passed: test_batch_queries_get_their_own_deadline")
+
+    def test_stream_joins_search_quality_once(self):
+        print("Running test: test_stream_joins_search_quality_once")
+        search_quality = {"search_quality_reflection": "relevant", "search_quality_score": 4}
+        with patch("app.get_api_key_tier", return_value="default"), patch("app.rate_limit", return_value=True), \
+                patch("app.get_conversation_memory", return_value={}), patch("app.classify_query", return_value="search"), \
+                patch("app.get_answer", return_value=None), patch("app.retriever") as retriever, \
+                patch("app.assess_search_quality", return_value=search_quality), \
+                patch("app.generate_model_output_stream", return_value=iter(["an ", "answer"])), \
+                patch("app.persist_search_run") as persist, patch("app.put_answer"), \
+                patch("stage_runner.record_stage") as record_stage:
+            retriever.search.return_value = []
+            response = self.app.post("/api/bayard/stream", json={"input_text": "stonewall riots"},
+                                     headers={"X-API-Key": "valid_key"})
+            body = response.get_data(as_text=True)
+        self.assertIn("event: done", body)
+        stages = [call.args[0] for call in record_stage.call_args_list]
+        self.assertEqual(stages.count("search_quality_reflection"), 1)
+        self.assertEqual(persist.call_args.args[4], search_quality)
+        print("Test passed: test_stream_joins_search_quality_once")
+
+    def test_revoke_key_only_revokes_supplied_keys(self):
+        print("Running test: test_revoke_key_only_revokes_supplied_keys")
+        with patch("app.get_api_key_tier") as mock_tier, patch("app.rate_limit") as mock_rate_limit, \
+                patch("app.revoke_api_key") as mock_revoke:
+            mock_tier.return_value = "default"
+            mock_rate_limit.return_value = True
+            mock_revoke.return_value = True
+            with patch.dict(os.environ, {"BAYARD_API_KEY": "server_key"}):
+                response = self.app.post("/api/revoke-key")
+            self.assertEqual(response.status_code, 403)
+            mock_revoke.assert_not_called()
+
+            with patch.dict(os.environ):
+                os.environ.pop("BAYARD_API_KEY", None)
+                response = self.app.post("/api/revoke-key", headers={"X-API-Key": "caller_key"})
+            self.assertEqual(response.status_code, 200)
+            mock_revoke.assert_called_once_with("caller_key")
+        print("Test passed: test_revoke_key_only_revokes_supplied_keys")
+
+    def test_oversized_batch_is_refused(self):
+        print("Running test: test_oversized_batch_is_refused")
+        with patch("app.get_api_key_tier", return_value="default"), patch("app.rate_limit") as mock_rate_limit, \
+                patch("rate_limiter.RATE_LIMIT_TIERS", {"default": {"limit": 2, "period": 60}}):
+            response = self.app.post("/api/bayard/batch", json={"queries": ["a", "b", "c"]},
+                                     headers={"X-API-Key": "valid_key"})
+            self.assertEqual(response.status_code, 400)
+            mock_rate_limit.assert_not_called()
+        print("Test passed: test_oversized_batch_is_refused")
+
+    def test_api_key_cache_hits_database_once(self):
+        print("Running test: test_api_key_cache_hits_database_once")
+        with patch("api_key_cache.redis_client") as mock_redis, \
+                patch("api_key_cache.lookup_api_key_in_database") as mock_lookup:
+            mock_redis.get.return_value = None
+            mock_lookup.return_value = True
+            self.assertTrue(api_key_cache.is_valid_api_key("cached_key"))
+            self.assertTrue(api_key_cache.is_valid_api_key("cached_key"))
+            self.assertEqual(mock_lookup.call_count, 1)
+
+            api_key_cache.invalidate_api_key("cached_key")
+            mock_redis.get.return_value = b"0"
+            self.assertFalse(api_key_cache.is_valid_api_key("cached_key"))
+            self.assertEqual(mock_lookup.call_count, 1)
+        print("Test passed: test_api_key_cache_hits_database_once")
+
+    def test_revoke_succeeds_when_redis_fails(self):
+        print("Running test: test_revoke_succeeds_when_redis_fails")
+        with patch("api_key_cache.redis_client") as mock_redis, patch("api_key_cache.get_cursor") as mock_cursor:
+            mock_cursor.return_value.__enter__.return_value.rowcount = 1
+            mock_redis.set.side_effect = ConnectionError("redis unavailable")
+            self.assertTrue(api_key_cache.revoke_api_key("revoked_key"))
+            mock_redis.set.assert_called_once()
+        print("Test passed: test_revoke_succeeds_when_redis_fails")
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
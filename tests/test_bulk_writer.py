@@ -0,0 +1,123 @@
+import unittest
+import sys
+import os
+import json
+import time
+import threading
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from unittest.mock import patch, MagicMock
+import bulk_writer
+from bulk_writer import BulkWriter
+
+class RecordingTable:
+    def __init__(self, failures=0):
+        self.batches = []
+        self.failures = failures
+        self.lock = threading.Lock()
+
+    def write_rows(self, rows):
+        with self.lock:
+            if self.failures:
+                self.failures -= 1
+                raise ConnectionError("database unavailable")
+            self.batches.append(list(rows))
+
+class BulkWriterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.redis = MagicMock()
+        patcher = patch("bulk_writer.redis_client", self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_writer(self, table, **kwargs):
+        writer = BulkWriter("test", table.write_rows, **kwargs)
+        self.addCleanup(bulk_writer._writers.remove, writer)
+        return writer
+
+    def test_batches_by_size_and_age(self):
+        print("Running test: test_batches_by_size_and_age")
+        table = RecordingTable()
+        writer = self.make_writer(table, batch_size=3, max_age=0.2)
+        for row in range(7):
+            writer.add([row])
+        time.sleep(0.5)
+        self.assertEqual(table.batches, [[[0], [1], [2]], [[3], [4], [5]], [[6]]])
+        writer.close()
+        print("Test passed: test_batches_by_size_and_age")
+
+    def test_close_drains_buffer(self):
+        print("Running test: test_close_drains_buffer")
+        table = RecordingTable()
+        writer = self.make_writer(table, batch_size=100, max_age=60)
+        for row in range(5):
+            writer.add({"run_id": row})
+        writer.close()
+        self.assertEqual(sum(len(batch) for batch in table.batches), 5)
+        self.assertEqual(writer.pending(), 0)
+        print("Test passed: test_close_drains_buffer")
+
+    def test_failed_batch_spills_to_redis_and_replays(self):
+        print("Running test: test_failed_batch_spills_to_redis_and_replays")
+        table = RecordingTable(failures=10)
+        writer = self.make_writer(table, batch_size=2, max_age=60)
+        with patch("bulk_writer.BULK_WRITER_RETRIES", 1), patch("bulk_writer.BULK_WRITER_RETRY_DELAY", 0):
+            writer.add(["a"])
+            writer.add(["b"])
+            writer.close()
+        self.assertEqual(table.batches, [])
+        self.redis.rpush.assert_called_once_with("bayard:bulk:test", json.dumps(["a"]), json.dumps(["b"]))
+
+        # Once the database is back the spilled rows are written and removed
+        table.failures = 0
+        self.redis.exists.return_value = True
+        self.redis.set.return_value = True
+        self.redis.lrange.side_effect = [[json.dumps(["a"]), json.dumps(["b"])], []]
+        self.assertEqual(writer.replay_spilled(), 2)
+        self.assertEqual(table.batches, [[["a"], ["b"]]])
+        self.redis.ltrim.assert_called_once_with("bayard:bulk:test", 2, -1)
+        print("Test passed: test_failed_batch_spills_to_redis_and_replays")
+
+    def test_failing_replay_moves_batch_to_dead_letter(self):
+        print("Running test: test_failing_replay_moves_batch_to_dead_letter")
+        table = RecordingTable(failures=100)
+        writer = self.make_writer(table, batch_size=2, max_age=60)
+        entries = [json.dumps(["a"]), json.dumps(["b"])]
+        self.redis.exists.return_value = True
+        self.redis.set.return_value = True
+        self.redis.lrange.return_value = entries
+        pipe = self.redis.pipeline.return_value
+        with patch("bulk_writer.BULK_WRITER_REPLAY_ATTEMPTS", 3):
+            # The first failures leave the batch at the head of the spill list
+            for attempts in (1, 2):
+                self.redis.incr.return_value = attempts
+                self.assertEqual(writer.replay_spilled(), 0)
+            pipe.rpush.assert_not_called()
+
+            self.redis.incr.return_value = 3
+            self.assertEqual(writer.replay_spilled(), 0)
+        pipe.rpush.assert_called_once_with("bayard:bulk:test:dead", *entries)
+        pipe.ltrim.assert_called_once_with("bayard:bulk:test", 2, -1)
+        self.redis.ltrim.assert_not_called()
+        writer.close()
+        print("Test passed: test_failing_replay_moves_batch_to_dead_letter")
+
+    def test_full_buffer_spills_instead_of_blocking(self):
+        print("Running test: test_full_buffer_spills_instead_of_blocking")
+        table = RecordingTable()
+        writer = self.make_writer(table, batch_size=100, max_age=60, max_rows=2)
+        with patch("bulk_writer.BULK_WRITER_PUT_TIMEOUT", 0.05):
+            for row in range(3):
+                writer.add([row])
+        self.assertEqual(writer.pending(), 2)
+        self.redis.rpush.assert_called_once_with("bayard:bulk:test", json.dumps([2]))
+
+        # Without Redis the row is written directly
+        self.redis.rpush.side_effect = ConnectionError("redis unavailable")
+        with patch("bulk_writer.BULK_WRITER_PUT_TIMEOUT", 0.05):
+            writer.add([3])
+        self.assertEqual(table.batches, [[[3]]])
+        writer.close()
+        print("Test passed: test_full_buffer_spills_instead_of_blocking")
+
+if __name__ == "__main__":
+    unittest.main()
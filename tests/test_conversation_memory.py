@@ -0,0 +1,87 @@
+import unittest
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from unittest.mock import patch, MagicMock
+from conversation_history import encode_turn
+from conversation_memory import select_recent_turns, summarize_conversation, turn_tokens
+from openai_utils import build_conversation_messages
+from prompt_builder import count_tokens
+
+def make_turn(number, words=50):
+    return {"input_text": f"Question {number}", "model_output": " ".join(["answer"] * words)}
+
+class ConversationMemoryTestCase(unittest.TestCase):
+    def test_select_recent_turns(self):
+        print("Running test: test_select_recent_turns")
+        turns = [make_turn(1), make_turn(2), make_turn(3)]
+        budget = turn_tokens(turns[1]) + turn_tokens(turns[2])
+        self.assertEqual(select_recent_turns(turns, budget), turns[1:])
+        self.assertEqual(select_recent_turns([], budget), [])
+
+        # The newest turn is kept even when it does not fit, with its answer shortened
+        long_turn = make_turn(4, words=2000)
+        kept = select_recent_turns(turns + [long_turn], 100)
+        self.assertEqual(len(kept), 1)
+        self.assertEqual(kept[0]["input_text"], "Question 4")
+        self.assertLessEqual(count_tokens(kept[0]["model_output"]), 100)
+        print("Test passed: test_select_recent_turns")
+
+    def test_memory_messages(self):
+        print("Running test: test_memory_messages")
+        memory = {"summary": "The user is researching Stonewall.", "turns": [make_turn(1, words=3)]}
+        messages = build_conversation_messages("What happened next?", memory)
+        self.assertEqual([message["role"] for message in messages], ["system", "system", "user", "assistant", "user"])
+        self.assertIn("researching Stonewall", messages[1]["content"])
+        self.assertEqual(messages[2]["content"], "Question 1")
+        self.assertEqual(len(build_conversation_messages("Hello", None)), 2)
+        print("Test passed: test_memory_messages")
+
+    def test_summarize_conversation_folds_old_turns(self):
+        print("Running test: test_summarize_conversation_folds_old_turns")
+        turns = [make_turn(number, words=600) for number in range(1, 6)]
+        redis = MagicMock()
+        redis.set.return_value = True
+        read_pipe, write_pipe = MagicMock(), MagicMock()
+        read_pipe.execute.return_value = [b"Earlier summary.", [encode_turn(t["input_text"], t["model_output"]) for t in turns]]
+        redis.pipeline.side_effect = [read_pipe, write_pipe]
+
+        with patch("conversation_memory.redis_client", redis), \
+             patch("conversation_memory._RELEASE_LOCK_SCRIPT") as release, \
+             patch("openai_utils.generate_conversation_summary", return_value="New summary.") as summarize:
+            folded = summarize_conversation("user-1")
+
+        # Everything before the turns a prompt gets verbatim is folded
+        kept = len(select_recent_turns(turns))
+        self.assertLess(kept, 3)
+        self.assertEqual(folded, len(turns) - kept)
+        self.assertEqual(summarize.call_args[0][0], "Earlier summary.")
+        self.assertEqual(summarize.call_args[0][1], turns[:folded])
+        write_pipe.set.assert_called_once()
+        self.assertEqual(write_pipe.set.call_args[0][1], "New summary.")
+        write_pipe.ltrim.assert_called_once_with("conversation_history:user-1", folded, -1)
+        release.assert_called_once()
+        print("Test passed: test_summarize_conversation_folds_old_turns")
+
+    def test_failed_summary_keeps_turns(self):
+        print("Running test: test_failed_summary_keeps_turns")
+        turns = [make_turn(number, words=600) for number in range(1, 5)]
+        redis = MagicMock()
+        redis.set.return_value = True
+        read_pipe = MagicMock()
+        read_pipe.execute.return_value = [None, [encode_turn(t["input_text"], t["model_output"]) for t in turns]]
+        redis.pipeline.side_effect = [read_pipe]
+
+        with patch("conversation_memory.redis_client", redis), \
+             patch("conversation_memory._RELEASE_LOCK_SCRIPT") as release, \
+             patch("openai_utils.generate_conversation_summary", side_effect=RuntimeError("openai down")):
+            with self.assertRaises(RuntimeError):
+                summarize_conversation("user-1")
+
+        # Nothing was written, and the lock was released for the next attempt
+        self.assertEqual(redis.pipeline.call_count, 1)
+        release.assert_called_once()
+        print("Test passed: test_failed_summary_keeps_turns")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import unittest
+import sys
+import os
+import threading
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from unittest.mock import patch, MagicMock
+import db
+
+class FakeConnection:
+    def __init__(self, broken=False):
+        self.closed = 0
+        self.broken = broken
+        self.commits = 0
+
+    def cursor(self):
+        cursor = MagicMock()
+        if self.broken:
+            cursor.__enter__.return_value.execute.side_effect = ConnectionError("server closed the connection")
+        return cursor
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+class FakePool:
+    """Hands out queued connections, then new healthy ones; closes what it is told to."""
+
+    def __init__(self, *args):
+        self.queue = []
+        self._used = {}
+        self._pool = []
+
+    def getconn(self):
+        conn = self.queue.pop(0) if self.queue else FakeConnection()
+        self._used[id(conn)] = conn
+        return conn
+
+    def putconn(self, conn, close=False):
+        self._used.pop(id(conn), None)
+        if close:
+            conn.close()
+        else:
+            self._pool.append(conn)
+
+    def closeall(self):
+        pass
+
+class ConnectionPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        patcher = patch("db.pg_pool.ThreadedConnectionPool", FakePool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        db._state = None
+        self.addCleanup(setattr, db, "_state", None)
+
+    def test_checkout_times_out_when_pool_is_exhausted(self):
+        print("Running test: test_checkout_times_out_when_pool_is_exhausted")
+        with patch("db.DB_POOL_MAX", 1), patch("db.DB_POOL_TIMEOUT", 0.05):
+            timeouts = db.get_pool_stats()["timeouts"]
+            with db.get_connection():
+                errors = []
+
+                def checkout():
+                    try:
+                        with db.get_connection():
+                            pass
+                    except db.PoolTimeoutError as e:
+                        errors.append(e)
+
+                thread = threading.Thread(target=checkout)
+                thread.start()
+                thread.join(2)
+            self.assertEqual(len(errors), 1)
+            self.assertEqual(db.get_pool_stats()["timeouts"], timeouts + 1)
+            # The slot is free again once the first checkout is returned
+            with db.get_connection():
+                pass
+        print("Test passed: test_checkout_times_out_when_pool_is_exhausted")
+
+    def test_new_pool_after_fork(self):
+        print("Running test: test_new_pool_after_fork")
+        parent = db._get_state()
+        with patch("db.os.getpid", return_value=parent.pid + 1):
+            child = db._get_state()
+        self.assertIsNot(child, parent)
+        self.assertEqual(child.pid, parent.pid + 1)
+        # The parent's connections are kept referenced, never closed from the child
+        self.assertIn(parent, db._inherited)
+        db._inherited.remove(parent)
+        print("Test passed: test_new_pool_after_fork")
+
+    def test_broken_connection_is_discarded(self):
+        print("Running test: test_broken_connection_is_discarded")
+        state = db._get_state()
+        broken = FakeConnection(broken=True)
+        state.pool.queue.append(broken)
+        # Idle long enough to be checked before it is handed out
+        state.last_used[id(broken)] = -db.DB_HEALTH_CHECK_INTERVAL
+        with db.get_connection() as conn:
+            self.assertIsNot(conn, broken)
+        self.assertTrue(broken.closed)
+        self.assertNotIn(id(broken), state.last_used)
+        self.assertEqual(conn.commits, 1)
+        self.assertEqual(state.last_used.keys(), {id(conn)})
+
+        # A connection that breaks while in use is closed on return and forgotten
+        with self.assertRaises(ConnectionError):
+            with db.get_connection() as conn:
+                conn.close()
+                raise ConnectionError("server closed the connection")
+        self.assertNotIn(id(conn), state.last_used)
+        print("Test passed: test_broken_connection_is_discarded")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+import sys
+import os
+import contextvars
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from unittest.mock import patch, MagicMock
+from deadline import (REQUEST_BUDGET, REQUEST_BUDGET_MAX, DEADLINE_MIN_DOCUMENTS, DEADLINE_MIN_MAX_TOKENS,
+                      parse_budget, start_deadline, budget_timeout, document_budget, token_budget, degraded,
+                      answer_degraded)
+from resilience import call
+from search_quality import assess_search_quality
+
+class UpstreamError(Exception):
+    status_code = 503
+
+class DeadlineTestCase(unittest.TestCase):
+    def run_in_request(self, func):
+        # Each test gets its own context, as each request does
+        return contextvars.copy_context().run(func)
+
+    def test_parse_budget(self):
+        print("Running test: test_parse_budget")
+        self.assertEqual(parse_budget("2.5"), 2.5)
+        self.assertEqual(parse_budget(None), REQUEST_BUDGET)
+        self.assertEqual(parse_budget("soon"), REQUEST_BUDGET)
+        self.assertEqual(parse_budget("-1"), REQUEST_BUDGET)
+        self.assertEqual(parse_budget("1e9"), REQUEST_BUDGET_MAX)
+        print("Test passed: test_parse_budget")
+
+    def test_generous_budget_degrades_nothing(self):
+        print("Running test: test_generous_budget_degrades_nothing")
+        def request():
+            start_deadline("120")
+            self.assertEqual(document_budget(10), 10)
+            self.assertEqual(token_budget(3000), 3000)
+            self.assertEqual(budget_timeout(5), 5)
+            return degraded()
+        self.assertEqual(self.run_in_request(request), [])
+        print("Test passed: test_generous_budget_degrades_nothing")
+
+    @patch("search_quality.SEARCH_QUALITY_MODE", "llm")
+    @patch("search_quality.generate_search_quality_reflection")
+    def test_short_budget_sheds_optional_work(self, reflection):
+        print("Running test: test_short_budget_sheds_optional_work")
+        def request():
+            start_deadline("2")
+            self.assertEqual(document_budget(10), DEADLINE_MIN_DOCUMENTS)
+            self.assertEqual(token_budget(3000), DEADLINE_MIN_MAX_TOKENS)
+            self.assertLessEqual(budget_timeout(5), 2)
+            search_quality = assess_search_quality([{"title": "Stonewall riots", "abstract": "", "_score": 12.0}],
+                                                   "stonewall riots")
+            self.assertIsNotNone(search_quality["search_quality_score"])
+            self.assertTrue(answer_degraded())
+            return degraded()
+        self.assertEqual(self.run_in_request(request), ["documents", "max_tokens", "search_quality_reflection"])
+        reflection.assert_not_called()
+        print("Test passed: test_short_budget_sheds_optional_work")
+
+    @patch("resilience.retry_delay", return_value=0.5)
+    def test_no_retry_past_deadline(self, _):
+        print("Running test: test_no_retry_past_deadline")
+        def request():
+            start_deadline("0.1")
+            flaky = MagicMock(side_effect=[UpstreamError(), "hits"])
+            with self.assertRaises(UpstreamError):
+                call("test-deadline", "index", "search", flaky, retries=2)
+            flaky.assert_called_once()
+        self.run_in_request(request)
+        print("Test passed: test_no_retry_past_deadline")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from unittest.mock import patch, MagicMock
+from lazy_client import LazyClient
+
+class LazyClientTestCase(unittest.TestCase):
+    def test_built_once_on_first_use(self):
+        print("Running test: test_built_once_on_first_use")
+        factory = MagicMock()
+        client = LazyClient("test", factory)
+        self.assertFalse(client._initialized)
+        factory.assert_not_called()
+        client.ping()
+        client.ping()
+        factory.assert_called_once()
+        self.assertEqual(factory.return_value.ping.call_count, 2)
+        # Client methods named like the proxy's own are forwarded too
+        client.get("key")
+        factory.return_value.get.assert_called_once_with("key")
+        print("Test passed: test_built_once_on_first_use")
+
+    def test_rebuilt_in_forked_process(self):
+        print("Running test: test_rebuilt_in_forked_process")
+        factory = MagicMock(side_effect=lambda: object())
+        client = LazyClient("test", factory)
+        parent_client = client._resolve()
+        with patch("lazy_client.os.getpid", return_value=os.getpid() + 1):
+            self.assertIsNot(client._resolve(), parent_client)
+        self.assertEqual(factory.call_count, 2)
+        print("Test passed: test_rebuilt_in_forked_process")
+
+    def test_attributes_can_be_patched(self):
+        print("Running test: test_attributes_can_be_patched")
+        client = LazyClient("test", MagicMock())
+        with patch.object(client, "table") as mock_table:
+            client.table("runs")
+            mock_table.assert_called_once_with("runs")
+        print("Test passed: test_attributes_can_be_patched")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from local_classifier import LocalQueryClassifier, normalize_query
+
+class LocalClassifierTestCase(unittest.TestCase):
+    def setUp(self):
+        self.classifier = LocalQueryClassifier.train(
+            [
+                "What are some important LGBTQIA+ historical events?",
+                "Tell me about the historical significance of the Stonewall Riots.",
+                "What legal protections do LGBTQIA+ individuals have?",
+                "What's the weather like today?",
+                "How do I fix a flat tire?",
+                "Can you explain how to bake a cake?",
+            ],
+            ["search", "search", "search", "conversation", "conversation", "conversation"],
+        )
+
+    def test_normalize_query(self):
+        print("Running test: test_normalize_query")
+        self.assertEqual(normalize_query("  What is   Pride Month?? "), "what is pride month")
+        print("Test passed: test_normalize_query")
+
+    def test_predict_labels_and_confidence(self):
+        print("Running test: test_predict_labels_and_confidence")
+        label, confidence = self.classifier.predict("LGBTQIA+ historical events and the Stonewall Riots")
+        self.assertEqual(label, "search")
+        self.assertGreater(confidence, 0.5)
+        label, confidence = self.classifier.predict("how do I bake bread today")
+        self.assertEqual(label, "conversation")
+        self.assertLessEqual(confidence, 1.0)
+        print("Test passed: test_predict_labels_and_confidence")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+import contextvars
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from unittest.mock import MagicMock
+from local_index import LocalIndex, build_snapshot
+from retrievers import FailoverRetriever, LocalRetriever
+from deadline import start_deadline, degraded
+
+DOCS = [
+    {"_id": "a", "title": "The Stonewall Riots", "abstract": "An account of the 1969 uprising in New York.",
+     "concepts": ["activism"], "authors": ["{'name': 'A. Author'}"], "content_embedding": {"stonewall": 2.5}},
+    {"_id": "b", "title": "The Stonewall Riots", "abstract": "A second printing of the same work, with a new preface and an index of names.",
+     "concepts": []},
+    {"_id": "c", "title": "Pride and Memory", "abstract": "Commemorations of Stonewall in later pride marches.",
+     "concepts": ["pride"]},
+    {"_id": "d", "title": "Workplace Equality", "abstract": "Transgender employees and anti-discrimination law.",
+     "concepts": ["law"]},
+]
+
+class LocalIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "snapshot")
+        build_snapshot(DOCS, self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_search_ranks_and_collapses_titles(self):
+        print("Running test: test_search_ranks_and_collapses_titles")
+        index = LocalIndex(self.path)
+        hits = index.search("stonewall riots", size=10)
+        self.assertEqual([hit["_id"] for hit in hits], ["a", "c"])
+        self.assertEqual(hits[0]["_source"]["authors"], ["{'name': 'A. Author'}"])
+        self.assertNotIn("content_embedding", hits[0]["_source"])
+        self.assertEqual(index.search("transgender law")[0]["_id"], "d")
+        self.assertEqual(index.search("nothing matches"), [])
+        index.close()
+        print("Test passed: test_search_ranks_and_collapses_titles")
+
+    def test_failover_to_local_index(self):
+        print("Running test: test_failover_to_local_index")
+        primary = MagicMock()
+        primary.name = "elasticsearch"
+        primary.search.return_value = None
+        primary.search_batch.return_value = [None, [{"title": "From Elasticsearch"}]]
+        retriever = FailoverRetriever(primary, LocalRetriever(self.path))
+
+        def request():
+            start_deadline()
+            results = retriever.search("stonewall")
+            batch = retriever.search_batch(["workplace equality", "pride"])
+            return results, batch, degraded()
+
+        results, batch, degraded_stages = contextvars.copy_context().run(request)
+        self.assertEqual(results[0]["title"], "The Stonewall Riots")
+        self.assertEqual(results[0]["_id"], "a")
+        self.assertEqual(batch[0][0]["title"], "Workplace Equality")
+        self.assertEqual(batch[1], [{"title": "From Elasticsearch"}])
+        self.assertEqual(degraded_stages, ["retriever"])
+
+        # Without a snapshot there is nothing to fail over to
+        missing = FailoverRetriever(primary, LocalRetriever(os.path.join(self.tmp, "missing")))
+        self.assertIsNone(missing.search("stonewall"))
+        print("Test passed: test_failover_to_local_index")
+
+if __name__ == "__main__":
+    unittest.main()
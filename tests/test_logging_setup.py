@@ -0,0 +1,50 @@
+import unittest
+import sys
+import os
+import queue
+import logging
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from unittest.mock import patch
+from logging_setup import RedactingFilter, PayloadSampler, BoundedQueueHandler, REDACTED
+from metrics import LOG_RECORDS_DROPPED
+
+def make_record(msg, *args, **extra):
+    record = logging.LogRecord("app", logging.INFO, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+class LoggingSetupTestCase(unittest.TestCase):
+    def test_secrets_redacted(self):
+        print("Running test: test_secrets_redacted")
+        record = make_record("Authorization: Bearer %s and api_key=%s", "abc.def", "s3cret", api_key="s3cret")
+        RedactingFilter().filter(record)
+        self.assertEqual(record.getMessage(), f"Authorization: Bearer {REDACTED} and api_key={REDACTED}")
+        self.assertEqual(record.api_key, REDACTED)
+        print("Test passed: test_secrets_redacted")
+
+    def test_payload_sampled_and_truncated(self):
+        print("Running test: test_payload_sampled_and_truncated")
+        with patch("logging_setup.LOG_PAYLOAD_SAMPLE_RATE", 0.0):
+            record = make_record("Answered", payload={"model_output": "x"})
+            PayloadSampler().filter(record)
+            self.assertFalse(hasattr(record, "payload"))
+        with patch("logging_setup.LOG_PAYLOAD_SAMPLE_RATE", 1.0), patch("logging_setup.LOG_PAYLOAD_MAX_CHARS", 20):
+            record = make_record("Answered", payload={"model_output": "x" * 100})
+            PayloadSampler().filter(record)
+            RedactingFilter().filter(record)
+            self.assertTrue(record.payload.startswith('{"model_output": "xx'))
+            self.assertTrue(record.payload.endswith("more chars]"))
+        print("Test passed: test_payload_sampled_and_truncated")
+
+    def test_full_queue_drops(self):
+        print("Running test: test_full_queue_drops")
+        handler = BoundedQueueHandler(queue.Queue(1))
+        dropped_before = LOG_RECORDS_DROPPED._value.get()
+        handler.handle(make_record("first"))
+        handler.handle(make_record("second"))
+        self.assertEqual(handler.queue.get_nowait().msg, "first")
+        self.assertEqual(LOG_RECORDS_DROPPED._value.get(), dropped_before + 1)
+        print("Test passed: test_full_queue_drops")
+
+if __name__ == "__main__":
+    unittest.main()
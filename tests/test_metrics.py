@@ -0,0 +1,40 @@
+import unittest
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from prometheus_client import REGISTRY
+from metrics import start_request_timing, timed, upstream_call, server_timing_header, render_metrics
+from stage_runner import Stage, run_stages
+
+class MetricsTestCase(unittest.TestCase):
+    def test_server_timing_sums_repeated_stages(self):
+        print("Running test: test_server_timing_sums_repeated_stages")
+        start_request_timing()
+        with timed("search_elasticsearch"):
+            pass
+        # Stages run on the pool report into the same request
+        run_stages([Stage("classify_query", lambda: "search"), Stage("classify_query_again", lambda: None)])
+        run_stages([Stage("classify_query", lambda: "search")])
+        header = server_timing_header(total=0.5)
+        names = [item.split(";")[0] for item in header.split(", ")]
+        self.assertEqual(names, ["search_elasticsearch", "classify_query", "classify_query_again", "total"])
+        self.assertIn("total;dur=500.0", header)
+        print("Test passed: test_server_timing_sums_repeated_stages")
+
+    def test_upstream_errors_counted(self):
+        print("Running test: test_upstream_errors_counted")
+        labels = {"upstream": "openai", "model": "test-model", "stage": "generate_model_output"}
+        errors_before = REGISTRY.get_sample_value("bayard_upstream_errors_total", labels) or 0
+        with upstream_call("openai", "test-model", "generate_model_output"):
+            pass
+        with self.assertRaises(ValueError):
+            with upstream_call("openai", "test-model", "generate_model_output"):
+                raise ValueError("upstream failed")
+        self.assertEqual(REGISTRY.get_sample_value("bayard_upstream_requests_total", labels), 2)
+        self.assertEqual(REGISTRY.get_sample_value("bayard_upstream_errors_total", labels), errors_before + 1)
+        body, _ = render_metrics()
+        self.assertIn(b'bayard_upstream_errors_total{model="test-model"', body)
+        print("Test passed: test_upstream_errors_counted")
+
+if __name__ == "__main__":
+    unittest.main()
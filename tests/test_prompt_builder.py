@@ -0,0 +1,45 @@
+import unittest
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from unittest.mock import patch
+import prompt_builder
+from prompt_builder import build_context, count_tokens
+
+class PromptBuilderTestCase(unittest.TestCase):
+    def setUp(self):
+        # Use the character estimate so the tests do not download a tiktoken encoding
+        patcher = patch("prompt_builder.get_encoding", return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.docs = [
+            {"_id": "low", "_score": 1.0, "title": "Low", "abstract": "word " * 1000},
+            {"_id": "high", "_score": 9.0, "title": "High", "abstract": "word " * 1000},
+        ]
+
+    def test_documents_packed_by_score_within_budget(self):
+        print("Running test: test_documents_packed_by_score_within_budget")
+        context, included = build_context("pride history", self.docs, budget=500)
+        self.assertEqual(included, 1)
+        self.assertIn("ID: high", context)
+        self.assertNotIn("ID: low", context)
+        self.assertLessEqual(count_tokens(context), 500)
+        print("Test passed: test_documents_packed_by_score_within_budget")
+
+    def test_abstracts_truncated(self):
+        print("Running test: test_abstracts_truncated")
+        context, included = build_context("pride history", self.docs, budget=10000)
+        self.assertEqual(included, 2)
+        self.assertLess(context.index("ID: high"), context.index("ID: low"))
+        self.assertLessEqual(count_tokens(context), 2 * (prompt_builder.PROMPT_MAX_ABSTRACT_TOKENS + 100))
+        print("Test passed: test_abstracts_truncated")
+
+    def test_no_documents(self):
+        print("Running test: test_no_documents")
+        context, included = build_context("hello", [], budget=1000)
+        self.assertEqual(included, 0)
+        self.assertIn(prompt_builder.NO_DOCUMENTS, context)
+        print("Test passed: test_no_documents")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from unittest.mock import patch
+import query_classifier
+from query_classifier import classify_queries, guess_query_types
+
+# Research questions asked conversationally, which the local model labels "conversation" with high confidence
+CONVERSATIONAL_RESEARCH_QUESTIONS = [
+    "what do you know about lesbian literature",
+    "can you explain what nonbinary means",
+    "how do I come out to my parents",
+    "what books should I read about queer history",
+]
+
+class QueryClassifierTestCase(unittest.TestCase):
+    def setUp(self):
+        query_classifier._classification_cache.clear()
+        self.addCleanup(query_classifier._classification_cache.clear)
+
+    def test_conversational_research_questions_are_not_skipped(self):
+        print("Running test: test_conversational_research_questions_are_not_skipped")
+        # Never settled as "conversation" without Cohere
+        self.assertNotIn("conversation", guess_query_types(CONVERSATIONAL_RESEARCH_QUESTIONS))
+
+        with patch("query_classifier.classify_with_cohere",
+                   side_effect=lambda queries: ["search"] * len(queries)) as cohere:
+            labels = classify_queries(CONVERSATIONAL_RESEARCH_QUESTIONS)
+        self.assertEqual(labels, ["search"] * len(CONVERSATIONAL_RESEARCH_QUESTIONS))
+        self.assertTrue(cohere.called)
+        print("Test passed: test_conversational_research_questions_are_not_skipped")
+
+    def test_small_talk_is_checked_by_cohere(self):
+        print("Running test: test_small_talk_is_checked_by_cohere")
+        with patch("query_classifier.classify_with_cohere", return_value=["conversation"]) as cohere:
+            self.assertEqual(classify_queries(["How was your day?"]), ["conversation"])
+        cohere.assert_called_once_with(["How was your day?"])
+        # Cohere's answer is cached, so the next lookup is local
+        self.assertEqual(guess_query_types(["how was your day"]), ["conversation"])
+        print("Test passed: test_small_talk_is_checked_by_cohere")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from unittest.mock import patch
+import rate_limiter
+from rate_limiter import check_rate_limit, rate_limit_headers, max_cost, _GCRA_LUA
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+TIERS = {"default": {"limit": 3, "period": 60}}
+
+class RateLimiterTestCase(unittest.TestCase):
+    def test_allowed_headers(self):
+        print("Running test: test_allowed_headers")
+        # The script answers in milliseconds; headers are whole seconds, rounded up
+        with patch("rate_limiter._GCRA_SCRIPT", return_value=[1, 2, 0, 20001]), \
+                patch("rate_limiter.RATE_LIMIT_TIERS", TIERS):
+            result = check_rate_limit("key")
+        self.assertTrue(result.allowed)
+        self.assertEqual(rate_limit_headers(result), {
+            "X-RateLimit-Limit": "3",
+            "X-RateLimit-Remaining": "2",
+            "X-RateLimit-Reset": "21",
+        })
+        print("Test passed: test_allowed_headers")
+
+    def test_denied_headers(self):
+        print("Running test: test_denied_headers")
+        with patch("rate_limiter._GCRA_SCRIPT", return_value=[0, 0, 19500, 60000]) as script, \
+                patch("rate_limiter.RATE_LIMIT_TIERS", TIERS):
+            result = check_rate_limit("key", cost=2)
+        self.assertFalse(result.allowed)
+        self.assertEqual(script.call_args.kwargs["args"], [20000.0, 3, 2])
+        headers = rate_limit_headers(result)
+        self.assertEqual(headers["Retry-After"], "20")
+        self.assertEqual(headers["X-RateLimit-Remaining"], "0")
+        self.assertEqual(headers["X-RateLimit-Reset"], "60")
+        print("Test passed: test_denied_headers")
+
+    def test_fails_open_without_redis(self):
+        print("Running test: test_fails_open_without_redis")
+        with patch("rate_limiter._GCRA_SCRIPT", side_effect=ConnectionError("redis unavailable")), \
+                patch("rate_limiter.RATE_LIMIT_TIERS", TIERS):
+            result = check_rate_limit("key")
+        self.assertTrue(result.allowed)
+        self.assertNotIn("Retry-After", rate_limit_headers(result))
+        print("Test passed: test_fails_open_without_redis")
+
+    def test_max_cost(self):
+        print("Running test: test_max_cost")
+        with patch("rate_limiter.RATE_LIMIT_TIERS", dict(TIERS, partner={"limit": 10, "period": 60})):
+            self.assertEqual(max_cost(), 3)
+            self.assertEqual(max_cost("partner"), 10)
+            self.assertEqual(max_cost("unknown"), 3)
+        print("Test passed: test_max_cost")
+
+    @unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+    def test_gcra_script(self):
+        print("Running test: test_gcra_script")
+        script = fakeredis.FakeStrictRedis().register_script(_GCRA_LUA)
+        with patch("rate_limiter._GCRA_SCRIPT", script), patch("rate_limiter.RATE_LIMIT_TIERS", TIERS):
+            results = [check_rate_limit("key") for _ in range(3)]
+            denied = check_rate_limit("key")
+            other_key = check_rate_limit("other key")
+        self.assertEqual([result.remaining for result in results], [2, 1, 0])
+        self.assertTrue(all(result.allowed for result in results))
+        self.assertFalse(denied.allowed)
+        # One query is released every 20 seconds
+        self.assertTrue(19 <= denied.retry_after <= 20)
+        self.assertTrue(other_key.allowed)
+        print("Test passed: test_gcra_script")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+import sys
+import os
+import time
+import threading
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from unittest.mock import patch
+import stage_runner
+from readiness import check_readiness
+
+class ReadinessTestCase(unittest.TestCase):
+    def test_ready_while_stage_pool_is_busy(self):
+        print("Running test: test_ready_while_stage_pool_is_busy")
+        release = threading.Event()
+        busy = [stage_runner._executor.submit(release.wait, 5) for _ in range(stage_runner.STAGE_POOL_SIZE)]
+        self.addCleanup(release.set)
+        with patch("readiness.BAYARD_RETRIEVER", "elasticsearch"), \
+                patch("readiness.check_redis", return_value=True), \
+                patch("readiness.check_elasticsearch", return_value=True), \
+                patch("readiness.check_database", return_value=True), \
+                patch("readiness.READY_CHECK_TIMEOUT", 1):
+            start = time.monotonic()
+            checks = check_readiness()
+        self.assertEqual(checks, {"redis": True, "elasticsearch": True, "database": True})
+        self.assertLess(time.monotonic() - start, 0.5)
+        release.set()
+        for future in busy:
+            future.result(5)
+        print("Test passed: test_ready_while_stage_pool_is_busy")
+
+if __name__ == "__main__":
+    unittest.main()
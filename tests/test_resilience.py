@@ -0,0 +1,110 @@
+import unittest
+import sys
+import os
+import time
+import asyncio
+import threading
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from unittest.mock import patch, MagicMock
+from resilience import (CircuitBreaker, CircuitOpenError, CLOSED, HALF_OPEN, OPEN, call, hedged_call,
+                        hedged_call_async, get_breaker, get_tracker)
+
+class UpstreamError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+class ResilienceTestCase(unittest.TestCase):
+    def test_breaker_opens_and_recovers(self):
+        print("Running test: test_breaker_opens_and_recovers")
+        breaker = CircuitBreaker("test-breaker", failure_threshold=2, reset_timeout=0.05)
+        breaker.before_call()
+        breaker.record_failure()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+        time.sleep(0.06)
+        # One trial call is let through, and only one
+        breaker.before_call()
+        self.assertEqual(breaker.state, HALF_OPEN)
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+        breaker.record_success()
+        self.assertEqual(breaker.state, CLOSED)
+        print("Test passed: test_breaker_opens_and_recovers")
+
+    @patch("resilience.retry_delay", return_value=0)
+    def test_only_transient_errors_retried(self, _):
+        print("Running test: test_only_transient_errors_retried")
+        flaky = MagicMock(side_effect=[UpstreamError(503), UpstreamError(429), "hits"])
+        self.assertEqual(call("test-retry", "index", "search", flaky, retries=2), "hits")
+        self.assertEqual(flaky.call_count, 3)
+
+        bad_request = MagicMock(side_effect=UpstreamError(400))
+        with self.assertRaises(UpstreamError):
+            call("test-retry", "index", "search", bad_request, retries=2)
+        bad_request.assert_called_once()
+        # A client error says nothing about the upstream's health
+        self.assertEqual(get_breaker("test-retry").failures, 0)
+        print("Test passed: test_only_transient_errors_retried")
+
+    def test_slow_call_hedged(self):
+        print("Running test: test_slow_call_hedged")
+        tracker = get_tracker("test-hedge", "search")
+        for _ in range(50):
+            tracker.record(0.01)
+        calls = []
+        lock = threading.Lock()
+
+        def search():
+            with lock:
+                calls.append(1)
+                first = len(calls) == 1
+            time.sleep(1.0 if first else 0.01)
+            return "slow" if first else "hedge"
+
+        start = time.perf_counter()
+        self.assertEqual(hedged_call("test-hedge", "index", "search", search), "hedge")
+        self.assertLess(time.perf_counter() - start, 0.5)
+
+        async def search_async():
+            with lock:
+                calls.append(1)
+                first = len(calls) == 3
+            await asyncio.sleep(1.0 if first else 0.01)
+            return "slow" if first else "hedge"
+
+        start = time.perf_counter()
+        self.assertEqual(asyncio.run(hedged_call_async("test-hedge", "index", "search", search_async)), "hedge")
+        self.assertLess(time.perf_counter() - start, 0.5)
+        print("Test passed: test_slow_call_hedged")
+
+    def test_hedged_wait_is_bounded(self):
+        print("Running test: test_hedged_wait_is_bounded")
+        tracker = get_tracker("test-hedge-bounded", "search")
+        for _ in range(50):
+            tracker.record(0.01)
+
+        def search():
+            time.sleep(1.0)
+            return "slow"
+
+        async def search_async():
+            await asyncio.sleep(1.0)
+            return "slow"
+
+        with patch("resilience.HEDGE_MAX_WAIT", 0.2):
+            start = time.perf_counter()
+            with self.assertRaises(TimeoutError):
+                hedged_call("test-hedge-bounded", "index", "search", search, retries=0)
+            self.assertLess(time.perf_counter() - start, 0.5)
+
+            start = time.perf_counter()
+            with self.assertRaises(TimeoutError):
+                asyncio.run(hedged_call_async("test-hedge-bounded", "index", "search", search_async, retries=0))
+            self.assertLess(time.perf_counter() - start, 0.5)
+        print("Test passed: test_hedged_wait_is_bounded")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+import sys
+import os
+import time
+import threading
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from unittest.mock import patch, MagicMock
+import retrieval_cache
+from retrieval_cache import cached_search
+
+class RetrievalCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.redis = MagicMock()
+        self.redis.get.return_value = None
+        patcher = patch("retrieval_cache.redis_client", self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        retrieval_cache._local_cache.clear()
+        retrieval_cache._index_versions.clear()
+
+    def start_leader(self, query, search):
+        thread = threading.Thread(target=lambda: self.leader_results.append(self.call(query, search)))
+        thread.start()
+        self.addCleanup(thread.join, 2)
+        while not retrieval_cache._inflight:
+            time.sleep(0.005)
+
+    def call(self, query, search):
+        try:
+            return cached_search(query, "index", 5, search)
+        except Exception as e:
+            return e
+
+    def test_follower_searches_when_leader_is_slow(self):
+        print("Running test: test_follower_searches_when_leader_is_slow")
+        self.leader_results = []
+        release = threading.Event()
+        self.start_leader("slow query", lambda: release.wait(2) and ["leader"])
+        with patch("retrieval_cache.INFLIGHT_WAIT_TIMEOUT", 0.05):
+            self.assertEqual(cached_search("slow query", "index", 5, lambda: ["follower"]), ["follower"])
+        release.set()
+        print("Test passed: test_follower_searches_when_leader_is_slow")
+
+    def test_follower_searches_when_leader_fails(self):
+        print("Running test: test_follower_searches_when_leader_fails")
+        self.leader_results = []
+        release = threading.Event()
+
+        def failing_search():
+            release.wait(2)
+            raise ConnectionError("elasticsearch unavailable")
+
+        self.start_leader("failing query", failing_search)
+        follower = []
+        thread = threading.Thread(target=lambda: follower.append(cached_search("failing query", "index", 5, lambda: ["follower"])))
+        thread.start()
+        time.sleep(0.05)
+        release.set()
+        thread.join(2)
+        self.assertEqual(follower, [["follower"]])
+        print("Test passed: test_follower_searches_when_leader_fails")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from search_quality import score_search_quality_local
+from openai_utils import parse_reflection_score
+
+class SearchQualityTestCase(unittest.TestCase):
+    def test_local_score_ranks_relevant_results_higher(self):
+        print("Running test: test_local_score_ranks_relevant_results_higher")
+        relevant = [
+            {"title": f"Stonewall riots study {i}", "abstract": "The history of the Stonewall riots in 1969.", "_score": 25.0}
+            for i in range(5)
+        ]
+        irrelevant = [{"title": "Tractor maintenance", "abstract": "Engines and tires.", "_score": 2.0}] * 5
+        good = score_search_quality_local(relevant, "history of the Stonewall riots")
+        bad = score_search_quality_local(irrelevant, "history of the Stonewall riots")
+        self.assertGreaterEqual(good["search_quality_score"], 4)
+        self.assertLessEqual(bad["search_quality_score"], 2)
+        self.assertEqual(score_search_quality_local([], "anything")["search_quality_score"], 1)
+        print("Test passed: test_local_score_ranks_relevant_results_higher")
+
+    def test_reflection_score_parsing(self):
+        print("Running test: test_reflection_score_parsing")
+        self.assertEqual(parse_reflection_score("4 The search results are relevant."), 4)
+        self.assertEqual(parse_reflection_score("<Score 3> Some results are off topic."), 3)
+        self.assertIsNone(parse_reflection_score("Document 2 is the only relevant result."))
+        print("Test passed: test_reflection_score_parsing")
+
+if __name__ == "__main__":
+    unittest.main()
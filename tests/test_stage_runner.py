@@ -0,0 +1,21 @@
+import unittest
+import sys
+import os
+import time
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from stage_runner import Stage, StageTimeoutError, run_stages
+
+class StageRunnerTestCase(unittest.TestCase):
+    def test_single_stage_is_bounded_by_its_timeout(self):
+        print("Running test: test_single_stage_is_bounded_by_its_timeout")
+        start = time.perf_counter()
+        results = run_stages([Stage("slow", time.sleep, 1, timeout=0.1, default="fallback")])
+        self.assertEqual(results["slow"], "fallback")
+        self.assertLess(time.perf_counter() - start, 0.5)
+
+        with self.assertRaises(StageTimeoutError):
+            run_stages([Stage("slow", time.sleep, 1, timeout=0.1, required=True)])
+        print("Test passed: test_single_stage_is_bounded_by_its_timeout")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+import sys
+import os
+import json
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from unittest.mock import patch, MagicMock
+import task_queue
+from task_queue import Worker, enqueue_many, DEAD_LETTER_KEY, PROCESSING_KEY, QUEUE_KEY
+
+class WorkerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.redis = MagicMock()
+        patcher = patch("task_queue.redis_client", self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pipe = self.redis.pipeline.return_value
+
+    def make_worker(self):
+        worker = Worker(concurrency=1)
+        self.addCleanup(worker._executor.shutdown)
+        # Hold the slot as run() does before handing a job to _process
+        worker._slots.acquire()
+        return worker
+
+    def test_unreadable_job_is_dead_lettered(self):
+        print("Running test: test_unreadable_job_is_dead_lettered")
+        worker = self.make_worker()
+        worker._process("not json")
+        self.pipe.lpush.assert_called_once_with(DEAD_LETTER_KEY, "not json")
+        self.pipe.lrem.assert_called_once_with(PROCESSING_KEY, 1, "not json")
+        # The slot was given back
+        self.assertTrue(worker._slots.acquire(timeout=0))
+        print("Test passed: test_unreadable_job_is_dead_lettered")
+
+    def test_failed_bookkeeping_releases_slot(self):
+        print("Running test: test_failed_bookkeeping_releases_slot")
+        worker = self.make_worker()
+        handler = MagicMock()
+        self.redis.hset.side_effect = ConnectionError("redis unavailable")
+        raw_job = json.dumps({"id": "1", "name": "noop", "kwargs": {}, "attempts": 0})
+        with patch.dict(task_queue._handlers, {"noop": handler}):
+            worker._process(raw_job)
+        handler.assert_not_called()
+        self.assertTrue(worker._slots.acquire(timeout=0))
+        print("Test passed: test_failed_bookkeeping_releases_slot")
+
+    def test_loop_survives_redis_errors(self):
+        print("Running test: test_loop_survives_redis_errors")
+        worker = Worker(concurrency=1)
+        calls = []
+
+        def brpoplpush(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 1:
+                raise ConnectionError("redis unavailable")
+            worker.stop()
+            return None
+
+        self.redis.brpoplpush.side_effect = brpoplpush
+        with patch("task_queue._PROMOTE_DELAYED_SCRIPT"), patch("task_queue.WORKER_ERROR_BACKOFF", 0):
+            worker.run()
+        self.assertEqual(len(calls), 2)
+        # Both polls gave their slot back
+        self.assertTrue(worker._slots.acquire(timeout=0))
+        print("Test passed: test_loop_survives_redis_errors")
+
+    def test_enqueue_many_is_one_transaction(self):
+        print("Running test: test_enqueue_many_is_one_transaction")
+        job_ids = enqueue_many([("log_conversation", {"input_text": "q"}), ("store_run", {"run": {}})])
+        self.redis.pipeline.assert_called_once_with(transaction=True)
+        self.assertEqual(self.pipe.lpush.call_count, 2)
+        self.assertEqual(self.pipe.lpush.call_args_list[0].args[0], QUEUE_KEY)
+        self.assertEqual(json.loads(self.pipe.lpush.call_args_list[1].args[1])["name"], "store_run")
+        self.pipe.execute.assert_called_once_with()
+        self.redis.lpush.assert_not_called()
+        self.assertEqual(len(set(job_ids)), 2)
+        print("Test passed: test_enqueue_many_is_one_transaction")
+
+if __name__ == "__main__":
+    unittest.main()
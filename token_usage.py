@@ -0,0 +1,61 @@
+import logging
+import threading
+from contextvars import ContextVar
+from metrics import record_tokens
+
+logger = logging.getLogger(__name__)
+
+# The usage records of the current request; threads started with a copied context share the same list
+_current_usage = ContextVar("token_usage", default=None)
+_lock = threading.Lock()
+
+
+def start_usage_collection():
+    """Begin collecting token usage for a new request."""
+    _current_usage.set([])
+
+
+def record_usage(stage: str, model: str, prompt_tokens: int, completion_tokens: int, estimated: bool = False):
+    """
+    Record the tokens used by one model call.
+
+    Parameters:
+    stage (str): The pipeline stage that made the call.
+    model (str): The model called.
+    prompt_tokens (int): Tokens sent.
+    completion_tokens (int): Tokens generated.
+    estimated (bool): True when the counts were computed locally rather than reported by the API.
+    """
+    record_tokens(stage, model, int(prompt_tokens or 0), int(completion_tokens or 0))
+    usage = _current_usage.get()
+    if usage is None:
+        return
+    with _lock:
+        usage.append({
+            "stage": stage,
+            "model": model,
+            "prompt_tokens": int(prompt_tokens or 0),
+            "completion_tokens": int(completion_tokens or 0),
+            "estimated": estimated,
+        })
+
+
+def get_usage() -> list:
+    usage = _current_usage.get()
+    with _lock:
+        return list(usage or [])
+
+
+def usage_totals() -> dict:
+    usage = get_usage()
+    return {
+        "prompt_tokens": sum(record["prompt_tokens"] for record in usage),
+        "completion_tokens": sum(record["completion_tokens"] for record in usage),
+        "calls": len(usage),
+    }
+
+
+def log_usage():
+    usage = get_usage()
+    if usage:
+        logger.info("Token usage: %s %s", usage_totals(), usage)
@@ -0,0 +1,36 @@
+import argparse
+import multiprocessing
+import tasks  # noqa: F401 - registers the task handlers
+from logging_setup import configure_logging
+from task_queue import run_worker, WORKER_CONCURRENCY
+from bulk_writer import close_writers
+
+# Configure logging
+configure_logging()
+
+
+def run(concurrency):
+    run_worker(concurrency)
+    # multiprocessing children exit without running atexit hooks, so drain the bulk writers here
+    close_writers()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Bayard background task workers.")
+    parser.add_argument("--processes", type=int, default=1, help="Number of worker processes to start.")
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY, help="Maximum jobs in flight per process.")
+    args = parser.parse_args()
+
+    if args.processes == 1:
+        run(args.concurrency)
+        return
+
+    processes = [multiprocessing.Process(target=run, args=(args.concurrency,)) for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()